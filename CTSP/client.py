@@ -1,40 +1,77 @@
+import os
 import socket
 import json
+import zlib
 from terminaltables import AsciiTable
 from colorama import Fore, Back, Style, init
 
 init(autoreset=True)  # Initialize colorama
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ACCEPT_ENCODING = 'zstd, gzip, deflate' if zstandard else 'gzip, deflate'
+
 class CTSClient:
-    def __init__(self, host='localhost', port=6002):
+    def __init__(self, host='localhost', port=6002, admin_token=None):
         self.host = host
         self.port = port
         self.socket = None
         self.logged_in = False
         self.username = None
+        self.session_tokens = {}  # {username: token} ใช้ login ซ้ำหลัง reconnect โดยไม่ต้องรอ KDF
+        self.price_version = None  # version ของราคาที่ response ล่าสุดใช้ (header Price-Version)
+        self.admin_token = admin_token or os.environ.get('CTSP_ADMIN_TOKEN')  # ใช้กับคำขอ /admin
 
     def connect(self):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.connect((self.host, self.port))
 
-    def send_request(self, method, resource, body=None):
+    def send_request(self, method, resource, body=None, headers=None):
         if not self.socket:
             self.connect()
 
         request = f"CTSP/1.0 {method} {resource}\n"
+        request += f"Accept-Encoding: {ACCEPT_ENCODING}\n"
+        for name, value in (headers or {}).items():
+            request += f"{name}: {value}\n"
         if body:
-            request += f"Content-Length: {len(body)}\n\n{body}"
+            request += f"Content-Length: {len(body.encode())}\n\n{body}"
         else:
             request += "\n"
 
-        self.socket.send(request.encode())
-        response = self.socket.recv(1024).decode()
+        self.socket.sendall(request.encode())
 
         # Parse the response
-        lines = response.split('\n')
-        status_line = lines[0].split()
-        status_code = int(status_line[1])
-        body = lines[-1]
+        response = b''
+        while b'\n\n' not in response:
+            chunk = self.socket.recv(4096)
+            if not chunk:
+                raise ConnectionError("Connection closed by server")
+            response += chunk
+        head, data = response.split(b'\n\n', 1)
+        lines = head.decode().split('\n')
+        status_code = int(lines[0].split()[1])
+        headers = dict(line.split(': ', 1) for line in lines[1:])
+        content_length = int(headers.get('Content-Length', 0))
+        if 'Price-Version' in headers:
+            self.price_version = int(headers['Price-Version'])
+        while len(data) < content_length:
+            chunk = self.socket.recv(content_length - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed by server")
+            data += chunk
+
+        encoding = headers.get('Content-Encoding')
+        if encoding == 'zstd':
+            data = zstandard.ZstdDecompressor().decompress(data)
+        elif encoding == 'gzip':
+            data = zlib.decompress(data, 31)
+        elif encoding == 'deflate':
+            data = zlib.decompress(data)
+        body = data.decode()
 
         return status_code, body
 
@@ -46,13 +83,18 @@ class CTSClient:
         return status_code, body
 
     def login(self, username, password):
-        status_code, body = self.send_request('LOGIN', '/auth', json.dumps({
-            'username': username,
-            'password': password
-        }))
+        credentials = {'username': username, 'password': password}
+        if username in self.session_tokens:
+            credentials['token'] = self.session_tokens[username]
+        status_code, body = self.send_request('LOGIN', '/auth', json.dumps(credentials))
         if status_code == 200:
             self.logged_in = True
             self.username = username
+            result = json.loads(body)
+            self.session_tokens[username] = result['token']
+            body = result['message']
+        else:
+            self.session_tokens.pop(username, None)
         return status_code, body
 
     def logout(self):
@@ -60,6 +102,7 @@ class CTSClient:
             status_code, body = self.send_request('LOGOUT', '/auth')
             if status_code == 200:
                 self.logged_in = False
+                self.session_tokens.pop(self.username, None)
                 self.username = None
             return status_code, body
         return 400, "Not logged in"
@@ -70,11 +113,64 @@ class CTSClient:
             return json.loads(prices)
         return None
 
-    def trade(self, trade_type, coin, amount):
+    def get_candles(self, coin, interval='1m', start=None, end=None, limit=None):
+        query = {'coin': coin, 'interval': interval}
+        if start is not None:
+            query['start'] = start
+        if end is not None:
+            query['end'] = end
+        if limit is not None:
+            query['limit'] = limit
+        status, candles = self.send_request('GET_CANDLES', '/market', json.dumps(query))
+        if status == 200:
+            return json.loads(candles)
+        return None
+
+    def trade(self, trade_type, coin, amount, idempotency_key=None):
+        # ส่ง idempotency_key เดิมตอน retry server จะตอบผลเดิมแทนการซื้อขายซ้ำ
         return self.send_request(trade_type, '/trade', json.dumps({
             'coin': coin,
             'amount': float(amount)
+        }), self._idempotency_headers(idempotency_key))
+
+    def trade_batch(self, trades, atomic=False, idempotency_key=None):
+        # trades: [(trade_type, coin, amount), ...] ส่งรวดเดียวแทนการส่งทีละคำขอ
+        status, body = self.send_request('BATCH', '/trade', json.dumps({
+            'trades': [{'type': trade_type, 'coin': coin, 'amount': float(amount)} for trade_type, coin, amount in trades],
+            'atomic': atomic
+        }), self._idempotency_headers(idempotency_key))
+        if status in (200, 400) and body.startswith('{'):
+            return status, json.loads(body)
+        return status, body
+
+    @staticmethod
+    def _idempotency_headers(idempotency_key):
+        return {'Idempotency-Key': idempotency_key} if idempotency_key else None
+
+    def place_order(self, kind, trade_type, coin, amount, trigger):
+        # kind: limit, stop_loss หรือ take_profit คำสั่งจะรอจนราคาวิ่งถึง trigger แล้วซื้อขายให้เอง
+        status, body = self.send_request('PLACE_ORDER', '/orders', json.dumps({
+            'kind': kind,
+            'type': trade_type,
+            'coin': coin,
+            'amount': float(amount),
+            'trigger': float(trigger)
         }))
+        if status == 200:
+            return status, json.loads(body)
+        return status, body
+
+    def cancel_order(self, order_id):
+        status, body = self.send_request('CANCEL_ORDER', '/orders', json.dumps({'order_id': order_id}))
+        if status == 200:
+            return status, json.loads(body)
+        return status, body
+
+    def get_orders(self):
+        status, orders = self.send_request('GET_ORDERS', '/orders')
+        if status == 200:
+            return json.loads(orders)
+        return None
 
     def get_portfolio(self):
         status, portfolio = self.send_request('GET_PORTFOLIO', '/portfolio')
@@ -93,6 +189,17 @@ class CTSClient:
         if status == 200:
             return json.loads(report)
         return None
+
+    def get_stats(self, prometheus=False):
+        body = json.dumps({'format': 'prometheus'}) if prometheus else None
+        status, stats = self.send_request('GET_STATS', '/admin', body, self._admin_headers())
+        if status == 200:
+            return stats if prometheus else json.loads(stats)
+        return None
+
+    def _admin_headers(self):
+        return {'Admin-Token': self.admin_token} if self.admin_token else None
+
     def get_leaderboard(self):
         status, leaderboard = self.send_request('GET_LEADERBOARD', '/leaderboard')
         if status == 200:
@@ -1,26 +1,266 @@
 import socket
-import json
 import threading
 import time
+import os
+import sys
+import hashlib
+import hmac
 from datetime import datetime
-import random
-from typing import Dict, List, Any
+import zlib
+import heapq
+import math
+import itertools
+from collections import OrderedDict, deque
+from types import MappingProxyType
+from typing import Dict, List, Any, Optional, Tuple, Union, TypedDict, Mapping
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.market import CandleStore, MarketSimulator, parse_candle_query
+from common.auth import DUMMY_PASSWORD_HASH, SessionCache, hash_password, is_admin_token, verify_password
+from common.codec import codec
+from common.response import response_head, send_parts
+from common.profiler import PROFILE_INTERVAL, SamplingProfiler
+from common.stats import ServerStats
+from common.idempotency import IDEMPOTENCY_KEY_LIMIT, IdempotencyEntry, IdempotencyStore
+
+COMPRESS_MIN_SIZE = 512  # body ที่เล็กกว่านี้ส่งแบบไม่บีบอัด
+COMPRESSION_CACHE_SIZE = 128
+COMPRESSION_CACHE_MAX_BODY = 64 * 1024  # body ที่ใหญ่กว่านี้บีบอัดทุกครั้ง ไม่เก็บใน cache
+SUPPORTED_ENCODINGS = ('zstd', 'gzip', 'deflate') if zstandard else ('gzip', 'deflate')
+CONTENT_ENCODING_HEADERS = {encoding: f"Content-Encoding: {encoding}\n".encode() for encoding in SUPPORTED_ENCODINGS}
+PRICE_VERSION_HEADER = b"Price-Version: %d\n"
+MAX_HEADER_SIZE = 8 * 1024
+MAX_REQUEST_SIZE = 1024 * 1024  # header + body ต่อคำขอ BATCH เต็ม 1000 รายการยังไม่ถึง 100 KB
+RECV_SIZE = 65536
+
+Response = Tuple[int, bytes, Optional[int]]  # (status code, body ที่ encode แล้ว, price version ที่ใช้ตอบ หรือ None)
+
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class TradeRequest(TypedDict):
+    coin: str
+    amount: float
+
+REQUEST_DECODERS = {
+    ('BUY', '/trade'): codec.decoder(TradeRequest),
+    ('SELL', '/trade'): codec.decoder(TradeRequest)
+}
+
+PRICE_TICK_INTERVAL = 5  # วินาทีต่อ tick ไม่ขึ้นกับจำนวนเหรียญ
+
+class PriceSnapshot:
+    # ราคาทุกเหรียญ ณ tick หนึ่ง สร้างแล้วไม่มีใครแก้ tick ใหม่สร้าง snapshot ใหม่แล้วสลับ reference ทีเดียว
+    # request อ่าน self.snapshot ครั้งเดียวแล้วใช้ตัวนั้นตลอด จึงเห็นราคาชุดเดียวกันทั้งหมดโดยไม่ต้องล็อก
+    __slots__ = ('version', 'timestamp', 'prices', 'body')
+
+    def __init__(self, version: int, prices: Dict[str, float], timestamp: Optional[float] = None):
+        prices = dict(prices)
+        self.version = version
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.prices: Mapping[str, float] = MappingProxyType(prices)
+        self.body = codec.encode(prices)  # body ของ GET_PRICES encode ครั้งเดียวต่อ version
+
+KDF_WORKERS = 4  # จำนวน KDF ที่คำนวณพร้อมกันได้ thread อื่นที่ login รอคิว
+BATCH_TRADE_LIMIT = 1000  # จำนวน trade สูงสุดต่อ BATCH /trade
+ADMIN_TOKEN = os.environ.get('CTSP_ADMIN_TOKEN', '')  # request ไป /admin ต้องส่ง Admin-Token ตรงกับค่านี้ ไม่ตั้งก็ปิด /admin
+ADMIN_REQUESTS = {('GET_STATS', '/admin'), ('PROFILE', '/admin')}
+
+class IdempotencyCache(IdempotencyStore):
+    # รอคำขอแรกด้วย condition ตัวเดียวทั้ง cache แทน Event ต่อ entry คำขอที่ซ้ำกันขณะทำอยู่เกิดน้อย
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = threading.Condition()
+
+    def claim(self, username: str, key: str, fingerprint: bytes) -> Tuple[IdempotencyEntry, bool]:
+        # คืน (entry, True) ถ้าผู้เรียกต้องทำคำขอเอง ไม่งั้นรอจนคำขอแรกเสร็จแล้วคืน entry ของคำขอนั้น
+        with self.changed:
+            entry = self.find(username, key)
+            while entry is not None and entry.pending:
+                self.changed.wait()
+            return self.resolve(username, key, entry, fingerprint)
+
+    def complete(self, entry: IdempotencyEntry, response: Response):
+        with self.changed:
+            super().complete(entry, response)
+            self.changed.notify_all()
+
+    def discard(self, username: str, key: str, entry: IdempotencyEntry):
+        with self.changed:
+            super().discard(username, key, entry)
+            self.changed.notify_all()
+
+ORDER_KINDS = ('limit', 'stop_loss', 'take_profit')
+# ทิศที่ราคาต้องวิ่งไปถึง trigger คำสั่งจึงทำงาน below = ราคาลงถึง trigger above = ราคาขึ้นถึง trigger
+TRIGGER_DIRECTIONS = {
+    ('limit', 'buy'): 'below', ('limit', 'sell'): 'above',
+    ('take_profit', 'buy'): 'below', ('take_profit', 'sell'): 'above',
+    ('stop_loss', 'buy'): 'above', ('stop_loss', 'sell'): 'below'
+}
+OPEN_ORDER_LIMIT = 1000  # คำสั่งที่รออยู่ได้สูงสุดต่อผู้ใช้
+ORDER_HISTORY_LIMIT = 100  # คำสั่งที่ปิดแล้วต่อผู้ใช้ที่เก็บไว้ให้ GET_ORDERS
+ORDER_COMPACT_MIN = 1024  # สร้าง heap ใหม่เมื่อคำสั่งที่ยกเลิกแล้วค้างใน heap เกินนี้และเกินจำนวนที่ยังรออยู่
+
+class ConditionalOrder:
+    __slots__ = ('order_id', 'username', 'kind', 'type', 'coin', 'amount', 'trigger', 'direction',
+                 'status', 'created', 'fill_price', 'price_version', 'error')
+
+    def __init__(self, username: str, kind: str, trade_type: str, coin: str, amount: float, trigger: float):
+        self.order_id = 0
+        self.username = username
+        self.kind = kind
+        self.type = trade_type
+        self.coin = coin
+        self.amount = amount
+        self.trigger = trigger
+        self.direction = TRIGGER_DIRECTIONS[(kind, trade_type)]
+        self.status = 'open'  # open -> triggered -> filled / rejected หรือ open -> cancelled
+        self.created = time.time()
+        self.fill_price: Optional[float] = None
+        self.price_version: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'order_id': self.order_id,
+            'kind': self.kind,
+            'type': self.type,
+            'coin': self.coin,
+            'amount': self.amount,
+            'trigger': self.trigger,
+            'status': self.status,
+            'created': self.created,
+            'fill_price': self.fill_price,
+            'price_version': self.price_version,
+            'error': self.error
+        }
+
+class OrderBook:
+    # คำสั่งที่รอราคาแยก heap ตามเหรียญและทิศ below เป็น max-heap ของ trigger (เก็บค่าติดลบ) above เป็น min-heap
+    # ต่อ tick ดูแค่หัว heap ของแต่ละเหรียญแล้ว pop เฉพาะคำสั่งที่ราคาข้ามแล้ว คำสั่งที่ยังไม่ถึงไม่ถูกแตะเลย
+    # ยกเลิกแบบ lazy คือเปลี่ยนสถานะไว้ แล้วทิ้งตอนหลุดออกมาจาก heap หรือตอน compact
+    def __init__(self):
+        self.below: Dict[str, list] = {}  # {coin: [(-trigger, order_id, order)]}
+        self.above: Dict[str, list] = {}  # {coin: [(trigger, order_id, order)]}
+        self.open: Dict[str, Dict[int, ConditionalOrder]] = {}  # {username: {order_id: order}}
+        self.closed: Dict[str, deque] = {}
+        self.count = 0
+        self.stale = 0
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def add(self, order: ConditionalOrder, limit: int = OPEN_ORDER_LIMIT) -> Optional[ConditionalOrder]:
+        with self.lock:
+            orders = self.open.setdefault(order.username, {})
+            if len(orders) >= limit:
+                return None
+            order.order_id = next(self.ids)
+            orders[order.order_id] = order
+            self.count += 1
+            if order.direction == 'below':
+                heapq.heappush(self.below.setdefault(order.coin, []), (-order.trigger, order.order_id, order))
+            else:
+                heapq.heappush(self.above.setdefault(order.coin, []), (order.trigger, order.order_id, order))
+        return order
+
+    def cancel(self, username: str, order_id: int) -> Optional[ConditionalOrder]:
+        with self.lock:
+            order = self.open.get(username, {}).pop(order_id, None)
+            if order is None:
+                return None
+            order.status = 'cancelled'
+            self.count -= 1
+            self.stale += 1
+            self._close(order)
+            if self.stale > max(self.count, ORDER_COMPACT_MIN):
+                self._compact()
+        return order
+
+    def triggered(self, prices: Mapping[str, float]) -> List[ConditionalOrder]:
+        fired = []
+        with self.lock:
+            for heaps, sign in ((self.below, -1), (self.above, 1)):
+                for coin, heap in heaps.items():
+                    price = prices.get(coin)
+                    if price is None:
+                        continue
+                    key = sign * price
+                    while heap and heap[0][0] <= key:
+                        order = heapq.heappop(heap)[2]
+                        if order.status != 'open':
+                            self.stale -= 1
+                            continue
+                        del self.open[order.username][order.order_id]
+                        order.status = 'triggered'
+                        self.count -= 1
+                        fired.append(order)
+        return fired
+
+    def close(self, order: ConditionalOrder):
+        with self.lock:
+            self._close(order)
+
+    def orders_of(self, username: str) -> Dict[str, List[Dict[str, Any]]]:
+        with self.lock:
+            return {
+                'open': [order.to_dict() for order in self.open.get(username, {}).values()],
+                'closed': [order.to_dict() for order in reversed(self.closed.get(username, ()))]
+            }
+
+    def _close(self, order: ConditionalOrder):
+        history = self.closed.get(order.username)
+        if history is None:
+            history = self.closed[order.username] = deque(maxlen=ORDER_HISTORY_LIMIT)
+        history.append(order)
+
+    def _compact(self):
+        for heaps in (self.below, self.above):
+            for coin, heap in heaps.items():
+                heaps[coin] = [entry for entry in heap if entry[2].status == 'open']
+                heapq.heapify(heaps[coin])
+        self.stale = 0
 
 class CTSServer:
-    def __init__(self, host: str = 'localhost', port: int = 6002):
+    def __init__(self, host: str = 'localhost', port: int = 6002, simulator: Optional[MarketSimulator] = None):
         self.host = host
         self.port = port
         self.server_socket  = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.clients: Dict[int, Dict[str, Any]] = {}
-        self.prices: Dict[str, float] = {'AA': 100.0, 'BB': 200.0, 'CC': 300.0}
+        # ส่ง simulator ของตัวเองเข้ามาได้ เช่น MarketSimulator.generate(5000, seed=1) ตอน load test
+        self.simulator = simulator or MarketSimulator({'AA': 100.0, 'BB': 200.0, 'CC': 300.0})
+        self.snapshot = PriceSnapshot(0, self.simulator.prices())
         self.users: Dict[str, Dict[str, Any]] = {
             'beer': {
-                'password': '1234',
+                'password': hash_password('1234'),
                 'portfolio': {'AA': 10, 'BB': 20, 'CC': 30},
-                'balance': 5000
+                'balance': 5000,
+                'lock': threading.Lock()
             },
         }
         self.transactions: List[Dict[str, Any]] = []
+        self.candles = CandleStore(self.prices)
+        self.candles.add_ticks(self.prices)
+        self.compression_cache: OrderedDict = OrderedDict()  # {(encoding, body): compressed}
+        self.compression_lock = threading.Lock()
+        self.stats = ServerStats()
+        self.profiler = SamplingProfiler()
+        # pbkdf2_hmac ปล่อย GIL ระหว่างคำนวณ แต่จำกัดจำนวนที่คำนวณพร้อมกันไม่ให้ login storm กิน CPU ทุก core
+        self.kdf_slots = threading.BoundedSemaphore(KDF_WORKERS)
+        self.sessions = SessionCache()
+        self.idempotency = IdempotencyCache()
+        self.order_book = OrderBook()
+
+    @property
+    def prices(self) -> Mapping[str, float]:
+        # ราคาของ snapshot ล่าสุด handler ที่ใช้ราคาหลายครั้งควรอ่าน self.snapshot เก็บไว้เองครั้งเดียว
+        return self.snapshot.prices
 
     def start(self):
         self.server_socket.bind((self.host, self.port))
@@ -46,51 +286,211 @@ class CTSServer:
     def _handle_client(self, client_socket):
         client_id = id(client_socket)
         self.clients[client_id] = {'socket': client_socket, 'user': None}
+        self.stats.connection_opened()
+        buffer = b''
         try:
             while True:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
+                request, buffer = self._read_request(client_socket, buffer)
+                if request is None:
                     break
-                response = self._process_request(client_id, data)
-                client_socket.send(response.encode('utf-8'))
+                send_parts(client_socket, self._process_request(client_id, request.decode('utf-8')))
+        except BadRequest as e:
+            # ขอบเขตของคำขอถัดไปใน stream ไม่แน่นอนแล้ว ตอบแล้วปิด connection
+            send_parts(client_socket, self._encode_response(self._create_response(e.status, str(e)), ''))
         except Exception as e:
             print(f"Error handling client: {e}")
         finally:
             del self.clients[client_id]
+            self.stats.connection_closed()
             client_socket.close()
 
-    def _process_request(self, client_id: int, data: str) -> str:
+    @staticmethod
+    def _read_request(client_socket, buffer: bytes) -> Tuple[Optional[bytes], bytes]:
+        # อ่านจนครบ header แล้วอ่าน body ตาม Content-Length คำขอที่ใหญ่กว่าหนึ่ง recv (เช่น batch) จึงไม่ถูกตัด
+        # อ่านทีละไม่เกิน RECV_SIZE และจำกัดขนาดรวม peer จึงสั่งให้จอง memory ตาม Content-Length ที่อ้างมาไม่ได้
+        while b'\n\n' not in buffer:
+            if len(buffer) > MAX_HEADER_SIZE:
+                raise BadRequest(413, "Request headers too large")
+            chunk = client_socket.recv(RECV_SIZE)
+            if not chunk:
+                return None, b''
+            buffer += chunk
+        head, rest = buffer.split(b'\n\n', 1)
+        if len(head) > MAX_HEADER_SIZE:
+            raise BadRequest(413, "Request headers too large")
+        length = 0
+        for line in head.split(b'\n')[1:]:
+            key, _, value = line.partition(b': ')
+            if key == b'Content-Length':
+                try:
+                    length = int(value)
+                except ValueError:
+                    raise BadRequest(400, "Invalid Content-Length")
+        if length < 0:
+            raise BadRequest(400, "Invalid Content-Length")
+        if length > MAX_REQUEST_SIZE - len(head):
+            raise BadRequest(413, f"Request limited to {MAX_REQUEST_SIZE} bytes")
+        if len(rest) < length:
+            rest = bytearray(rest)
+            while len(rest) < length:
+                chunk = client_socket.recv(min(RECV_SIZE, length - len(rest)))
+                if not chunk:
+                    return None, b''
+                rest += chunk
+            rest = bytes(rest)
+        return head + b'\n\n' + rest[:length], rest[length:]
+
+    def _process_request(self, client_id: int, data: str) -> List[bytes]:
+        started = time.perf_counter()
+        accept_encoding = ''
+        idempotency_key = None
+        admin_token = None
+        handler_name = 'unknown'  # method ที่ไม่รู้จักรวมไว้ชื่อเดียว label จะได้ไม่บวมตามที่ client ส่งมา
         try:
             lines = data.split('\n')
             request_line = lines[0].split()
             method, resource = request_line[1], request_line[2]
             body = lines[-1] if len(lines) > 1 else ''
+            for line in lines[1:]:
+                if not line:
+                    break
+                key, _, value = line.partition(': ')
+                if key == 'Accept-Encoding':
+                    accept_encoding = value
+                elif key == 'Idempotency-Key':
+                    idempotency_key = value
+                elif key == 'Admin-Token':
+                    admin_token = value
 
             request_handlers = {
                 ('REGISTER', '/auth'): self._register_user,
                 ('LOGIN', '/auth'): self._login_user,
                 ('LOGOUT', '/auth'): self._logout_user,
                 ('GET_PRICES', '/market'): self._get_prices,
+                ('GET_CANDLES', '/market'): self._get_candles,
                 ('BUY', '/trade'): self._process_buy,
                 ('SELL', '/trade'): self._process_sell,
+                ('BATCH', '/trade'): self._process_batch,
                 ('GET_PORTFOLIO', '/portfolio'): self._get_portfolio,
                 ('GET_HISTORY', '/history'): self._get_history,
                 ('GET_REPORT', '/report'): self._get_report,
-                ('GET_LEADERBOARD', '/leaderboard'): self._get_leaderboard  # เพิ่มตัวจัดการคำขอสำหรับ Leaderboard
+                ('PLACE_ORDER', '/orders'): self._place_order,
+                ('CANCEL_ORDER', '/orders'): self._cancel_order,
+                ('GET_ORDERS', '/orders'): self._get_orders,
+                ('GET_LEADERBOARD', '/leaderboard'): self._get_leaderboard,  # เพิ่มตัวจัดการคำขอสำหรับ Leaderboard
+                ('GET_STATS', '/admin'): self._get_stats,
+                ('PROFILE', '/admin'): self._profile
             }
 
             handler = request_handlers.get((method, resource))
             if handler:
-                return handler(client_id, json.loads(body) if body else None)
+                handler_name = f"{method} {resource}"
+                if (method, resource) in ADMIN_REQUESTS and not is_admin_token(admin_token, ADMIN_TOKEN):
+                    response = self._create_response(403, "Admin token required")
+                elif idempotency_key is not None and resource == '/trade' and self.clients[client_id]['user']:
+                    response = self._process_idempotent(client_id, idempotency_key, handler, method, resource, body)
+                else:
+                    response = handler(client_id, self._decode_body(method, resource, body))
             else:
-                return self._create_response(400, "Bad Request")
+                response = self._create_response(400, "Bad Request")
+        except BadRequest as e:
+            response = self._create_response(e.status, str(e))
         except Exception as e:
-            return self._create_response(500, f"Internal Server Error: {str(e)}")
+            response = self._create_response(500, f"Internal Server Error: {str(e)}")
+        parts = self._encode_response(response, accept_encoding)
+        self.stats.record(handler_name, time.perf_counter() - started, response[0] >= 400, len(data), len(parts[0]) + len(parts[1]))
+        return parts
+
+    @staticmethod
+    def _decode_body(method: str, resource: str, body: str) -> Any:
+        if not body:
+            return None
+        try:
+            return REQUEST_DECODERS.get((method, resource), codec.decode)(body)
+        except ValueError as e:  # JSON เสียหรือ type ไม่ตรง schema ของ msgspec
+            raise BadRequest(400, f"Invalid body: {e}")
+
+    def _process_idempotent(self, client_id: int, key: str, handler, method: str, resource: str, body: str) -> Response:
+        # retry หลัง timeout ที่ส่ง Idempotency-Key เดิมได้คำตอบเดิมโดยไม่ทำ trade ซ้ำ
+        if not key or len(key) > IDEMPOTENCY_KEY_LIMIT:
+            return self._create_response(400, f"Idempotency-Key must be 1-{IDEMPOTENCY_KEY_LIMIT} characters")
+        username = self.clients[client_id]['user']
+        fingerprint = hashlib.sha256(f"{method}\n{body}".encode()).digest()
+        entry, owner = self.idempotency.claim(username, key, fingerprint)
+        if not owner:
+            if not hmac.compare_digest(entry.fingerprint, fingerprint):
+                return self._create_response(400, "Idempotency-Key reused for a different request")
+            return entry.response
+        try:
+            response = handler(client_id, self._decode_body(method, resource, body))
+        except Exception:
+            self.idempotency.discard(username, key, entry)
+            raise
+        self.idempotency.complete(entry, response)
+        return response
+
+    def _encode_response(self, response: Response, accept_encoding: str) -> List[bytes]:
+        # คืน [header, body] แยกกัน ส่งด้วย sendmsg โดยไม่ต้องต่อ body เข้ากับ header
+        status_code, data, price_version = response
+        headers = b''
+        if price_version is not None:
+            headers += PRICE_VERSION_HEADER % price_version
+        encoding = self._choose_encoding(accept_encoding) if len(data) >= COMPRESS_MIN_SIZE else None
+        if encoding:
+            compressed = self._compress(data, encoding)
+            if len(compressed) < len(data):
+                data = compressed
+                headers += CONTENT_ENCODING_HEADERS[encoding]
+        return [response_head(status_code, headers, len(data)), data]
 
-    def _get_leaderboard(self, client_id: int, _: None) -> str:
+    @staticmethod
+    def _choose_encoding(accept_encoding: str) -> Optional[str]:
+        accepted = {}
+        for item in accept_encoding.split(','):
+            name, _, params = item.partition(';')
+            params = params.strip()
+            q = 1.0
+            if params.startswith('q='):
+                try:
+                    q = float(params[2:])
+                except ValueError:
+                    q = 0.0
+            accepted[name.strip().lower()] = q
+        for encoding in SUPPORTED_ENCODINGS:
+            if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+                return encoding
+        return None
+
+    def _compress(self, data: bytes, encoding: str) -> bytes:
+        # GET_PRICES / GET_LEADERBOARD ให้ body เดิมซ้ำจนกว่าราคาจะเปลี่ยน จึงเก็บผลบีบอัดไว้ใช้ซ้ำ
+        # body ใหญ่เช่น GET_HISTORY ยาว ๆ มักไม่ซ้ำ ถ้าเก็บไว้ cache จะกิน memory ได้ถึง COMPRESSION_CACHE_SIZE เท่าของ body
+        cacheable = len(data) <= COMPRESSION_CACHE_MAX_BODY
+        key = (encoding, data)
+        if cacheable:
+            with self.compression_lock:
+                compressed = self.compression_cache.get(key)
+                if compressed is not None:
+                    self.compression_cache.move_to_end(key)
+                    return compressed
+        if encoding == 'zstd':
+            compressed = zstandard.ZstdCompressor().compress(data)
+        else:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+            compressed = compressor.compress(data) + compressor.flush()
+        if not cacheable:
+            return compressed
+        with self.compression_lock:
+            self.compression_cache[key] = compressed
+            if len(self.compression_cache) > COMPRESSION_CACHE_SIZE:
+                self.compression_cache.popitem(last=False)
+        return compressed
+
+    def _get_leaderboard(self, client_id: int, _: None) -> Response:
+        snapshot = self.snapshot
+        prices = snapshot.prices
         leaderboard = []
         for username, user_data in self.users.items():
-            total_value = user_data['balance'] + sum(user_data['portfolio'][coin] * self.prices[coin] for coin in self.prices)
+            total_value = user_data['balance'] + sum(amount * prices.get(coin, 0.0) for coin, amount in user_data['portfolio'].items())
             profit_loss = total_value - 10000  # สมมติว่าเงินเริ่มต้นคือ 10000
             leaderboard.append({
                 'username': username,
@@ -100,119 +500,331 @@ class CTSServer:
             leaderboard.sort(key=lambda x: x['profit_loss'], reverse=True)
             top_10 = leaderboard[:10]
         
-        return self._create_response(200, json.dumps(top_10))
+        return self._create_response(200, codec.encode(top_10), snapshot.version)
+
+    def _get_stats(self, client_id: int, query: Optional[Dict[str, Any]]) -> Response:
+        if query and query.get('format') == 'prometheus':
+            return self._create_response(200, self.stats.prometheus())
+        return self._create_response(200, codec.encode(self.stats.snapshot()))
+
+    def _profile(self, client_id: int, options: Optional[Dict[str, Any]]) -> Response:
+        options = options or {}
+        action = options.get('action', 'status')
+        if action == 'start':
+            try:
+                duration = float(options.get('duration', 30))
+                interval = float(options.get('interval_ms', PROFILE_INTERVAL * 1000)) / 1000
+                started = self.profiler.start(duration, interval, bool(options.get('memory', False)))
+            except (TypeError, ValueError):
+                return self._create_response(400, "duration and interval_ms must be positive numbers")
+            if not started:
+                return self._create_response(400, "Profiler already running")
+            return self._create_response(200, "Profiler started")
+        if action == 'stop':
+            result = self.profiler.stop()
+            if result is None:
+                return self._create_response(400, "Profiler has not run")
+            return self._create_response(200, codec.encode(result))
+        if action == 'status':
+            return self._create_response(200, codec.encode({'running': self.profiler.running(), 'result': self.profiler.result}))
+        return self._create_response(400, "Invalid action, use start, stop or status")
 
-    def _register_user(self, client_id: int, user_data: Dict[str, str]) -> str:
-        print(user_data)
-        print(self.users)
+    def _register_user(self, client_id: int, user_data: Dict[str, str]) -> Response:
         username = user_data['username']
         if username in self.users:
             return self._create_response(400, "Username already exists")
+        with self.kdf_slots:
+            password_hash = hash_password(user_data['password'])
+        if username in self.users:  # มีคน register ชื่อเดียวกันระหว่างรอ KDF
+            return self._create_response(400, "Username already exists")
         self.users[username] = {
-            'password': user_data['password'],
+            'password': password_hash,
             'portfolio': {'AA': 0, 'BB': 0, 'CC': 0},
-            'balance': 10000  # Starting balance
+            'balance': 10000,  # Starting balance
+            'lock': threading.Lock()
         }
         return self._create_response(200, "User registered successfully")
 
-    def _login_user(self, client_id: int, login_data: Dict[str, str]) -> str:
+    def _login_user(self, client_id: int, login_data: Dict[str, str]) -> Response:
         username = login_data['username']
-        password = login_data['password']
-        if username in self.users and self.users[username]['password'] == password:
-            self.clients[client_id]['user'] = username
-            return self._create_response(200, "Login successful")
-        return self._create_response(401, "Invalid credentials")
+        token = login_data.get('token')
+        # token ที่ยังไม่หมดอายุ (เช่นตอน reconnect) ข้าม KDF ไปเลย
+        if not (token and self.sessions.check(token, username)):
+            user = self.users.get(username)
+            password = login_data.get('password')
+            if password is None:
+                return self._create_response(401, "Invalid credentials")
+            with self.kdf_slots:
+                valid = verify_password(password, user['password'] if user else DUMMY_PASSWORD_HASH)
+            if not (valid and user):
+                return self._create_response(401, "Invalid credentials")
+            token = self.sessions.issue(username)
+        self.clients[client_id]['user'] = username
+        self.clients[client_id]['token'] = token
+        return self._create_response(200, codec.encode({"message": "Login successful", "token": token}))
 
-    def _logout_user(self, client_id: int, _: None) -> str:
+    def _logout_user(self, client_id: int, _: None) -> Response:
         if self.clients[client_id]['user']:
             self.clients[client_id]['user'] = None
+            self.sessions.revoke(self.clients[client_id].pop('token', None))
             return self._create_response(200, "Logout successful")
         return self._create_response(400, "No user logged in")
 
-    def _get_prices(self, client_id: int, _: None) -> str:
-        return self._create_response(200, json.dumps(self.prices))
+    def _get_prices(self, client_id: int, _: None) -> Response:
+        snapshot = self.snapshot
+        return self._create_response(200, snapshot.body, snapshot.version)
 
-    def _process_buy(self, client_id: int, trade_data: Dict[str, Any]) -> str:
+    def _get_candles(self, client_id: int, query: Dict[str, Any]) -> Response:
+        try:
+            coin, interval, start, end, limit = parse_candle_query(query or {}, self.prices)
+        except ValueError as e:
+            return self._create_response(400, str(e))
+        candles = self.candles.query(coin, interval, start, end, limit)
+        return self._create_response(200, codec.encode({
+            'coin': coin,
+            'interval': interval,
+            'fields': ['time', 'open', 'high', 'low', 'close', 'volume'],
+            'candles': candles
+        }))
+
+    def _process_buy(self, client_id: int, trade_data: Dict[str, Any]) -> Response:
         return self._process_trade(client_id, trade_data, 'buy')
 
-    def _process_sell(self, client_id: int, trade_data: Dict[str, Any]) -> str:
+    def _process_sell(self, client_id: int, trade_data: Dict[str, Any]) -> Response:
         return self._process_trade(client_id, trade_data, 'sell')
 
-    def _process_trade(self, client_id: int, trade_data: Dict[str, Any], trade_type: str) -> str:
+    def _process_trade(self, client_id: int, trade_data: Dict[str, Any], trade_type: str) -> Response:
         username = self.clients[client_id]['user']
         if not username:
             return self._create_response(401, "User not logged in")
         
-        coin = trade_data['coin']
-        amount = trade_data['amount']
-        price = self.prices[coin]
-        total_cost = amount * price
-        
-        user = self.users[username]
-        if trade_type == 'buy':
-            if user['balance'] < total_cost:
-                return self._create_response(400, "Insufficient funds")
-            user['balance'] -= total_cost
-            user['portfolio'][coin] += amount
-        else:  # sell
-            if user['portfolio'][coin] < amount:
-                return self._create_response(400, "Insufficient coins")
-            user['balance'] += total_cost
-            user['portfolio'][coin] -= amount
+        trade_data = trade_data or {}
+        coin = trade_data.get('coin')
+        amount = trade_data.get('amount')
+        snapshot = self.snapshot
+        price = snapshot.prices.get(coin) if isinstance(coin, str) else None
         
-        self._record_transaction(username, trade_type, coin, amount, price)
+        error = self._apply_trade(self.users[username], trade_type, coin, amount, price)
+        if error:
+            return self._create_response(400, error, snapshot.version)
+
+        self._record_transaction(username, trade_type, coin, amount, price, snapshot.version)
+        self.candles.add_tick(coin, price, amount)
         
-        return self._create_response(200, f"{trade_type.capitalize()} order processed for {amount} {coin} at {price}")
+        return self._create_response(200, f"{trade_type.capitalize()} order processed for {amount} {coin} at {price}", snapshot.version)
+
+    @staticmethod
+    def _trade_error(amount: Any, price: Optional[float]) -> Optional[str]:
+        # price เป็น None เมื่อไม่มีเหรียญนี้ จำนวนต้องเป็นตัวเลขบวกที่จำกัด ติดลบจะกลับทิศ trade และไหลเข้า volume ของแท่งเทียน
+        if price is None:
+            return "Unknown coin"
+        if not isinstance(amount, (int, float)) or isinstance(amount, bool) or not 0 < amount < math.inf:
+            return "Invalid amount"
+        return None
+
+    @staticmethod
+    def _apply_trade(user: Dict[str, Any], trade_type: str, coin: str, amount: float, price: Optional[float]) -> Optional[str]:
+        # คืนข้อความ error ถ้าทำไม่ได้ None ถ้าสำเร็จ
+        error = CTSServer._trade_error(amount, price)
+        if error:
+            return error
+        total_cost = amount * price
+        with user['lock']:
+            if trade_type == 'buy':
+                if user['balance'] < total_cost:
+                    return "Insufficient funds"
+                user['balance'] -= total_cost
+                user['portfolio'][coin] = user['portfolio'].get(coin, 0) + amount
+            else:  # sell
+                if user['portfolio'].get(coin, 0) < amount:
+                    return "Insufficient coins"
+                user['balance'] += total_cost
+                user['portfolio'][coin] -= amount
+        return None
+
+    def _process_batch(self, client_id: int, batch: Dict[str, Any]) -> Response:
+        username = self.clients[client_id]['user']
+        if not username:
+            return self._create_response(401, "User not logged in")
+        trades = batch.get('trades') if batch else None
+        if not isinstance(trades, list) or not trades:
+            return self._create_response(400, "Batch must contain a list of trades")
+        if len(trades) > BATCH_TRADE_LIMIT:
+            return self._create_response(400, f"Batch limited to {BATCH_TRADE_LIMIT} trades")
+        atomic = bool(batch.get('atomic', False))
+
+        user = self.users[username]
+        snapshot = self.snapshot  # ทุกรายการใน batch ใช้ราคา version เดียวกัน
+        results = []
+        executed = []
+        # ล็อกผู้ใช้ครั้งเดียวทั้ง batch คำนวณบนสำเนาก่อน แล้วค่อยเขียนกลับ โหมด atomic จึงยกเลิกได้ทั้งก้อน
+        with user['lock']:
+            balance = user['balance']
+            portfolio = dict(user['portfolio'])
+            for trade in trades:
+                if not isinstance(trade, dict):
+                    results.append({'status': 400, 'error': "Invalid trade"})
+                    continue
+                trade_type = str(trade.get('type', '')).lower()
+                coin = trade.get('coin')
+                amount = trade.get('amount')
+                price = snapshot.prices.get(coin) if isinstance(coin, str) else None
+                if trade_type not in ('buy', 'sell'):
+                    results.append({'status': 400, 'error': "Invalid trade type"})
+                    continue
+                error = self._trade_error(amount, price)
+                if error:
+                    results.append({'status': 400, 'error': error})
+                    continue
+                total_cost = amount * price
+                if trade_type == 'buy':
+                    if balance < total_cost:
+                        results.append({'status': 400, 'error': "Insufficient funds"})
+                        continue
+                    balance -= total_cost
+                    portfolio[coin] = portfolio.get(coin, 0) + amount
+                else:
+                    if portfolio.get(coin, 0) < amount:
+                        results.append({'status': 400, 'error': "Insufficient coins"})
+                        continue
+                    balance += total_cost
+                    portfolio[coin] -= amount
+                results.append({'status': 200, 'type': trade_type, 'coin': coin, 'amount': amount, 'price': price})
+                executed.append((trade_type, coin, amount, price))
+
+            failed = len(results) - len(executed)
+            if atomic and failed:
+                for result in results:
+                    if result['status'] == 200:
+                        result.update(status=409, error="Not executed, batch rolled back")
+                return self._create_response(400, codec.encode({'executed': 0, 'failed': failed, 'results': results}), snapshot.version)
+            user['balance'] = balance
+            user['portfolio'] = portfolio
+
+        for trade_type, coin, amount, price in executed:
+            self._record_transaction(username, trade_type, coin, amount, price, snapshot.version)
+            self.candles.add_tick(coin, price, amount)
+        return self._create_response(200, codec.encode({'executed': len(executed), 'failed': failed, 'results': results}), snapshot.version)
+
+    def _place_order(self, client_id: int, order_data: Dict[str, Any]) -> Response:
+        username = self.clients[client_id]['user']
+        if not username:
+            return self._create_response(401, "User not logged in")
+        if not isinstance(order_data, dict):
+            return self._create_response(400, "Order must be an object")
+        kind = str(order_data.get('kind', '')).lower()
+        trade_type = str(order_data.get('type', '')).lower()
+        coin = order_data.get('coin')
+        amount = order_data.get('amount')
+        trigger = order_data.get('trigger')
+        if kind not in ORDER_KINDS:
+            return self._create_response(400, f"Invalid order kind, use one of {', '.join(ORDER_KINDS)}")
+        if trade_type not in ('buy', 'sell'):
+            return self._create_response(400, "Invalid trade type")
+        error = self._trade_error(amount, self.prices.get(coin) if isinstance(coin, str) else None)
+        if error:
+            return self._create_response(400, error)
+        # ตรวจแบบเดียวกับ amount ใน _trade_error: bool เป็น int ใน Python ส่วน nan / inf ทำให้ heap ของ order book เรียงผิด
+        if not isinstance(trigger, (int, float)) or isinstance(trigger, bool) or not 0 < trigger < math.inf:
+            return self._create_response(400, "Invalid trigger price")
+        order = self.order_book.add(ConditionalOrder(username, kind, trade_type, coin, amount, float(trigger)))
+        if order is None:
+            return self._create_response(400, f"Open orders limited to {OPEN_ORDER_LIMIT}")
+        return self._create_response(200, codec.encode(order.to_dict()))
+
+    def _cancel_order(self, client_id: int, order_data: Dict[str, Any]) -> Response:
+        username = self.clients[client_id]['user']
+        if not username:
+            return self._create_response(401, "User not logged in")
+        order_id = order_data.get('order_id') if isinstance(order_data, dict) else None
+        # order_id ที่ไม่ใช่ int (เช่น list) hash ไม่ได้ และ True จะไปตรงกับคำสั่งหมายเลข 1
+        if not isinstance(order_id, int) or isinstance(order_id, bool):
+            return self._create_response(400, "Invalid order_id")
+        order = self.order_book.cancel(username, order_id)
+        if order is None:
+            return self._create_response(400, "Order not found or no longer open")
+        return self._create_response(200, codec.encode(order.to_dict()))
+
+    def _get_orders(self, client_id: int, _: None) -> Response:
+        username = self.clients[client_id]['user']
+        if not username:
+            return self._create_response(401, "User not logged in")
+        return self._create_response(200, codec.encode(self.order_book.orders_of(username)))
+
+    def _fill_orders(self, snapshot: PriceSnapshot):
+        # คำสั่งที่ราคาข้าม trigger ใน tick นี้ ซื้อขายที่ราคาของ snapshot นี้ (stop ที่ราคากระโดดข้ามจึงได้ราคาหลังกระโดด)
+        # เงินหรือเหรียญไม่พอตอนทำงานถือว่า rejected ไม่กันเงินไว้ตอนวางคำสั่ง
+        for order in self.order_book.triggered(snapshot.prices):
+            price = snapshot.prices[order.coin]
+            order.price_version = snapshot.version
+            user = self.users.get(order.username)
+            error = self._apply_trade(user, order.type, order.coin, order.amount, price) if user else "User not found"
+            if error:
+                order.status = 'rejected'
+                order.error = error
+            else:
+                order.status = 'filled'
+                order.fill_price = price
+                self._record_transaction(order.username, order.type, order.coin, order.amount, price, snapshot.version)
+                self.candles.add_tick(order.coin, price, order.amount)
+            self.order_book.close(order)
 
-    def _record_transaction(self, username: str, trade_type: str, coin: str, amount: float, price: float):
+    def _record_transaction(self, username: str, trade_type: str, coin: str, amount: float, price: float, price_version: int):
         self.transactions.append({
             'username': username,
             'type': trade_type,
             'coin': coin,
             'amount': amount,
             'price': price,
+            'price_version': price_version,
             'timestamp': datetime.now().isoformat()
         })
 
-    def _get_portfolio(self, client_id: int, _: None) -> str:
+    def _get_portfolio(self, client_id: int, _: None) -> Response:
         username = self.clients[client_id]['user']
         if not username:
             return self._create_response(401, "User not logged in")
-        return self._create_response(200, json.dumps(self.users[username]['portfolio']))
+        return self._create_response(200, codec.encode(self.users[username]['portfolio']))
 
-    def _get_history(self, client_id: int, _: None) -> str:
+    def _get_history(self, client_id: int, _: None) -> Response:
         username = self.clients[client_id]['user']
         if not username:
             return self._create_response(401, "User not logged in")
         user_transactions = [t for t in self.transactions if t['username'] == username]
-        return self._create_response(200, json.dumps(user_transactions))
+        return self._create_response(200, codec.encode(user_transactions))
 
-    def _get_report(self, client_id: int, _: None) -> str:
+    def _get_report(self, client_id: int, _: None) -> Response:
         username = self.clients[client_id]['user']
         if not username:
             return self._create_response(401, "User not logged in")
         user = self.users[username]
-        total_value = user['balance'] + sum(user['portfolio'][coin] * self.prices[coin] for coin in self.prices)
+        snapshot = self.snapshot
+        total_value = user['balance'] + sum(amount * snapshot.prices.get(coin, 0.0) for coin, amount in user['portfolio'].items())
         report = {
             'balance': user['balance'],
             'portfolio': user['portfolio'],
             'total_value': total_value,
             'profit_loss': total_value - 10000  # Assuming starting balance was 10000
         }
-        return self._create_response(200, json.dumps(report))
+        return self._create_response(200, codec.encode(report), snapshot.version)
 
     def _update_prices(self):
+        # นับเวลาจาก deadline ของ tick ก่อน เวลาที่ใช้คำนวณจึงไม่ทำให้ tick ช้าลงเมื่อมีเหรียญมากขึ้น
+        next_tick = time.monotonic()
         while True:
-            time.sleep(5)  # Update prices every 5 seconds
-            for coin in self.prices:
-                self.prices[coin] *= (1 + (random.random() - 0.5) * 0.02)  # Random price fluctuation ±1%
+            next_tick += PRICE_TICK_INTERVAL
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            prices = self.simulator.step()
+            # มี thread นี้ thread เดียวที่เขียน snapshot การกำหนด attribute เป็น atomic อยู่แล้ว
+            snapshot = PriceSnapshot(self.snapshot.version + 1, prices)
+            self.snapshot = snapshot
+            self.candles.add_ticks(prices)
+            self._fill_orders(snapshot)
 
     @staticmethod
-    def _create_response(status_code: int, body: str) -> str:
-        status_phrase = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 500: "Internal Server Error"}
-        headers = f"CTSP/1.0 {status_code} {status_phrase.get(status_code, '')}\n"
-        headers += f"Content-Length: {len(body)}\n"
-        return f"{headers}\n{body}"
+    def _create_response(status_code: int, body: Union[str, bytes], price_version: Optional[int] = None) -> Response:
+        # header สร้างตอนส่ง (_encode_response) เพราะ Content-Length ขึ้นกับการบีบอัด
+        return status_code, body if isinstance(body, bytes) else body.encode('utf-8'), price_version
 
 if __name__ == "__main__":
     server = CTSServer()
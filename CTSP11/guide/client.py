@@ -1,6 +1,28 @@
+import os
 import socket
 import json
 import hashlib
+import time
+import threading
+import zlib
+from typing import List, Tuple
+
+WINDOW_SIZE = 8  # จำนวน request ที่ส่งค้างไว้ได้โดยยังไม่ได้ response
+RETRANSMIT_TIMEOUT = 1.0
+MAX_RETRANSMITS = 5
+HEARTBEAT_INTERVAL = 10  # ส่ง PING เมื่อว่างนานเท่านี้ ต้องน้อยกว่า IDLE_TIMEOUT ของ server
+
+CHECKSUM_KEY = os.environ.get('CTSP_CHECKSUM_KEY', '').encode()  # ต้องตรงกับที่ server ใช้ ไม่ตั้งก็ไม่เสนอ blake2b
+CHECKSUM_ALGORITHMS = {
+    'crc32': lambda data: f"{zlib.crc32(data):08x}",
+    'adler32': lambda data: f"{zlib.adler32(data):08x}",
+    'md5': lambda data: hashlib.md5(data).hexdigest()[:16],
+}
+if CHECKSUM_KEY:
+    CHECKSUM_ALGORITHMS['blake2b'] = lambda data: hashlib.blake2b(data, key=CHECKSUM_KEY, digest_size=16).hexdigest()
+# เรียงตามที่ต้องการ: crc32 ถูกที่สุด ถ้าต้องการยืนยันผู้ส่งให้ย้าย blake2b ขึ้นก่อน
+CHECKSUM_PREFERENCE = [name for name in ('crc32', 'adler32', 'blake2b', 'md5') if name in CHECKSUM_ALGORITHMS]
+DEFAULT_CHECKSUM = 'md5'
 
 class CTSPClient:
     def __init__(self, host: str = 'localhost', port: int = 6789):
@@ -8,37 +30,166 @@ class CTSPClient:
         self.port = port
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.player_id = None
+        self.checksum_algorithm = DEFAULT_CHECKSUM
         self.sequence_number = 0
+        self.buffer = b''
+        self.send_count = 0
+        self.last_sent = time.monotonic()
+        # send_window อ่าน response จาก socket เอง thread heartbeat จึงต้องรอให้ request อื่นเสร็จก่อน
+        self.lock = threading.RLock()
+        self.heartbeat_stop = threading.Event()
 
     def connect(self):
         self.socket.connect((self.host, self.port))
 
+    def start_heartbeat(self, interval: float = HEARTBEAT_INTERVAL):
+        heartbeat_thread = threading.Thread(target=self._heartbeat_loop, args=(interval,))
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+
+    def _heartbeat_loop(self, interval: float):
+        while not self.heartbeat_stop.wait(interval / 2):
+            if time.monotonic() - self.last_sent < interval:
+                continue
+            try:
+                self.ping()
+            except (OSError, ConnectionError):
+                break
+
     def send_request(self, command: str, payload: dict) -> dict:
+        return self.send_window([(command, payload)], window=1)[0]
+
+    def send_window(self, requests: List[Tuple[str, dict]], window: int = WINDOW_SIZE) -> List[dict]:
+        with self.lock:
+            return self._send_window(requests, window)
+
+    def _send_window(self, requests: List[Tuple[str, dict]], window: int) -> List[dict]:
+        # ส่ง request ค้างไว้ได้หลายอัน แล้วส่งซ้ำเฉพาะ sequence ที่โดน NACK หรือหายไป
+        results = [None] * len(requests)
+        in_flight = {}  # {sequence: [index, command, payload, sent_at, send_id, retransmits]}
+        next_index = 0
+        done = 0
+        self.socket.settimeout(RETRANSMIT_TIMEOUT)
+        try:
+            while done < len(requests):
+                while next_index < len(requests) and len(in_flight) < window:
+                    command, payload = requests[next_index]
+                    sequence = self.sequence_number
+                    self.sequence_number += 1
+                    in_flight[sequence] = [next_index, command, payload, 0.0, 0, -1]
+                    self._retransmit(sequence, in_flight[sequence])
+                    next_index += 1
+
+                try:
+                    response = self._read_response()
+                except socket.timeout:
+                    now = time.monotonic()
+                    for sequence, entry in in_flight.items():
+                        if now - entry[3] >= RETRANSMIT_TIMEOUT:
+                            self._retransmit(sequence, entry)
+                    continue
+
+                sequence = response['request_sequence']
+                entry = in_flight.get(sequence)
+                if entry is not None and response['command'] != 'NACK' and response['checksum_ok']:
+                    del in_flight[sequence]
+                    results[entry[0]] = response
+                    done += 1
+                # ทุก sequence ที่ <= Ack server ประมวลผลแล้ว ปล่อยออกจาก window ได้เลยไม่ต้องส่งซ้ำ
+                # แม้ response ของมันจะหายหรือเสียระหว่างทาง
+                ack = response['ack']
+                for acked_sequence in [s for s in in_flight if s <= ack]:
+                    acked_entry = in_flight.pop(acked_sequence)
+                    results[acked_entry[0]] = self._acked_result(acked_entry[1], acked_sequence, ack)
+                    done += 1
+                if entry is None or sequence <= ack:
+                    continue
+                if sequence in in_flight:
+                    # NACK หรือ response เสีย และ server ยังไม่ได้ประมวลผล sequence นี้
+                    self._retransmit(sequence, entry)
+                    continue
+                # server ตอบตามลำดับ request ที่ส่งก่อนหน้านี้แต่ยังไม่ได้ response แปลว่าหายไประหว่างทาง
+                for lost_sequence, lost_entry in in_flight.items():
+                    if lost_entry[4] < entry[4]:
+                        self._retransmit(lost_sequence, lost_entry)
+        finally:
+            self.socket.settimeout(None)
+        return results
+
+    @staticmethod
+    def _acked_result(command: str, sequence: int, ack: int) -> dict:
+        # server ยืนยันด้วย Ack ว่าประมวลผลแล้ว แต่ response ของ request นี้ไม่มาถึง จึงไม่มี status และ body
+        return {
+            "command": command,
+            "status": None,
+            "player_id": None,
+            "sequence": 0,
+            "request_sequence": sequence,
+            "ack": ack,
+            "acked": True,
+            "checksum_ok": False,
+            "body": None
+        }
+
+    def _retransmit(self, sequence: int, entry: list):
+        entry[5] += 1
+        if entry[5] > MAX_RETRANSMITS:
+            raise ConnectionError(f"No response for sequence {sequence}")
+        self.send_count += 1
+        entry[3] = time.monotonic()
+        entry[4] = self.send_count
+        self._send_frame(entry[1], entry[2], sequence)
+
+    def _send_frame(self, command: str, payload: dict, sequence: int):
         payload_json = json.dumps(payload)
-        checksum = self._calculate_checksum(payload_json)
+        checksum = self._calculate_checksum(payload_json, self.checksum_algorithm)
         
         headers = f"CTSP/1.0 {command}\n"
-        headers += f"Sequence: {self.sequence_number}\n"
+        headers += f"Sequence: {sequence}\n"
         if self.player_id:
             headers += f"Player-ID: {self.player_id}\n"
-        headers += f"Content-Length: {len(payload_json)}\n"
+        headers += f"Content-Length: {len(payload_json.encode('utf-8'))}\n"
         headers += f"Checksum: {checksum}\n"
         
         request = f"{headers}\n{payload_json}"
-        self.socket.send(request.encode('utf-8'))
-        
-        response = self.socket.recv(4096).decode('utf-8')
-        return self._parse_response(response)
+        self.socket.sendall(request.encode('utf-8'))
+        self.last_sent = time.monotonic()
+
+    def _read_response(self) -> dict:
+        while b'\n\n' not in self.buffer:
+            chunk = self.socket.recv(4096)
+            if not chunk:
+                raise ConnectionError("Connection closed by server")
+            self.buffer += chunk
+        head, rest = self.buffer.split(b'\n\n', 1)
+        length = 0
+        for line in head.split(b'\n'):
+            if line.startswith(b'Content-Length: '):
+                length = int(line[len(b'Content-Length: '):])
+        while len(rest) < length:
+            chunk = self.socket.recv(4096)
+            if not chunk:
+                raise ConnectionError("Connection closed by server")
+            rest += chunk
+        self.buffer = rest[length:]
+        response = head + b'\n\n' + rest[:length]
+        return self._parse_response(response.decode('utf-8', errors='replace'))
 
     def enter(self, username: str, password: str) -> dict:
-        payload = {"username": username, "password": password}
+        payload = {"username": username, "password": password, "checksums": CHECKSUM_PREFERENCE}
         response = self.send_request("ENTER", payload)
         if response['status'] == 200:
             self.player_id = response['body']['player_id']
+            self.checksum_algorithm = response['body'].get('checksum', DEFAULT_CHECKSUM)
         return response
 
     def exit(self) -> dict:
-        return self.send_request("EXIT", {})
+        response = self.send_request("EXIT", {})
+        if response['status'] == 200:
+            # server ลบ session แล้ว request ถัดไปต้องกลับไปใช้ checksum เริ่มต้น
+            self.player_id = None
+            self.checksum_algorithm = DEFAULT_CHECKSUM
+        return response
 
     def scan(self, coins: List[str]) -> dict:
         return self.send_request("SCAN", {"coins": coins})
@@ -59,8 +210,8 @@ class CTSPClient:
         return self.send_request("PING", {})
 
     @staticmethod
-    def _calculate_checksum(payload: str) -> str:
-        return hashlib.md5(payload.encode('utf-8')).hexdigest()[:16]
+    def _calculate_checksum(payload: str, algorithm: str = DEFAULT_CHECKSUM) -> str:
+        return CHECKSUM_ALGORITHMS[algorithm](payload.encode('utf-8'))
 
     def _parse_response(self, response: str) -> dict:
         lines = response.split('\n')
@@ -71,22 +222,29 @@ class CTSPClient:
             key, value = line.split(': ')
             headers[key] = value
         
-        body = json.loads(lines[-1])
+        algorithm = headers.get('Checksum-Algorithm', DEFAULT_CHECKSUM)
+        checksum_ok = algorithm in CHECKSUM_ALGORITHMS and self._calculate_checksum(lines[-1], algorithm) == headers.get('Checksum')
+        body = json.loads(lines[-1]) if checksum_ok else None
         
         return {
             "command": lines[0].split()[1],
             "status": int(headers['Status'].split()[0]),
             "player_id": headers.get('Player-ID'),
             "sequence": int(headers.get('Sequence', 0)),
+            "request_sequence": int(headers.get('Request-Sequence', -1)),
+            "ack": int(headers.get('Ack', -1)),
+            "checksum_ok": checksum_ok,
             "body": body
         }
 
     def close(self):
+        self.heartbeat_stop.set()
         self.socket.close()
 
 if __name__ == "__main__":
     client = CTSPClient()
     client.connect()
+    client.start_heartbeat()
     
     # Example usage
     print(client.enter("Satoshi", "bitcoin123"))
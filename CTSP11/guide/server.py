@@ -1,20 +1,262 @@
+import os
 import socket
-import json
+import sys
 import threading
 import time
 import hashlib
 import random
-from typing import Dict, List, Any
+import secrets
+import zlib
+import bisect
+import math
+from array import array
+from typing import Dict, List, Any, Optional, Tuple, TypedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from common.codec import codec
+from common.response import send_parts, status_header
+
+REPLAY_WINDOW = 64  # จำนวน sequence ย้อนหลังที่จำไว้สำหรับตรวจ request ซ้ำ
+MAX_SEQUENCE_JUMP = REPLAY_WINDOW  # client ส่งค้างได้ไม่เกิน window sequence ที่กระโดดไกลกว่านี้ถือว่าผิด
+STARTING_BALANCE = 100000.0
+LEADERBOARD_SIZE = 10
+PRICE_UPDATE_INTERVAL = 5  # วินาที
+HISTORY_SLOTS = 24 * 60 * 60 // PRICE_UPDATE_INTERVAL  # ราคาย้อนหลัง 24 ชั่วโมง
+MAX_HEADER_SIZE = 8 * 1024
+MAX_REQUEST_SIZE = 64 * 1024  # header + payload ต่อ request SCAN ทุกเหรียญยังไม่ถึง 1 KB
+RECV_SIZE = 4096
+IDLE_TIMEOUT = 30  # วินาที ไม่มี request (รวม PING) นานเกินนี้ถือว่า connection ตายแล้ว
+HEARTBEAT_TICK = 1  # วินาทีต่อช่องของ timer wheel
+
+# คีย์สำหรับ blake2b (ต้องตรงกับที่ client ใช้) ใช้เมื่อต้องการตรวจว่าข้อความมาจากผู้ถือคีย์จริง
+# ไม่ได้ตั้ง CTSP_CHECKSUM_KEY ก็ไม่รับ blake2b ตอน ENTER จะตกลงใช้ algorithm อื่นแทน
+CHECKSUM_KEY = os.environ.get('CTSP_CHECKSUM_KEY', '').encode()
+CHECKSUM_ALGORITHMS = {
+    'crc32': lambda data: f"{zlib.crc32(data):08x}",
+    'adler32': lambda data: f"{zlib.adler32(data):08x}",
+    'md5': lambda data: hashlib.md5(data).hexdigest()[:16],
+}
+if CHECKSUM_KEY:
+    CHECKSUM_ALGORITHMS['blake2b'] = lambda data: hashlib.blake2b(data, key=CHECKSUM_KEY, digest_size=16).hexdigest()
+DEFAULT_CHECKSUM = 'md5'  # ใช้จนกว่า ENTER จะตกลง algorithm กันได้
+
+# บรรทัดคำสั่งและ header ของ session encode ไว้ล่วงหน้า ต่อ response เหลือแค่ใส่ความยาว checksum และ sequence
+COMMAND_LINES = {command: f"CTSP/1.0 {command}\n".encode() for command in ('ENTER', 'EXIT', 'SCAN', 'BUY', 'SELL', 'CHECK', 'RANK', 'PONG', 'NACK')}
+SESSION_HEADERS = b"Player-ID: %s\nSequence: %d\n"
+CHECKSUM_TRAILERS = {
+    algorithm: b"Content-Length: %d\nChecksum-Algorithm: " + algorithm.encode() + b"\nChecksum: %s\n\n"
+    for algorithm in CHECKSUM_ALGORITHMS
+}
+
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+Response = List[bytes]  # [บรรทัดคำสั่ง, header ที่เหลือ, body] ส่งด้วย sendmsg โดยไม่ต่อกัน
+
+class TradePayload(TypedDict):
+    coin: str
+    amount: float
+
+PAYLOAD_DECODERS = {
+    'BUY': codec.decoder(TradePayload),
+    'SELL': codec.decoder(TradePayload)
+}
+
+class Session:
+    __slots__ = ('player_id', 'username', 'checksum', 'next_sequence', 'highest_seen', 'seen_mask', 'acked', 'responses')
+
+    NEW = 0
+    DUPLICATE = 1
+    STALE = 2
+    TOO_FAR = 3
+
+    def __init__(self, player_id: str, username: str, first_sequence: int, checksum: str = DEFAULT_CHECKSUM):
+        self.player_id = player_id
+        self.username = username
+        self.checksum = checksum
+        self.next_sequence = 0
+        self.highest_seen = first_sequence
+        self.seen_mask = 1  # bit i = sequence (highest_seen - i) ถูกประมวลผลแล้ว
+        self.acked = first_sequence  # ทุก sequence ที่ <= acked ถูกประมวลผลแล้ว (cumulative ack)
+        self.responses: Dict[int, Response] = {}
+
+    def next_response_sequence(self) -> int:
+        self.next_sequence += 1
+        return self.next_sequence
+
+    def check(self, sequence: int) -> int:
+        if sequence > self.highest_seen:
+            if sequence - self.highest_seen > MAX_SEQUENCE_JUMP:
+                return Session.TOO_FAR
+            return Session.NEW
+        offset = self.highest_seen - sequence
+        if offset >= REPLAY_WINDOW:
+            return Session.STALE
+        if (self.seen_mask >> offset) & 1:
+            return Session.DUPLICATE
+        return Session.NEW
+
+    def record(self, sequence: int, response: Response):
+        if sequence > self.highest_seen:
+            shift = sequence - self.highest_seen
+            if shift >= REPLAY_WINDOW:
+                self.seen_mask = 1
+            else:
+                self.seen_mask = ((self.seen_mask << shift) | 1) & ((1 << REPLAY_WINDOW) - 1)
+            self.highest_seen = sequence
+        else:
+            self.seen_mask |= 1 << (self.highest_seen - sequence)
+        # sequence ที่หลุด window ไปแล้วจะไม่ถูกประมวลผลอีก จึงนับว่า ack แล้ว
+        self.acked = max(self.acked, self.highest_seen - REPLAY_WINDOW)
+        # ช่องว่างแรกหลัง acked คือ bit 0 ที่อยู่สูงสุดใน pending bit ล่าง (bit i = sequence highest_seen - i)
+        pending = self.highest_seen - self.acked
+        missing = ~self.seen_mask & ((1 << pending) - 1)
+        self.acked = self.highest_seen - missing.bit_length()
+        # เก็บ response ไว้ตอบซ้ำเมื่อ client ส่ง request เดิมมาอีกครั้ง (เช่น response หาย)
+        self.responses[sequence] = response
+        oldest = self.highest_seen - REPLAY_WINDOW
+        while self.responses:
+            first = next(iter(self.responses))
+            if first > oldest:
+                break
+            del self.responses[first]
+
+class PriceHistory:
+    __slots__ = ('prices', 'index', 'count')
+
+    # ring buffer ขนาดคงที่ เขียนทับราคาที่เก่ากว่า 24 ชั่วโมง
+    def __init__(self, price: float, size: int = HISTORY_SLOTS):
+        self.prices = array('d', bytes(8 * size))
+        self.prices[0] = price
+        self.index = 0
+        self.count = 1
+
+    def push(self, price: float):
+        self.index = (self.index + 1) % len(self.prices)
+        self.prices[self.index] = price
+        if self.count < len(self.prices):
+            self.count += 1
+
+    def change(self) -> float:
+        oldest = self.prices[(self.index - self.count + 1) % len(self.prices)]
+        return (self.prices[self.index] - oldest) / oldest * 100
+
+class Connection:
+    __slots__ = ('socket', 'last_seen', 'slot', 'session')
+
+    def __init__(self, client_socket: socket.socket):
+        self.socket = client_socket
+        self.last_seen = time.monotonic()
+        self.slot = None
+        self.session: Optional[Session] = None  # session ที่ ENTER บน connection นี้ ลบทิ้งเมื่อ connection ปิด
+
+class TimerWheel:
+    # แต่ละช่องเก็บ connection ที่ถึงเวลาต้องตรวจในรอบนั้น request ใหม่แค่แก้ last_seen
+    # ตอนถึงช่อง ถ้ายังไม่หมดเวลาจึงค่อยย้ายไปช่องใหม่ แต่ละ connection ถูกตรวจไม่เกินหนึ่งครั้งต่อ timeout
+    def __init__(self, timeout: float, tick: float = HEARTBEAT_TICK):
+        self.timeout = timeout
+        self.tick = tick
+        self.slots = [set() for _ in range(int(timeout / tick) + 2)]
+        self.current = 0
+        self.lock = threading.Lock()
+
+    def _slot_for(self, deadline: float, now: float) -> int:
+        ticks = max(1, int((deadline - now) / self.tick) + 1)
+        return (self.current + ticks) % len(self.slots)
+
+    def _schedule(self, connection: Connection, now: float):
+        connection.slot = self._slot_for(connection.last_seen + self.timeout, now)
+        self.slots[connection.slot].add(connection)
+
+    def add(self, connection: Connection):
+        with self.lock:
+            self._schedule(connection, time.monotonic())
+
+    def remove(self, connection: Connection):
+        with self.lock:
+            if connection.slot is not None:
+                self.slots[connection.slot].discard(connection)
+                connection.slot = None
+
+    def advance(self) -> List[Connection]:
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            self.current = (self.current + 1) % len(self.slots)
+            due = self.slots[self.current]
+            self.slots[self.current] = set()
+            for connection in due:
+                if connection.last_seen + self.timeout <= now:
+                    connection.slot = None
+                    expired.append(connection)
+                else:
+                    self._schedule(connection, now)
+        return expired
+
+class Leaderboard:
+    # เก็บ (-total_value, username) เรียงไว้ตลอด แต่ละ trade ย้ายเฉพาะผู้เล่นคนนั้นด้วย bisect
+    # ส่วนตอนราคาเปลี่ยนค่อยเรียงใหม่ครั้งเดียวต่อ tick แทนการคำนวณใหม่ทุก RANK
+    def __init__(self):
+        self.entries: List[tuple] = []
+        self.values: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def update(self, username: str, total_value: float):
+        with self.lock:
+            old = self.values.get(username)
+            if old is not None:
+                del self.entries[bisect.bisect_left(self.entries, (-old, username))]
+            self.values[username] = total_value
+            bisect.insort(self.entries, (-total_value, username))
+
+    def rebuild(self, values: Dict[str, float]):
+        entries = sorted((-value, username) for username, value in values.items())
+        with self.lock:
+            self.values = values
+            self.entries = entries
+
+    def top(self, n: int) -> List[Dict[str, Any]]:
+        with self.lock:
+            top_entries = self.entries[:n]
+        return [{"username": username, "total_value": -value, "rank": i + 1}
+                for i, (value, username) in enumerate(top_entries)]
+
+    def rank_of(self, username: str) -> Optional[int]:
+        with self.lock:
+            value = self.values.get(username)
+            if value is None:
+                return None
+            return bisect.bisect_left(self.entries, (-value, username)) + 1
 
 class CTSPServer:
-    def __init__(self, host: str = 'localhost', port: int = 6789):
+    def __init__(self, host: str = 'localhost', port: int = 6789, idle_timeout: float = IDLE_TIMEOUT):
         self.host = host
         self.port = port
+        self.heartbeats = TimerWheel(idle_timeout)
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.clients: Dict[str, Dict[str, Any]] = {}
+        self.sessions: Dict[str, Session] = {}
         self.prices: Dict[str, float] = {'BTC': 50000.0, 'ETH': 3000.0, 'DOGE': 0.5}
         self.users: Dict[str, Dict[str, Any]] = {}
-        self.sequence_numbers: Dict[str, int] = {}
+        self.leaderboard = Leaderboard()
+        self.price_history = {coin: PriceHistory(price) for coin, price in self.prices.items()}
+        self._build_market_snapshot()
+        for username, password in [('Satoshi', 'bitcoin123'), ('Vitalik', 'ethereum123'), ('Elon', 'dogecoin123')]:
+            self.add_user(username, password)
+
+    def add_user(self, username: str, password: str, balance: float = STARTING_BALANCE):
+        self.users[username] = {
+            'password': password,
+            'balance': balance,
+            'portfolio': {coin: 0.0 for coin in self.prices},
+            'transactions': [],
+            'lock': threading.Lock()
+        }
+        self.leaderboard.update(username, balance)
+
+    def _total_value(self, user: Dict[str, Any]) -> float:
+        return user['balance'] + sum(amount * self.prices[coin] for coin, amount in user['portfolio'].items())
 
     def start(self):
         self.server_socket.bind((self.host, self.port))
@@ -22,6 +264,7 @@ class CTSPServer:
         print(f"Server listening on {self.host}:{self.port}")
         
         self._start_price_update_thread()
+        self._start_heartbeat_thread()
         
         while True:
             client_socket, addr = self.server_socket.accept()
@@ -33,50 +276,138 @@ class CTSPServer:
         price_thread.daemon = True
         price_thread.start()
 
+    def _start_heartbeat_thread(self):
+        heartbeat_thread = threading.Thread(target=self._reap_idle_connections)
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+
+    def _reap_idle_connections(self):
+        while True:
+            time.sleep(self.heartbeats.tick)
+            for connection in self.heartbeats.advance():
+                # peer ที่หายไปเฉยๆ ไม่ส่ง FIN มา recv จะค้างตลอด shutdown เพื่อปลุก thread ให้ไปปิดเอง
+                try:
+                    connection.socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
     def _start_client_thread(self, client_socket):
         client_thread = threading.Thread(target=self._handle_client, args=(client_socket,))
         client_thread.start()
 
     def _handle_client(self, client_socket):
-        player_id = None
+        buffer = b''
+        connection = Connection(client_socket)
+        self.heartbeats.add(connection)
         try:
             while True:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
+                head, payload, buffer = self._read_frame(client_socket, buffer, connection)
+                if head is None:
                     break
-                
-                lines = data.split('\n')
+                lines = head.decode('utf-8', errors='replace').split('\n')
                 headers = {}
                 for line in lines[1:]:
-                    if line.strip() == '':
-                        break
-                    key, value = line.split(': ')
+                    key, value = line.split(': ', 1)
                     headers[key] = value
-                
-                payload = lines[-1]
-                
-                if self._verify_checksum(payload, headers['Checksum']):
-                    response = self._process_request(headers, payload)
-                    if 'Player-ID' in headers:
-                        player_id = headers['Player-ID']
-                        self.sequence_numbers[player_id] = int(headers['Sequence']) + 1
-                    client_socket.send(response.encode('utf-8'))
+                payload = payload.decode('utf-8', errors='replace')
+
+                command = lines[0].split()[1]
+                sequence = int(headers.get('Sequence', 0))
+                # session ผูกกับ connection ที่ ENTER Player-ID ใน header ต้องตรงกับ session ของ connection นี้
+                player_id = connection.session.player_id if connection.session else None
+                session = self.sessions.get(player_id) if player_id else None
+                if 'Player-ID' in headers and headers['Player-ID'] != player_id:
+                    response = self._with_ack(self._create_response(command, 401, {"error": "Player-ID does not belong to this connection"}), sequence, None)
+                    send_parts(client_socket, response)
+                    continue
+                algorithm = session.checksum if session else DEFAULT_CHECKSUM
+                if self._verify_checksum(payload, headers['Checksum'], algorithm):
+                    response = self._process_sequenced(command, sequence, player_id, payload, connection)
                 else:
-                    nack = self._create_response("NACK", 400, {"error": "Checksum mismatch"}, player_id)
-                    client_socket.send(nack.encode('utf-8'))
+                    # ไม่บันทึก sequence นี้ว่าประมวลผลแล้ว client จึงส่งซ้ำเฉพาะ sequence นี้ได้
+                    nack = self._create_response("NACK", 400, {"error": "Checksum mismatch", "sequence": sequence}, player_id)
+                    response = self._with_ack(nack, sequence, self.sessions.get(player_id) if player_id else None)
+                send_parts(client_socket, response)
+        except BadRequest as e:
+            # ขนาด frame ผิดจนตัด request ถัดไปไม่ได้แล้ว ตอบ error แล้วปิด connection
+            send_parts(client_socket, self._create_response("ERROR", e.status, {"error": str(e)}))
         except Exception as e:
             print(f"Error handling client: {e}")
         finally:
-            if player_id:
-                del self.clients[player_id]
+            self.heartbeats.remove(connection)
+            session = connection.session
+            if session is not None and self.sessions.get(session.player_id) is session:
+                del self.sessions[session.player_id]
             client_socket.close()
 
-    def _process_request(self, headers: Dict[str, str], payload: str) -> str:
-        command = headers['CTSP/1.0']
-        player_id = headers.get('Player-ID')
-        
+    @staticmethod
+    def _read_frame(client_socket, buffer: bytes, connection: Connection) -> Tuple[Optional[bytes], bytes, bytes]:
+        # client ส่ง request ต่อกันได้หลายอันโดยไม่รอ response จึงต้องตัด frame ตาม Content-Length
+        # จำกัดขนาด header และ payload peer จึงสั่งให้จอง memory ตาม Content-Length ที่อ้างมาไม่ได้
+        while b'\n\n' not in buffer:
+            if len(buffer) > MAX_HEADER_SIZE:
+                raise BadRequest(413, "Request headers too large")
+            chunk = client_socket.recv(RECV_SIZE)
+            if not chunk:
+                return None, b'', b''
+            buffer += chunk
+            connection.last_seen = time.monotonic()
+        head, rest = buffer.split(b'\n\n', 1)
+        if len(head) > MAX_HEADER_SIZE:
+            raise BadRequest(413, "Request headers too large")
+        length = 0
+        for line in head.split(b'\n')[1:]:
+            key, _, value = line.partition(b': ')
+            if key == b'Content-Length':
+                try:
+                    length = int(value)
+                except ValueError:
+                    raise BadRequest(400, "Invalid Content-Length")
+        if length < 0:
+            raise BadRequest(400, "Invalid Content-Length")
+        if length > MAX_REQUEST_SIZE - len(head):
+            raise BadRequest(413, f"Request limited to {MAX_REQUEST_SIZE} bytes")
+        if len(rest) < length:
+            rest = bytearray(rest)
+            while len(rest) < length:
+                chunk = client_socket.recv(min(RECV_SIZE, length - len(rest)))
+                if not chunk:
+                    return None, b'', b''
+                rest += chunk
+                connection.last_seen = time.monotonic()
+            rest = bytes(rest)
+        return head, rest[:length], rest[length:]
+
+    def _process_sequenced(self, command: str, sequence: int, player_id: Optional[str], payload: str, connection: Optional[Connection] = None) -> Response:
+        session = self.sessions.get(player_id) if player_id else None
+        if session is None:
+            return self._with_ack(self._process_request(command, player_id, payload, sequence, connection), sequence, None)
+
+        status = session.check(sequence)
+        if status == Session.DUPLICATE:
+            response = session.responses.get(sequence)
+            if response is None:
+                response = self._create_response(command, 400, {"error": "Duplicate request"}, player_id)
+        elif status == Session.STALE:
+            response = self._create_response(command, 400, {"error": "Sequence outside replay window"}, player_id)
+        elif status == Session.TOO_FAR:
+            response = self._create_response(command, 400, {"error": "Sequence too far ahead"}, player_id)
+        else:
+            response = self._process_request(command, player_id, payload, sequence, connection)
+            session.record(sequence, response)
+        return self._with_ack(response, sequence, session)
+
+    @staticmethod
+    def _with_ack(response: Response, sequence: int, session: Optional[Session]) -> Response:
+        # Request-Sequence บอกว่าตอบ request ไหน ส่วน Ack คือ cumulative ack ล่าสุดของ session
+        if session is not None:
+            ack = b"Request-Sequence: %d\nAck: %d\n" % (sequence, session.acked)
+        else:
+            ack = b"Request-Sequence: %d\n" % sequence
+        return [response[0], ack, response[1], response[2]]
+
+    def _process_request(self, command: str, player_id: Optional[str], payload: str, sequence: int = -1, connection: Optional[Connection] = None) -> Response:
         handlers = {
-            'ENTER': self._handle_enter,
             'EXIT': self._handle_exit,
             'SCAN': self._handle_scan,
             'BUY': self._handle_buy,
@@ -86,130 +417,194 @@ class CTSPServer:
             'PING': self._handle_ping
         }
         
-        handler = handlers.get(command)
-        if handler:
-            return handler(player_id, json.loads(payload))
-        else:
+        if command != 'ENTER' and command not in handlers:
             return self._create_response(command, 400, {"error": "Invalid command"}, player_id)
+        try:
+            data = PAYLOAD_DECODERS.get(command, codec.decode)(payload)
+        except ValueError:  # JSON เสียหรือ type ไม่ตรง schema ของ msgspec
+            return self._create_response(command, 400, {"error": "Invalid payload"}, player_id)
+        if not isinstance(data, dict):
+            return self._create_response(command, 400, {"error": "Invalid payload"}, player_id)
+        # ENTER ต้องรู้ sequence ของตัวเองเพื่อเริ่ม replay window ของ session ใหม่
+        if command == 'ENTER':
+            return self._handle_enter(player_id, data, sequence, connection)
+        return handlers[command](player_id, data)
 
-    def _handle_enter(self, player_id: str, data: Dict[str, str]) -> str:
-        username = data['username']
-        password = data['password']
-        
-        if username in self.users and self.users[username]['password'] == password:
-            player_id = f"{username}_{int(time.time())}"
-            self.clients[player_id] = {'socket': None, 'username': username}
-            self.sequence_numbers[player_id] = 0
+    def _handle_enter(self, player_id: str, data: Dict[str, str], sequence: int = -1, connection: Optional[Connection] = None) -> Response:
+        username = data.get('username')
+        password = data.get('password')
+
+        if isinstance(username, str) and username in self.users and self.users[username]['password'] == password:
+            # player_id เดาไม่ได้ connection อื่นจึงสวมรอย session นี้ไม่ได้
+            player_id = secrets.token_urlsafe(16)
+            # client เสนอ algorithm ตามลำดับที่ต้องการ server เลือกตัวแรกที่รองรับ
+            offered = data.get('checksums', [DEFAULT_CHECKSUM])
+            checksum = next((name for name in offered if name in CHECKSUM_ALGORITHMS), DEFAULT_CHECKSUM)
+            session = Session(player_id, username, sequence, checksum)
+            if connection is not None:
+                # ENTER ซ้ำบน connection เดิมแทนที่ session เก่า
+                if connection.session is not None:
+                    self.sessions.pop(connection.session.player_id, None)
+                connection.session = session
+            self.sessions[player_id] = session
             return self._create_response("ENTER", 200, {
                 "message": f"Welcome back, {username}!",
-                "player_id": player_id
+                "player_id": player_id,
+                "checksum": checksum
             }, player_id)
         else:
             return self._create_response("ENTER", 401, {"error": "Invalid credentials"}, player_id)
 
-    def _handle_exit(self, player_id: str, data: Dict[str, Any]) -> str:
-        if player_id in self.clients:
-            del self.clients[player_id]
-            return self._create_response("EXIT", 200, {"message": "Logout successful"}, player_id)
+    def _handle_exit(self, player_id: str, data: Dict[str, Any]) -> Response:
+        if player_id in self.sessions:
+            response = self._create_response("EXIT", 200, {"message": "Logout successful"}, player_id)
+            del self.sessions[player_id]
+            return response
         return self._create_response("EXIT", 400, {"error": "Not logged in"}, player_id)
 
-    def _handle_scan(self, player_id: str, data: Dict[str, Any]) -> str:
-        return self._create_response("SCAN", 200, {"market_data": [
-            {"coin": coin, "price": price, "change_24h": f"{random.uniform(-10, 10):.1f}%"}
-            for coin, price in self.prices.items()
-        ]}, player_id)
-
-    def _handle_buy(self, player_id: str, data: Dict[str, Any]) -> str:
-        coin = data['coin']
-        amount = data['amount']
-        if coin in self.prices:
-            return self._create_response("BUY", 200, {
-                "message": f"Congrats! You've mined {amount} {coin}!",
-                "transaction": {
-                    "coin": coin,
-                    "amount": amount,
-                    "price": self.prices[coin],
-                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-                }
-            }, player_id)
-        return self._create_response("BUY", 400, {"error": "Invalid coin"}, player_id)
-
-    def _handle_sell(self, player_id: str, data: Dict[str, Any]) -> str:
-        coin = data['coin']
-        amount = data['amount']
-        if coin in self.prices:
-            return self._create_response("SELL", 200, {
-                "message": f"You've sold {amount} {coin}!",
-                "transaction": {
-                    "coin": coin,
-                    "amount": amount,
-                    "price": self.prices[coin],
-                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-                }
-            }, player_id)
-        return self._create_response("SELL", 400, {"error": "Invalid coin"}, player_id)
+    def _handle_scan(self, player_id: str, data: Dict[str, Any]) -> Response:
+        requested = data.get('coins') or list(self.prices)
+        unknown = [coin for coin in requested if coin not in self.prices]
+        if unknown:
+            return self._create_response("SCAN", 400, {"error": f"Invalid coin: {', '.join(unknown)}"}, player_id)
+        # ใช้ลำดับเหรียญของ server เป็น key ชุดของ key จึงมีจำกัด
+        key = tuple(coin for coin in self.prices if coin in requested)
+        snapshot = self.market_snapshot
+        cached = snapshot['bodies'].get(key)
+        if cached is None:
+            body = b'{"market_data":[' + b','.join(snapshot['entries'][coin] for coin in key) + b']}'
+            cached = snapshot['bodies'].setdefault(key, (body, {}))
+        body, checksums = cached
+        return self._create_response("SCAN", 200, body, player_id, checksums)
+
+    def _build_market_snapshot(self):
+        # serialize ราคาครั้งเดียวต่อ tick แล้วสลับทั้งก้อน request ที่กำลังอ่าน snapshot เก่าอยู่จึงไม่เห็นข้อมูลครึ่งๆ
+        self.market_snapshot = {
+            'entries': {
+                coin: codec.encode({"coin": coin, "price": price, "change_24h": f"{self.price_history[coin].change():.1f}%"})
+                for coin, price in self.prices.items()
+            },
+            'bodies': {}  # {tuple ของเหรียญ: (body ที่ encode แล้ว, {algorithm: checksum})}
+        }
+
+    def _handle_buy(self, player_id: str, data: Dict[str, Any]) -> Response:
+        return self._handle_trade(player_id, data, "BUY")
+
+    def _handle_sell(self, player_id: str, data: Dict[str, Any]) -> Response:
+        return self._handle_trade(player_id, data, "SELL")
+
+    def _handle_trade(self, player_id: str, data: Dict[str, Any], trade_type: str) -> Response:
+        session = self.sessions.get(player_id) if player_id else None
+        if session is None:
+            return self._create_response(trade_type, 401, {"error": "Not logged in"}, player_id)
+        coin = data.get('coin')
+        amount = data.get('amount')
+        if not isinstance(coin, str) or coin not in self.prices:
+            return self._create_response(trade_type, 400, {"error": "Invalid coin"}, player_id)
+        # nan และ inf ผ่าน amount <= 0 ได้ แล้วทำให้ total_value ที่ Leaderboard ใช้ bisect เรียงไม่ได้
+        if not isinstance(amount, (int, float)) or isinstance(amount, bool) or not 0 < amount < math.inf:
+            return self._create_response(trade_type, 400, {"error": "Invalid amount"}, player_id)
+
+        user = self.users[session.username]
+        with user['lock']:
+            price = self.prices[coin]
+            total_cost = amount * price
+            if trade_type == "BUY":
+                if user['balance'] < total_cost:
+                    return self._create_response(trade_type, 400, {"error": "Insufficient funds"}, player_id)
+                user['balance'] -= total_cost
+                user['portfolio'][coin] += amount
+                message = f"Congrats! You've mined {amount} {coin}!"
+            else:
+                if user['portfolio'][coin] < amount:
+                    return self._create_response(trade_type, 400, {"error": "Insufficient coins"}, player_id)
+                user['balance'] += total_cost
+                user['portfolio'][coin] -= amount
+                message = f"You've sold {amount} {coin}!"
+            transaction = {
+                "type": trade_type,
+                "coin": coin,
+                "amount": amount,
+                "price": price,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            }
+            user['transactions'].append(transaction)
+            balance = user['balance']
+            total_value = self._total_value(user)
+        self.leaderboard.update(session.username, total_value)
+
+        return self._create_response(trade_type, 200, {
+            "message": message,
+            "transaction": transaction,
+            "balance": balance
+        }, player_id)
 
-    def _handle_check(self, player_id: str, data: Dict[str, Any]) -> str:
-        check_type = data['type']
+    def _handle_check(self, player_id: str, data: Dict[str, Any]) -> Response:
+        session = self.sessions.get(player_id) if player_id else None
+        if session is None:
+            return self._create_response("CHECK", 401, {"error": "Not logged in"}, player_id)
+        user = self.users[session.username]
+        check_type = data.get('type')
         if check_type == 'portfolio':
-            return self._create_response("CHECK", 200, {
-                "portfolio": {
-                    "BTC": 1.5,
-                    "ETH": 10,
-                    "DOGE": 1000
-                },
-                "balance": 25000
-            }, player_id)
+            with user['lock']:
+                body = {
+                    "portfolio": dict(user['portfolio']),
+                    "balance": user['balance'],
+                    "total_value": self._total_value(user)
+                }
+            return self._create_response("CHECK", 200, body, player_id)
+        if check_type == 'history':
+            with user['lock']:
+                transactions = list(user['transactions'])
+            return self._create_response("CHECK", 200, {"transactions": transactions}, player_id)
         return self._create_response("CHECK", 400, {"error": "Invalid check type"}, player_id)
 
-    def _handle_rank(self, player_id: str, data: Dict[str, Any]) -> str:
-        return self._create_response("RANK", 200, {
-            "leaderboard": [
-                {"username": "Satoshi", "total_value": 100000, "rank": 1},
-                {"username": "Vitalik", "total_value": 90000, "rank": 2},
-                {"username": "Elon", "total_value": 80000, "rank": 3}
-            ]
-        }, player_id)
+    def _handle_rank(self, player_id: str, data: Dict[str, Any]) -> Response:
+        body = {"leaderboard": self.leaderboard.top(LEADERBOARD_SIZE)}
+        session = self.sessions.get(player_id) if player_id else None
+        if session is not None:
+            body["rank"] = self.leaderboard.rank_of(session.username)
+        return self._create_response("RANK", 200, body, player_id)
 
-    def _handle_ping(self, player_id: str, data: Dict[str, Any]) -> str:
+    def _handle_ping(self, player_id: str, data: Dict[str, Any]) -> Response:
         return self._create_response("PONG", 200, {}, player_id)
 
     def _update_prices(self):
         while True:
-            time.sleep(5)
+            time.sleep(PRICE_UPDATE_INTERVAL)
             for coin in self.prices:
                 self.prices[coin] *= (1 + (random.random() - 0.5) * 0.02)
+                self.price_history[coin].push(self.prices[coin])
+            self._build_market_snapshot()
+            self.leaderboard.rebuild({username: self._total_value(user) for username, user in list(self.users.items())})
 
-    @staticmethod
-    def _create_response(command: str, status_code: int, body: Dict[str, Any], player_id: str = None) -> str:
-        status_phrase = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 500: "Internal Server Error"}
-        body_json = json.dumps(body)
-        checksum = CTSPServer._calculate_checksum(body_json)
-        
-        headers = f"CTSP/1.0 {command}\n"
-        headers += f"Status: {status_code} {status_phrase.get(status_code, '')}\n"
-        if player_id:
-            headers += f"Player-ID: {player_id}\n"
-            headers += f"Sequence: {CTSPServer._get_next_sequence(player_id)}\n"
-        headers += f"Content-Length: {len(body_json)}\n"
-        headers += f"Checksum: {checksum}\n"
-        
-        return f"{headers}\n{body_json}"
+    def _create_response(self, command: str, status_code: int, body, player_id: str = None, checksums: Dict[str, str] = None) -> Response:
+        # body ที่ serialize และ encode ไว้แล้ว (เช่น market snapshot) ส่งมาเป็น bytes ได้เลย
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8') if isinstance(body, str) else codec.encode(body)
+        session = self.sessions.get(player_id) if player_id else None
+        algorithm = session.checksum if session else DEFAULT_CHECKSUM
+        if checksums is None:
+            checksum = CHECKSUM_ALGORITHMS[algorithm](body)
+        else:
+            checksum = checksums.get(algorithm)
+            if checksum is None:
+                checksum = checksums.setdefault(algorithm, CHECKSUM_ALGORITHMS[algorithm](body))
 
-    @staticmethod
-    def _calculate_checksum(payload: str) -> str:
-        return hashlib.md5(payload.encode('utf-8')).hexdigest()[:16]
+        headers = status_header(status_code)
+        if session:
+            headers += SESSION_HEADERS % (player_id.encode(), session.next_response_sequence())
+        headers += CHECKSUM_TRAILERS[algorithm] % (len(body), checksum.encode())
+        command_line = COMMAND_LINES.get(command) or f"CTSP/1.0 {command}\n".encode()
+        return [command_line, headers, body]
 
     @staticmethod
-    def _verify_checksum(payload: str, checksum: str) -> bool:
-        return CTSPServer._calculate_checksum(payload) == checksum
+    def _calculate_checksum(payload: str, algorithm: str = DEFAULT_CHECKSUM) -> str:
+        return CHECKSUM_ALGORITHMS[algorithm](payload.encode('utf-8'))
 
     @staticmethod
-    def _get_next_sequence(player_id: str) -> int:
-        if player_id not in CTSPServer.sequence_numbers:
-            CTSPServer.sequence_numbers[player_id] = 0
-        CTSPServer.sequence_numbers[player_id] += 1
-        return CTSPServer.sequence_numbers[player_id]
+    def _verify_checksum(payload: str, checksum: str, algorithm: str = DEFAULT_CHECKSUM) -> bool:
+        return CTSPServer._calculate_checksum(payload, algorithm) == checksum
 
 if __name__ == "__main__":
     server = CTSPServer()
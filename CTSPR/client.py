@@ -1,10 +1,12 @@
 import asyncio
 import json
-import aioconsole
-from typing import Dict, Any
+import os
+from typing import Dict, List, Any, Optional
+
+SUBSCRIPTION_QUEUE_SIZE = 100  # push ที่ค้างเกินนี้ทิ้งอันเก่าสุด (เช่น PRICE_UPDATE สนใจแค่อันล่าสุด)
 
 class CTSClient:
-    def __init__(self, host='localhost', port=6001):
+    def __init__(self, host='localhost', port=6001, admin_token: Optional[str] = None):
         self.host = host
         self.port = port
         self.reader: asyncio.StreamReader = None
@@ -14,44 +16,113 @@ class CTSClient:
         self.prices: Dict[str, float] = {}
         self.portfolio: Dict[str, float] = {}
         self.balance: float = 0
+        self.session_tokens: Dict[str, str] = {}  # {username: token} ใช้ login ซ้ำหลัง reconnect โดยไม่ต้องรอ KDF
+        self.next_request_id = 0
+        self.pending: Dict[int, asyncio.Future] = {}  # {request_id: future ที่รอ response}
+        self.subscriptions: Dict[str, List[asyncio.Queue]] = {}  # {ชนิด push: คิวของผู้ฟัง}
+        self.reader_task: asyncio.Task = None
+        self.write_lock = asyncio.Lock()
+        self.admin_token = admin_token or os.environ.get('CTSP_ADMIN_TOKEN')  # ใช้กับคำขอ /admin
 
     async def connect(self):
         self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        # อ่าน socket จาก task นี้ที่เดียว แล้วแจก response ให้ future ตาม Request-ID ส่วน push ส่งเข้าคิวตามชนิด
+        self.reader_task = asyncio.create_task(self._read_loop())
         asyncio.create_task(self.listen_for_updates())
 
-    async def send_request(self, method: str, resource: str, body: Any = None) -> Dict[str, Any]:
+    async def send_request(self, method: str, resource: str, body: Any = None, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
         if not self.writer:
             await self.connect()
+        if self.reader_task.done():
+            raise ConnectionError("Connection closed by server")
 
+        self.next_request_id += 1
+        request_id = self.next_request_id
         request = f"CTSP/1.0 {method} {resource}\n"
+        request += f"Request-ID: {request_id}\n"
+        for name, value in (headers or {}).items():
+            request += f"{name}: {value}\n"
         if body:
-            body_json = json.dumps(body)
-            request += f"Content-Length: {len(body_json)}\n\n{body_json}"
+            body_json = json.dumps(body).encode()
+            request = request.encode() + f"Content-Length: {len(body_json)}\n\n".encode() + body_json
         else:
-            request += "\n"
-
-        self.writer.write(request.encode())
-        await self.writer.drain()
-
-        response = await self.reader.read(1024)
-        response_str = response.decode()
-
-        lines = response_str.split('\n')
-        status_line = lines[0].split()
-        status_code = int(status_line[1])
-        body = json.loads(lines[-1]) if lines[-1] else {}
-
-        return {"status": status_code, "body": body}
+            request = (request + "\n").encode()
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            async with self.write_lock:
+                self.writer.write(request)
+                await self.writer.drain()
+            return await future
+        finally:
+            self.pending.pop(request_id, None)
+
+    def subscribe(self, message_type: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+        self.subscriptions.setdefault(message_type, []).append(queue)
+        return queue
+
+    def unsubscribe(self, message_type: str, queue: asyncio.Queue):
+        queues = self.subscriptions.get(message_type, [])
+        if queue in queues:
+            queues.remove(queue)
+
+    async def _read_loop(self):
+        error: Exception = ConnectionError("Connection closed by server")
+        try:
+            while True:
+                try:
+                    head = await self.reader.readuntil(b'\n\n')
+                except asyncio.IncompleteReadError:
+                    break
+                lines = head.decode().split('\n')
+                headers = {}
+                for line in lines[1:]:
+                    key, _, value = line.partition(': ')
+                    if key:
+                        headers[key] = value
+                length = int(headers.get('Content-Length', 0))
+                data = (await self.reader.readexactly(length)).decode() if length else ''
+                try:
+                    body = json.loads(data) if data else {}
+                except ValueError:
+                    body = data  # ข้อความธรรมดาเช่น "Login successful"
+                response = {"status": int(lines[0].split()[1]), "body": body}
+
+                if 'Request-ID' in headers:
+                    future = self.pending.get(int(headers['Request-ID']))
+                    if future is not None and not future.done():
+                        future.set_result(response)
+                elif 'Push' in headers:
+                    for queue in list(self.subscriptions.get(headers['Push'], [])):
+                        if queue.full():
+                            queue.get_nowait()
+                        queue.put_nowait(body)
+        except Exception as e:
+            error = e
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
 
     async def register(self, username: str, password: str) -> Dict[str, Any]:
         return await self.send_request('REGISTER', '/auth', {'username': username, 'password': password})
 
     async def login(self, username: str, password: str) -> Dict[str, Any]:
-        response = await self.send_request('LOGIN', '/auth', {'username': username, 'password': password})
+        credentials = {'username': username, 'password': password}
+        if username in self.session_tokens:
+            credentials['token'] = self.session_tokens[username]
+        response = await self.send_request('LOGIN', '/auth', credentials)
         if response['status'] == 200:
             self.logged_in = True
             self.username = username
+            if isinstance(response['body'], dict):
+                self.session_tokens[username] = response['body']['token']
+                response['body'] = response['body']['message']
             await self.update_portfolio()
+        else:
+            self.session_tokens.pop(username, None)
         return response
 
     async def logout(self) -> Dict[str, Any]:
@@ -59,6 +130,7 @@ class CTSClient:
             response = await self.send_request('LOGOUT', '/auth')
             if response['status'] == 200:
                 self.logged_in = False
+                self.session_tokens.pop(self.username, None)
                 self.username = None
                 self.portfolio = {}
                 self.balance = 0
@@ -68,8 +140,18 @@ class CTSClient:
     async def get_prices(self) -> Dict[str, Any]:
         return await self.send_request('GET_PRICES', '/market')
 
-    async def trade(self, trade_type: str, coin: str, amount: float) -> Dict[str, Any]:
-        response = await self.send_request(trade_type, '/trade', {'coin': coin, 'amount': amount})
+    async def get_candles(self, coin: str, interval: str = '1m', start: float = None, end: float = None) -> Dict[str, Any]:
+        query = {'coin': coin, 'interval': interval}
+        if start is not None:
+            query['start'] = start
+        if end is not None:
+            query['end'] = end
+        return await self.send_request('GET_CANDLES', '/market', query)
+
+    async def trade(self, trade_type: str, coin: str, amount: float, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        # ส่ง idempotency_key เดิมตอน retry server จะตอบผลเดิมแทนการซื้อขายซ้ำ
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else None
+        response = await self.send_request(trade_type, '/trade', {'coin': coin, 'amount': amount}, headers)
         if response['status'] == 200:
             await self.update_portfolio()
         return response
@@ -83,6 +165,10 @@ class CTSClient:
     async def get_report(self) -> Dict[str, Any]:
         return await self.send_request('GET_REPORT', '/report')
 
+    async def get_stats(self, prometheus: bool = False) -> Dict[str, Any]:
+        headers = {'Admin-Token': self.admin_token} if self.admin_token else None
+        return await self.send_request('GET_STATS', '/admin', {'format': 'prometheus'} if prometheus else None, headers)
+
     async def update_portfolio(self):
         portfolio_response = await self.get_portfolio()
         if portfolio_response['status'] == 200:
@@ -92,12 +178,12 @@ class CTSClient:
             self.balance = report_response['body']['balance']
 
     async def listen_for_updates(self):
+        updates = asyncio.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+        for message_type in ('PRICE_UPDATE', 'NEW_TRANSACTION'):
+            self.subscriptions.setdefault(message_type, []).append(updates)
         while True:
             try:
-                data = await self.reader.read(1024)
-                if not data:
-                    break
-                message = json.loads(data.decode())
+                message = await updates.get()
                 if message['type'] == 'PRICE_UPDATE':
                     self.prices = message['data']
                     await self.display_prices()
@@ -109,6 +195,13 @@ class CTSClient:
                 print(f"Error in listening for updates: {e}")
                 break
 
+    async def close(self):
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+            await self.writer.wait_closed()
+
     async def display_prices(self):
         print("\nCurrent Prices:")
         for coin, price in self.prices.items():
@@ -134,6 +227,7 @@ async def print_menu():
     print("0. Exit")
 
 async def main():
+    import aioconsole  # ใช้เฉพาะเมนูแบบ interactive ใช้ CTSClient เป็น library ได้โดยไม่ต้องติดตั้ง
     client = CTSClient()
 
     while True:
@@ -1,27 +1,99 @@
 import asyncio
-import json
-import random
+import time
+import threading
+import os
+import sys
+import hashlib
+import hmac
+import math
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple, Union, TypedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.market import CandleStore, MarketSimulator, parse_candle_query
+from common.auth import DUMMY_PASSWORD_HASH, SessionCache, hash_password, is_admin_token, verify_password
+from common.codec import codec
+from common.response import response_head
+from common.profiler import PROFILE_INTERVAL, SamplingProfiler
+from common.stats import ServerStats
+from common.idempotency import IDEMPOTENCY_KEY_LIMIT, IdempotencyEntry, IdempotencyStore
+
+
+class TradeRequest(TypedDict):
+    coin: str
+    amount: float
+
+REQUEST_DECODERS = {
+    ('BUY', '/trade'): codec.decoder(TradeRequest),
+    ('SELL', '/trade'): codec.decoder(TradeRequest)
+}
+
+PRICE_TICK_INTERVAL = 1  # วินาทีต่อ tick ไม่ขึ้นกับจำนวนเหรียญ
+
+KDF_WORKERS = 4  # จำนวน KDF ที่คำนวณพร้อมกันได้ ที่เหลือรอคิว
+MAX_HEADER_SIZE = 8 * 1024  # limit ของ StreamReader header ที่ยาวกว่านี้ readuntil จะไม่รอต่อ
+MAX_REQUEST_SIZE = 1024 * 1024  # header + body ต่อคำขอ เท่ากับ CTSP
+ADMIN_TOKEN = os.environ.get('CTSP_ADMIN_TOKEN', '')  # request ไป /admin ต้องส่ง Admin-Token ตรงกับค่านี้ ไม่ตั้งก็ปิด /admin
+ADMIN_REQUESTS = {('GET_STATS', '/admin'), ('PROFILE', '/admin')}
+
+Response = Tuple[int, bytes]  # (status code, body ที่ encode แล้ว)
+
+class BadRequest(Exception):
+    def __init__(self, status, message, extra_headers: bytes = b''):
+        super().__init__(message)
+        self.status = status
+        self.extra_headers = extra_headers  # Request-ID ของคำขอที่ผิด ถ้ารู้แล้ว
+
+class IdempotencyCache(IdempotencyStore):
+    # ทุกอย่างรันบน event loop เดียวจึงไม่ต้องล็อก รอคำขอแรกด้วย asyncio.Event ที่สร้างเมื่อมีคำขอซ้ำมารอเท่านั้น
+    async def claim(self, username: str, key: str, fingerprint: bytes) -> Tuple[IdempotencyEntry, bool]:
+        # คืน (entry, True) ถ้าผู้เรียกต้องทำคำขอเอง ไม่งั้นรอจนคำขอแรกเสร็จแล้วคืน entry ของคำขอนั้น
+        entry = self.find(username, key)
+        if entry is not None and entry.pending:
+            if entry.done is None:
+                entry.done = asyncio.Event()
+            await entry.done.wait()
+        return self.resolve(username, key, entry, fingerprint)
+
+    def complete(self, entry: IdempotencyEntry, response: Response):
+        super().complete(entry, response)
+        if entry.done is not None:
+            entry.done.set()
+
+    def discard(self, username: str, key: str, entry: IdempotencyEntry):
+        super().discard(username, key, entry)
+        if entry.done is not None:
+            entry.done.set()
 
 class CTSServer:
-    def __init__(self, host: str = 'localhost', port: int = 6001):
+    def __init__(self, host: str = 'localhost', port: int = 6001, simulator: Optional[MarketSimulator] = None):
         self.host = host
         self.port = port
         self.clients: Dict[str, asyncio.StreamWriter] = {}
-        self.prices: Dict[str, float] = {'AA': 100.0, 'BB': 200.0, 'CC': 300.0}
+        # ส่ง simulator ของตัวเองเข้ามาได้ เช่น MarketSimulator.generate(5000, seed=1) ตอน load test
+        self.simulator = simulator or MarketSimulator({'AA': 100.0, 'BB': 200.0, 'CC': 300.0})
+        self.prices: Dict[str, float] = self.simulator.prices()
         self.users: Dict[str, Dict[str, Any]] = {
             'beer': {
-                'password': '1234',
+                'password': hash_password('1234'),
                 'portfolio': {'AA': 10, 'BB': 20, 'CC': 30},
                 'balance': 5000
             },
         }
         self.transactions: List[Dict[str, Any]] = []
+        self.stats = ServerStats()
+        self.profiler = SamplingProfiler()
+        # pbkdf2_hmac ปล่อย GIL ระหว่างคำนวณ จึงใช้ thread pool ได้โดยไม่ต้องแยก process
+        self.kdf_executor = ThreadPoolExecutor(max_workers=KDF_WORKERS)
+        self.sessions = SessionCache()
+        self.idempotency = IdempotencyCache()
+        self.candles = CandleStore(self.prices)
+        self.candles.add_ticks(self.prices)
 
     async def start(self):
         server = await asyncio.start_server(
-            self._handle_client, self.host, self.port)
+            self._handle_client, self.host, self.port, limit=MAX_HEADER_SIZE)
         
         print(f"Server listening on {self.host}:{self.port}")
         
@@ -33,108 +105,271 @@ class CTSServer:
     async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         client_id = f"{writer.get_extra_info('peername')}"
         self.clients[client_id] = writer
+        self.stats.connection_opened()
         try:
             while True:
-                data = await reader.read(1024)
-                if not data:
+                # ตัด frame ตาม Content-Length client จึงส่ง request ต่อกันหลายอันโดยไม่ต้องรอ response ได้
+                try:
+                    head = await reader.readuntil(b'\n\n')
+                except asyncio.IncompleteReadError:
                     break
-                message = data.decode()
-                response = await self._process_request(client_id, message)
-                writer.write(response.encode())
+                except asyncio.LimitOverrunError:
+                    raise BadRequest(413, "Request headers too large")
+                headers = {}
+                for line in head.decode().split('\n')[1:]:
+                    key, _, value = line.partition(': ')
+                    if key:
+                        headers[key] = value
+                # ตอบ Request-ID กลับไปให้ client จับคู่ response กับ request ได้แม้มี push แทรกมา
+                extra_headers = b"Request-ID: %s\n" % headers['Request-ID'].encode() if 'Request-ID' in headers else b''
+                length = self._content_length(headers, len(head), extra_headers)
+                body = await reader.readexactly(length) if length else b''
+                writer.writelines(await self._process_request(client_id, (head + body).decode(), extra_headers))
                 await writer.drain()
+        except BadRequest as e:
+            # ขนาดคำขอผิดจนตัด frame ถัดไปไม่ได้แล้ว ตอบ error แล้วปิด connection
+            writer.writelines(self._encode_response(self._create_response(e.status, str(e)), e.extra_headers))
         except Exception as e:
             print(f"Error handling client: {e}")
         finally:
             del self.clients[client_id]
+            self.stats.connection_closed()
             writer.close()
             await writer.wait_closed()
 
-    async def _process_request(self, client_id: str, data: str) -> str:
+    @staticmethod
+    def _content_length(headers: Dict[str, str], head_size: int, extra_headers: bytes) -> int:
+        # ตรวจก่อน readexactly peer จึงสั่งให้รอหรือจอง memory ตาม Content-Length ที่อ้างมาไม่ได้
+        try:
+            length = int(headers.get('Content-Length', 0))
+        except ValueError:
+            raise BadRequest(400, "Invalid Content-Length", extra_headers)
+        if length < 0:
+            raise BadRequest(400, "Invalid Content-Length", extra_headers)
+        if length > MAX_REQUEST_SIZE - head_size:
+            raise BadRequest(413, f"Request limited to {MAX_REQUEST_SIZE} bytes", extra_headers)
+        return length
+
+    async def _process_request(self, client_id: str, data: str, extra_headers: bytes = b'') -> List[bytes]:
+        started = time.perf_counter()
+        handler_name = 'unknown'  # method ที่ไม่รู้จักรวมไว้ชื่อเดียว label จะได้ไม่บวมตามที่ client ส่งมา
+        idempotency_key = None
+        admin_token = None
         try:
             lines = data.split('\n')
             request_line = lines[0].split()
             method, resource = request_line[1], request_line[2]
             body = lines[-1] if len(lines) > 1 else ''
+            for line in lines[1:]:
+                if not line:
+                    break
+                key, _, value = line.partition(': ')
+                if key == 'Idempotency-Key':
+                    idempotency_key = value
+                elif key == 'Admin-Token':
+                    admin_token = value
 
             request_handlers = {
                 ('REGISTER', '/auth'): self._register_user,
                 ('LOGIN', '/auth'): self._login_user,
                 ('LOGOUT', '/auth'): self._logout_user,
                 ('GET_PRICES', '/market'): self._get_prices,
+                ('GET_CANDLES', '/market'): self._get_candles,
                 ('BUY', '/trade'): self._process_buy,
                 ('SELL', '/trade'): self._process_sell,
                 ('GET_PORTFOLIO', '/portfolio'): self._get_portfolio,
                 ('GET_HISTORY', '/history'): self._get_history,
-                ('GET_REPORT', '/report'): self._get_report
+                ('GET_REPORT', '/report'): self._get_report,
+                ('GET_STATS', '/admin'): self._get_stats,
+                ('PROFILE', '/admin'): self._profile
             }
 
             handler = request_handlers.get((method, resource))
             if handler:
-                return await handler(client_id, json.loads(body) if body else None)
+                handler_name = f"{method} {resource}"
+                if (method, resource) in ADMIN_REQUESTS and not is_admin_token(admin_token, ADMIN_TOKEN):
+                    response = self._create_response(403, "Admin token required")
+                elif idempotency_key is not None and resource == '/trade' and hasattr(self.clients[client_id], 'username'):
+                    response = await self._process_idempotent(client_id, idempotency_key, handler, method, resource, body)
+                else:
+                    response = await handler(client_id, self._decode_body(method, resource, body))
             else:
-                return self._create_response(400, "Bad Request")
+                response = self._create_response(400, "Bad Request")
+        except BadRequest as e:
+            response = self._create_response(e.status, str(e))
         except Exception as e:
-            return self._create_response(500, f"Internal Server Error: {str(e)}")
+            response = self._create_response(500, f"Internal Server Error: {str(e)}")
+        parts = self._encode_response(response, extra_headers)
+        self.stats.record(handler_name, time.perf_counter() - started, response[0] >= 400, len(data), len(parts[0]) + len(parts[1]))
+        return parts
+
+    @staticmethod
+    def _decode_body(method: str, resource: str, body: str) -> Any:
+        if not body:
+            return None
+        try:
+            return REQUEST_DECODERS.get((method, resource), codec.decode)(body)
+        except ValueError as e:  # JSON เสียหรือ type ไม่ตรง schema ของ msgspec
+            raise BadRequest(400, f"Invalid body: {e}")
 
-    async def _register_user(self, client_id: str, user_data: Dict[str, str]) -> str:
+    async def _process_idempotent(self, client_id: str, key: str, handler, method: str, resource: str, body: str) -> Response:
+        # retry หลัง timeout ที่ส่ง Idempotency-Key เดิมได้คำตอบเดิมโดยไม่ทำ trade ซ้ำ
+        if not key or len(key) > IDEMPOTENCY_KEY_LIMIT:
+            return self._create_response(400, f"Idempotency-Key must be 1-{IDEMPOTENCY_KEY_LIMIT} characters")
+        username = self.clients[client_id].username
+        fingerprint = hashlib.sha256(f"{method}\n{body}".encode()).digest()
+        entry, owner = await self.idempotency.claim(username, key, fingerprint)
+        if not owner:
+            if not hmac.compare_digest(entry.fingerprint, fingerprint):
+                return self._create_response(400, "Idempotency-Key reused for a different request")
+            return entry.response
+        try:
+            response = await handler(client_id, self._decode_body(method, resource, body))
+        except BaseException:
+            self.idempotency.discard(username, key, entry)
+            raise
+        self.idempotency.complete(entry, response)
+        return response
+
+    async def _get_stats(self, client_id: str, query: Optional[Dict[str, Any]]) -> Response:
+        if query and query.get('format') == 'prometheus':
+            return self._create_response(200, self.stats.prometheus())
+        return self._create_response(200, codec.encode(self.stats.snapshot()))
+
+    async def _profile(self, client_id: str, options: Optional[Dict[str, Any]]) -> Response:
+        options = options or {}
+        action = options.get('action', 'status')
+        if action == 'start':
+            try:
+                duration = float(options.get('duration', 30))
+                interval = float(options.get('interval_ms', PROFILE_INTERVAL * 1000)) / 1000
+                started = self.profiler.start(duration, interval, bool(options.get('memory', False)))
+            except (TypeError, ValueError):
+                return self._create_response(400, "duration and interval_ms must be positive numbers")
+            if not started:
+                return self._create_response(400, "Profiler already running")
+            return self._create_response(200, "Profiler started")
+        if action == 'stop':
+            # stop รอ thread ของ profiler (และ snapshot ของ tracemalloc) จึงไม่ทำใน event loop
+            result = await asyncio.get_running_loop().run_in_executor(None, self.profiler.stop)
+            if result is None:
+                return self._create_response(400, "Profiler has not run")
+            return self._create_response(200, codec.encode(result))
+        if action == 'status':
+            return self._create_response(200, codec.encode({'running': self.profiler.running(), 'result': self.profiler.result}))
+        return self._create_response(400, "Invalid action, use start, stop or status")
+
+    async def _register_user(self, client_id: str, user_data: Dict[str, str]) -> Response:
         username = user_data['username']
         if username in self.users:
             return self._create_response(400, "Username already exists")
+        password_hash = await asyncio.get_running_loop().run_in_executor(self.kdf_executor, hash_password, user_data['password'])
+        if username in self.users:  # มีคน register ชื่อเดียวกันระหว่างรอ KDF
+            return self._create_response(400, "Username already exists")
         self.users[username] = {
-            'password': user_data['password'],
+            'password': password_hash,
             'portfolio': {'AA': 0, 'BB': 0, 'CC': 0},
             'balance': 10000  # Starting balance
         }
         return self._create_response(200, "User registered successfully")
 
-    async def _login_user(self, client_id: str, login_data: Dict[str, str]) -> str:
+    async def _login_user(self, client_id: str, login_data: Dict[str, str]) -> Response:
         username = login_data['username']
-        password = login_data['password']
-        if username in self.users and self.users[username]['password'] == password:
-            self.clients[client_id].username = username
-            return self._create_response(200, "Login successful")
-        return self._create_response(401, "Invalid credentials")
+        token = login_data.get('token')
+        # token ที่ยังไม่หมดอายุ (เช่นตอน reconnect) ข้าม KDF ไปเลย
+        if not (token and self.sessions.check(token, username)):
+            user = self.users.get(username)
+            password = login_data.get('password')
+            if password is None:
+                return self._create_response(401, "Invalid credentials")
+            # KDF ใช้เวลาหลายสิบ ms ถ้าคำนวณใน event loop ทุก request ของทุก client จะค้างตาม
+            valid = await asyncio.get_running_loop().run_in_executor(
+                self.kdf_executor, verify_password, password, user['password'] if user else DUMMY_PASSWORD_HASH)
+            if not (valid and user):
+                return self._create_response(401, "Invalid credentials")
+            token = self.sessions.issue(username)
+        writer = self.clients.get(client_id)
+        if writer is None:  # client ปิดไปแล้วระหว่างรอ KDF
+            return self._create_response(400, "Connection closed")
+        writer.username = username
+        writer.token = token
+        return self._create_response(200, codec.encode({"message": "Login successful", "token": token}))
 
-    async def _logout_user(self, client_id: str, _: None) -> str:
+    async def _logout_user(self, client_id: str, _: None) -> Response:
         if hasattr(self.clients[client_id], 'username'):
             del self.clients[client_id].username
+            self.sessions.revoke(getattr(self.clients[client_id], 'token', None))
             return self._create_response(200, "Logout successful")
         return self._create_response(400, "No user logged in")
 
-    async def _get_prices(self, client_id: str, _: None) -> str:
-        return self._create_response(200, json.dumps(self.prices))
+    async def _get_prices(self, client_id: str, _: None) -> Response:
+        return self._create_response(200, codec.encode(self.prices))
+
+    async def _get_candles(self, client_id: str, query: Dict[str, Any]) -> Response:
+        try:
+            coin, interval, start, end, limit = parse_candle_query(query or {}, self.prices)
+        except ValueError as e:
+            return self._create_response(400, str(e))
+        candles = self.candles.query(coin, interval, start, end, limit)
+        return self._create_response(200, codec.encode({
+            'coin': coin,
+            'interval': interval,
+            'fields': ['time', 'open', 'high', 'low', 'close', 'volume'],
+            'candles': candles
+        }))
 
-    async def _process_buy(self, client_id: str, trade_data: Dict[str, Any]) -> str:
+    async def _process_buy(self, client_id: str, trade_data: Dict[str, Any]) -> Response:
         return await self._process_trade(client_id, trade_data, 'buy')
 
-    async def _process_sell(self, client_id: str, trade_data: Dict[str, Any]) -> str:
+    async def _process_sell(self, client_id: str, trade_data: Dict[str, Any]) -> Response:
         return await self._process_trade(client_id, trade_data, 'sell')
 
-    async def _process_trade(self, client_id: str, trade_data: Dict[str, Any], trade_type: str) -> str:
+    async def _process_trade(self, client_id: str, trade_data: Dict[str, Any], trade_type: str) -> Response:
         if not hasattr(self.clients[client_id], 'username'):
             return self._create_response(401, "User not logged in")
         
         username = self.clients[client_id].username
-        coin = trade_data['coin']
-        amount = trade_data['amount']
-        price = self.prices[coin]
-        total_cost = amount * price
+        trade_data = trade_data or {}
+        coin = trade_data.get('coin')
+        amount = trade_data.get('amount')
+        price = self.prices.get(coin) if isinstance(coin, str) else None
         
-        user = self.users[username]
+        error = self._apply_trade(self.users[username], trade_type, coin, amount, price)
+        if error:
+            return self._create_response(400, error)
+        
+        await self._record_transaction(username, trade_type, coin, amount, price)
+        self.candles.add_tick(coin, price, amount)
+        
+        return self._create_response(200, f"{trade_type.capitalize()} order processed for {amount} {coin} at {price}")
+
+    @staticmethod
+    def _trade_error(amount: Any, price: Optional[float]) -> Optional[str]:
+        # price เป็น None เมื่อไม่มีเหรียญนี้ จำนวนต้องเป็นตัวเลขบวกที่จำกัด ติดลบจะกลับทิศ trade และไหลเข้า volume ของแท่งเทียน
+        if price is None:
+            return "Unknown coin"
+        if not isinstance(amount, (int, float)) or isinstance(amount, bool) or not 0 < amount < math.inf:
+            return "Invalid amount"
+        return None
+
+    @staticmethod
+    def _apply_trade(user: Dict[str, Any], trade_type: str, coin: str, amount: float, price: Optional[float]) -> Optional[str]:
+        # คืนข้อความ error ถ้าทำไม่ได้ None ถ้าสำเร็จ ทั้งหมดรันใน event loop จึงไม่ต้องล็อก
+        error = CTSServer._trade_error(amount, price)
+        if error:
+            return error
+        total_cost = amount * price
         if trade_type == 'buy':
             if user['balance'] < total_cost:
-                return self._create_response(400, "Insufficient funds")
+                return "Insufficient funds"
             user['balance'] -= total_cost
-            user['portfolio'][coin] += amount
+            user['portfolio'][coin] = user['portfolio'].get(coin, 0) + amount
         else:  # sell
-            if user['portfolio'][coin] < amount:
-                return self._create_response(400, "Insufficient coins")
+            if user['portfolio'].get(coin, 0) < amount:
+                return "Insufficient coins"
             user['balance'] += total_cost
             user['portfolio'][coin] -= amount
-        
-        await self._record_transaction(username, trade_type, coin, amount, price)
-        
-        return self._create_response(200, f"{trade_type.capitalize()} order processed for {amount} {coin} at {price}")
+        return None
 
     async def _record_transaction(self, username: str, trade_type: str, coin: str, amount: float, price: float):
         transaction = {
@@ -148,60 +383,69 @@ class CTSServer:
         self.transactions.append(transaction)
         await self._notify_clients('NEW_TRANSACTION', transaction)
 
-    async def _get_portfolio(self, client_id: str, _: None) -> str:
+    async def _get_portfolio(self, client_id: str, _: None) -> Response:
         if not hasattr(self.clients[client_id], 'username'):
             return self._create_response(401, "User not logged in")
         username = self.clients[client_id].username
-        return self._create_response(200, json.dumps(self.users[username]['portfolio']))
+        return self._create_response(200, codec.encode(self.users[username]['portfolio']))
 
-    async def _get_history(self, client_id: str, _: None) -> str:
+    async def _get_history(self, client_id: str, _: None) -> Response:
         if not hasattr(self.clients[client_id], 'username'):
             return self._create_response(401, "User not logged in")
         username = self.clients[client_id].username
         user_transactions = [t for t in self.transactions if t['username'] == username]
-        return self._create_response(200, json.dumps(user_transactions))
+        return self._create_response(200, codec.encode(user_transactions))
 
-    async def _get_report(self, client_id: str, _: None) -> str:
+    async def _get_report(self, client_id: str, _: None) -> Response:
         if not hasattr(self.clients[client_id], 'username'):
             return self._create_response(401, "User not logged in")
         username = self.clients[client_id].username
         user = self.users[username]
-        total_value = user['balance'] + sum(user['portfolio'][coin] * self.prices[coin] for coin in self.prices)
+        total_value = user['balance'] + sum(amount * self.prices.get(coin, 0.0) for coin, amount in user['portfolio'].items())
         report = {
             'balance': user['balance'],
             'portfolio': user['portfolio'],
             'total_value': total_value,
             'profit_loss': total_value - 10000  # Assuming starting balance was 10000
         }
-        return self._create_response(200, json.dumps(report))
+        return self._create_response(200, codec.encode(report))
 
     async def _update_prices(self):
+        # นับเวลาจาก deadline ของ tick ก่อน เวลาที่ใช้คำนวณจึงไม่ทำให้ tick ช้าลงเมื่อมีเหรียญมากขึ้น
+        next_tick = time.monotonic()
         while True:
-            await asyncio.sleep(1)  # Update prices every second
+            next_tick += PRICE_TICK_INTERVAL
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
             old_prices = self.prices.copy()
-            for coin in self.prices:
-                self.prices[coin] *= (1 + (random.random() - 0.5) * 0.02)  # Random price fluctuation ±1%
+            prices = self.simulator.step()
+            self.prices.update(prices)
+            self.candles.add_ticks(prices)
             if self.prices != old_prices:
                 await self._notify_clients('PRICE_UPDATE', self.prices)
 
     async def _notify_clients(self, notification_type: str, data: Any):
-        message = json.dumps({
+        message = codec.encode({
             'type': notification_type,
             'data': data
         })
-        for client in self.clients.values():
+        # push ไม่มี Request-ID แต่มี header Push บอกชนิดข้อความแทน
+        push = self._encode_response(self._create_response(200, message), b"Push: %s\n" % notification_type.encode())
+        for client in list(self.clients.values()):
             try:
-                client.write(self._create_response(200, message).encode())
+                client.writelines(push)
                 await client.drain()
             except Exception as e:
                 print(f"Error notifying client: {e}")
 
     @staticmethod
-    def _create_response(status_code: int, body: str) -> str:
-        status_phrase = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 500: "Internal Server Error"}
-        headers = f"CTSP/1.0 {status_code} {status_phrase.get(status_code, '')}\n"
-        headers += f"Content-Length: {len(body)}\n"
-        return f"{headers}\n{body}"
+    def _encode_response(response: Response, extra_headers: bytes = b'') -> List[bytes]:
+        # คืน [header, body] แยกกัน writelines ส่งต่อกันโดยไม่ต้องต่อ body เข้ากับ header
+        status_code, body = response
+        return [response_head(status_code, extra_headers, len(body)), body]
+
+    @staticmethod
+    def _create_response(status_code: int, body: Union[str, bytes]) -> Response:
+        return status_code, body if isinstance(body, bytes) else body.encode('utf-8')
 
 if __name__ == "__main__":
     server = CTSServer()
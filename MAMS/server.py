@@ -1,10 +1,15 @@
+import os
 import socket
-import json
+import sys
 import hashlib
 import hmac
 import time
 import threading
 import uuid
+from typing import TypedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.codec import codec
 
 # คีย์สำหรับ HMAC (ในระบบจริงควรเก็บไว้อย่างปลอดภัย)
 hmac_key = b'secret_key_for_hmac'
@@ -44,6 +49,13 @@ weapons = {
 
 audit_log = []
 
+# รูปร่างของข้อความที่รู้ล่วงหน้า ชั้นนอกเป็นซองที่มี message (JSON ชั้นใน) กับ signature
+Envelope = TypedDict('Envelope', {'message': str, 'signature': str})
+Header = TypedDict('Header', {'protocol_version': str, 'message_type': str, 'sender_id': str, 'timestamp': int, 'message_id': str})
+Message = TypedDict('Message', {'header': Header, 'body': dict})
+decode_envelope = codec.decoder(Envelope)
+decode_message = codec.decoder(Message)
+
 
 def create_response(status_code, message, data=None):
     return {
@@ -103,12 +115,13 @@ def create_message(msg_type, user_id, content):
     body = {
         "content": content
     }
-    message = json.dumps({"header": header, "body": body})
-    signature = hmac.new(hmac_key, message.encode(), hashlib.sha256).hexdigest()
-    return json.dumps({"message": message, "signature": signature})
+    # signature คำนวณจาก bytes ของ JSON ชั้นในตรงๆ ไม่ต้อง encode string ซ้ำ
+    message = codec.encode({"header": header, "body": body})
+    signature = hmac.new(hmac_key, message, hashlib.sha256).hexdigest()
+    return codec.encode({"message": message.decode(), "signature": signature})
 
 def verify_and_decode_message(encoded_message):
-    message_data = json.loads(encoded_message)
+    message_data = decode_envelope(encoded_message)
     message = message_data["message"]
     signature = message_data["signature"]
     
@@ -116,15 +129,15 @@ def verify_and_decode_message(encoded_message):
     if hmac.new(hmac_key, message.encode(), hashlib.sha256).hexdigest() != signature:
         raise ValueError("Invalid message signature")
     
-    decoded_message = json.loads(message)
+    decoded_message = decode_message(message)
     return decoded_message["header"], decoded_message["body"]
 
 # ฟังก์ชันการรับและส่งข้อความ
 def send_message(client_socket, message):
-    client_socket.send(message.encode())
+    client_socket.send(message)
 
 def receive_message(client_socket):
-    data = client_socket.recv(4096).decode()
+    data = client_socket.recv(4096)
     return data
 
 # ฟังก์ชันการเชื่อมต่อและส่งคำสั่งไปยัง server
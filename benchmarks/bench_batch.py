@@ -0,0 +1,86 @@
+# เทียบ trade ต่อวินาทีของ BUY ทีละคำขอกับ BATCH /trade ขนาด 10 / 100 / 1000 บน loopback
+# แล้วตรวจว่ารายการที่ผิด (เหรียญไม่มี จำนวนติดลบ) ได้ 400 และโหมด atomic ยกเลิกทั้ง batch
+# รัน: python benchmarks/bench_batch.py [จำนวน trade ต่อรอบ]
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'CTSP'))
+import server as ctsp_server
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+class RawClient:
+    # ส่ง frame CTSP/1.0 ตรงๆ ไม่ผ่าน client.py ที่ต้องใช้ terminaltables / colorama
+    def __init__(self, port):
+        self.sock = socket.create_connection(('localhost', port))
+        self.buffer = b''
+
+    def request(self, method, resource, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        frame = f"CTSP/1.0 {method} {resource}\n".encode()
+        frame += b"Content-Length: %d\n\n" % len(data) + data if data else b"\n"
+        self.sock.sendall(frame)
+        while b'\n\n' not in self.buffer:
+            self.buffer += self.sock.recv(65536)
+        head, self.buffer = self.buffer.split(b'\n\n', 1)
+        lines = head.decode().split('\n')
+        headers = dict(line.split(': ', 1) for line in lines[1:])
+        length = int(headers.get('Content-Length', 0))
+        while len(self.buffer) < length:
+            self.buffer += self.sock.recv(65536)
+        body, self.buffer = self.buffer[:length], self.buffer[length:]
+        return int(lines[0].split()[1]), body.decode()
+
+def main():
+    trades = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    port = free_port()
+    server = ctsp_server.CTSServer('localhost', port)
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.3)
+
+    client = RawClient(port)
+    client.request('REGISTER', '/auth', {'username': 'algo', 'password': 'pw'})
+    if client.request('LOGIN', '/auth', {'username': 'algo', 'password': 'pw'})[0] != 200:
+        print("login failed")
+        return 1
+    server.users['algo']['balance'] = 1e12
+
+    started = time.perf_counter()
+    for _ in range(trades):
+        client.request('BUY', '/trade', {'coin': 'AA', 'amount': 0.01})
+    single = trades / (time.perf_counter() - started)
+    print(f"single BUY: {single:8.0f} trades/s")
+
+    failures = 0
+    for size in (10, 100, 1000):
+        batch = {'trades': [{'type': 'buy', 'coin': 'AA', 'amount': 0.01}] * size}
+        rounds = max(1, trades // size)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            status, body = client.request('BATCH', '/trade', batch)
+            if status != 200 or json.loads(body)['executed'] != size:
+                failures += 1
+        rate = rounds * size / (time.perf_counter() - started)
+        print(f"batch {size:4}: {rate:8.0f} trades/s ({rate / single:.1f}x)")
+
+    for body in ({'coin': 'ZZ', 'amount': 1}, {'coin': 'AA', 'amount': -1}, {'coin': 'AA', 'amount': 'x'}):
+        status, message = client.request('BUY', '/trade', body)
+        print(f"BUY {body}: {status} {message}")
+        failures += status != 400
+    balance = server.users['algo']['balance']
+    status, body = client.request('BATCH', '/trade', {'atomic': True, 'trades': [
+        {'type': 'buy', 'coin': 'AA', 'amount': 0.01}, {'type': 'sell', 'coin': 'AA', 'amount': -5}]})
+    print(f"atomic batch with a negative amount: {status}, balance unchanged {server.users['algo']['balance'] == balance}")
+    failures += status != 400 or server.users['algo']['balance'] != balance
+    return 0 if failures == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
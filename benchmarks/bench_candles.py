@@ -0,0 +1,79 @@
+# วัด ingest ของ CandleStore (tick ต่อวินาทีเมื่อมีหลายเหรียญ) และ latency ของ query แยกตามช่วงแท่งและ limit
+# แล้วส่ง GET_CANDLES ที่ start / end / limit ไม่ใช่ตัวเลขไปที่ CTSP ตัวจริง ต้องได้ 400 ทั้งหมดและ connection ยังใช้ต่อได้
+# รัน: python benchmarks/bench_candles.py [จำนวนเหรียญ] [จำนวนวินาทีของ tick ต่อเหรียญ]
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_batch import RawClient, free_port, ctsp_server
+from common.market import CANDLE_INTERVALS, CandleStore
+
+LIMITS = (10, 100, 1000)
+QUERY_ROUNDS = 200
+
+def ingest(coins, seconds):
+    # tick ละวินาทีต่อเหรียญ ผ่านทั้ง add_ticks (ราคาทุกเหรียญพร้อมกันแบบ simulator) และ add_tick (ทีละ trade)
+    symbols = [f"C{i}" for i in range(coins)]
+    store = CandleStore(symbols)
+    prices = dict.fromkeys(symbols, 100.0)
+    started = time.perf_counter()
+    for second in range(seconds):
+        store.add_ticks(prices, second)
+    batched = coins * seconds / (time.perf_counter() - started)
+    started = time.perf_counter()
+    for second in range(seconds, 2 * seconds):
+        for symbol in symbols:
+            store.add_tick(symbol, 101.0, 0.5, second)
+    single = coins * seconds / (time.perf_counter() - started)
+    print(f"ingest {coins} coins x {seconds}s: add_ticks {batched:10.0f} ticks/s, add_tick {single:10.0f} ticks/s")
+    return store, symbols[0], 2 * seconds
+
+def query_latency(store, symbol, end):
+    print(f"{'interval':>8}" + ''.join(f"{'limit ' + str(limit):>14}" for limit in LIMITS) + "  (us per query)")
+    for interval in CANDLE_INTERVALS:
+        cells = []
+        for limit in LIMITS:
+            started = time.perf_counter()
+            for _ in range(QUERY_ROUNDS):
+                store.query(symbol, interval, 0, end, limit)
+            cells.append((time.perf_counter() - started) / QUERY_ROUNDS * 1e6)
+        print(f"{interval:>8}" + ''.join(f"{cell:14.1f}" for cell in cells))
+
+def invalid_queries(port):
+    client = RawClient(port)
+    queries = [{'coin': 'AA', 'start': 'yesterday'}, {'coin': 'AA', 'end': 'now'}, {'coin': 'AA', 'start': True},
+               {'coin': 'AA', 'end': [1]}, {'coin': 'AA', 'limit': 'ten'}, {'coin': 'AA', 'limit': 0},
+               {'coin': 'AA', 'start': None}, {'coin': ['AA']}, {'coin': 'AA', 'interval': {}}]
+    failures = []
+    for query in queries:
+        status, body = client.request('GET_CANDLES', '/market', query)
+        if status != 400:
+            failures.append((query, status, body))
+    status, body = client.request('GET_CANDLES', '/market', {'coin': 'AA', 'interval': '1s', 'limit': 5})
+    if status != 200:
+        failures.append(('valid query after invalid ones', status, body))
+    print(f"{len(queries)} invalid GET_CANDLES: {len(queries) - len(failures)} answered 400, valid query afterwards: {status}")
+    return failures
+
+def main():
+    coins = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 3600
+    store, symbol, end = ingest(coins, seconds)
+    query_latency(store, symbol, end)
+
+    port = free_port()
+    server = ctsp_server.CTSServer('localhost', port)
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.3)
+    failures = invalid_queries(port)
+    if failures:
+        print(f"not rejected: {failures}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
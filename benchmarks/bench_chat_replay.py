@@ -0,0 +1,220 @@
+# วัดการ replay history ของ simple-chat และ chat-app เมื่อ log มีข้อความ 1M ข้อความ
+# เทียบ MessageLog.read_page หน้าละ REPLAY_LIMIT กับการอ่านทั้ง log ในครั้งเดียว (แบบเดิมเมื่อ client ส่ง OFFSET 0)
+# แล้วให้ client หนึ่งไล่ขอ history ทีละหน้าตั้งแต่ offset 0 จนครบ ระหว่างนั้นอีก client ส่งข้อความและวัดเวลาจนได้ broadcast กลับ
+# ทุกหน้าต้องต่อกันครบไม่มีข้อความหายหรือซ้ำ
+# รัน: python benchmarks/bench_chat_replay.py [จำนวนข้อความใน log]
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from common.message_log import MessageLog
+
+SENDER_INTERVAL = 0.002  # ข้อความจาก client ที่สองทุก 2ms ระหว่าง replay
+
+def load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000 if ordered else 0.0
+
+class SimpleChatClient:
+    # frame ของ simple-chat: header "KEY: value" จบด้วยบรรทัดว่าง ตามด้วย body ยาว LENGTH bytes
+    def __init__(self, port):
+        self.sock = socket.create_connection(('localhost', port))
+        self.buffer = b''
+
+    def send(self, msg_type, content='', offset=None):
+        data = content.encode()
+        header = f"TYPE: {msg_type}\nUSER: bench\n"
+        if offset is not None:
+            header += f"OFFSET: {offset}\n"
+        self.sock.sendall(header.encode() + b"LENGTH: %d\n\n" % len(data) + data)
+
+    def receive(self):
+        while b'\n\n' not in self.buffer:
+            self.buffer += self.sock.recv(65536)
+        head, self.buffer = self.buffer.split(b'\n\n', 1)
+        message = dict(line.split(': ', 1) for line in head.decode().split('\n'))
+        length = int(message['LENGTH'])
+        while len(self.buffer) < length:
+            self.buffer += self.sock.recv(65536)
+        message['content'], self.buffer = self.buffer[:length].decode(), self.buffer[length:]
+        return message
+
+    def history_page(self, offset):
+        self.send('HISTORY', offset=offset)
+        while True:
+            message = self.receive()
+            if message['TYPE'] == 'HISTORY':
+                return int(message['OFFSET']), int(message['REMAINING']), message['content']
+
+    def join(self, offset=None):
+        self.send('JOIN', offset=offset)
+        while True:
+            message = self.receive()
+            if message['TYPE'] == 'HISTORY':
+                return int(message['OFFSET']), int(message['REMAINING']), message['content']
+
+class ChatAppClient:
+    # frame ของ chat-app: header JSON | body | md5(header + body)
+    def __init__(self, port):
+        self.sock = socket.create_connection(('localhost', port))
+        self.buffer = b''
+
+    def send(self, body, msg_type='chat'):
+        body = body.encode()
+        header = json.dumps({'length': len(body), 'type': msg_type}).encode()
+        self.sock.sendall(header + b'|' + body + b'|' + hashlib.md5(header + body).hexdigest().encode())
+
+    def receive(self):
+        while b'|' not in self.buffer:
+            self.buffer += self.sock.recv(65536)
+        sep = self.buffer.index(b'|')
+        header = json.loads(self.buffer[:sep])
+        end = sep + 1 + header['length'] + 1 + 32
+        while len(self.buffer) < end:
+            self.buffer += self.sock.recv(65536)
+        body, self.buffer = self.buffer[sep + 1:sep + 1 + header['length']].decode(), self.buffer[end:]
+        return header, body
+
+    def history_page(self, offset):
+        self.send('' if offset is None else str(offset), 'history')
+        while True:
+            header, body = self.receive()
+            if header['type'] == 'history':
+                return header['offset'], header['remaining'], body
+
+def page_through(client, first_page):
+    # ขอ history หน้าต่อไปจนกว่า remaining จะเป็น 0 นับบรรทัดเพื่อตรวจว่าไม่มีข้อความหายหรือซ้ำ
+    offset, remaining, content = first_page
+    pages, lines, largest = 1, content.count('\n'), len(content.encode())
+    while remaining:
+        offset, remaining, content = client.history_page(offset)
+        pages += 1
+        lines += content.count('\n')
+        largest = max(largest, len(content.encode()))
+    return offset, pages, lines, largest
+
+def run_simple_chat(module, messages):
+    port = free_port()
+    server = module.ChatServer('localhost', port)
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.3)
+    sender = SimpleChatClient(port)
+    sender.join()
+    stop = threading.Event()
+    latencies = []
+
+    def send_loop():
+        # ส่งข้อความแล้วรอจนได้ broadcast ของตัวเองกลับมา
+        while not stop.is_set():
+            started = time.perf_counter()
+            sender.send('MESSAGE', 'ping')
+            while sender.receive().get('content') != 'bench: ping':
+                pass
+            latencies.append(time.perf_counter() - started)
+            time.sleep(SENDER_INTERVAL)
+
+    thread = threading.Thread(target=send_loop)
+    thread.start()
+    reader = SimpleChatClient(port)
+    started = time.perf_counter()
+    offset, pages, lines, largest = page_through(reader, reader.join(0))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    thread.join()
+    report('simple-chat', elapsed, pages, largest, latencies)
+    return offset == lines and offset >= messages
+
+def run_chat_app(module, messages):
+    port = free_port()
+    threading.Thread(target=module.start_server, args=('localhost', port), daemon=True).start()
+    time.sleep(0.3)
+    sender, reader = ChatAppClient(port), ChatAppClient(port)
+    sender.history_page(None)
+    reader.history_page(None)
+    stop = threading.Event()
+    latencies = []
+
+    def send_loop():
+        # chat-app ไม่ส่ง broadcast กลับหาผู้ส่ง จึงวัดเวลาจนอีก client หนึ่งได้รับ
+        while not stop.is_set():
+            started = time.perf_counter()
+            sender.send('ping')
+            while not watcher.receive()[1].endswith(': ping'):
+                pass
+            latencies.append(time.perf_counter() - started)
+            time.sleep(SENDER_INTERVAL)
+
+    watcher = ChatAppClient(port)
+    watcher.history_page(None)
+    thread = threading.Thread(target=send_loop)
+    thread.start()
+    started = time.perf_counter()
+    offset, pages, lines, largest = page_through(reader, reader.history_page(0))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    thread.join()
+    report('chat-app', elapsed, pages, largest, latencies)
+    return offset == lines and offset >= messages
+
+def report(name, elapsed, pages, largest, latencies):
+    print(f"{name:12} replay from 0: {elapsed:6.2f}s in {pages} pages, largest page {largest / 1024:.1f} KB, "
+          f"broadcast during replay p50 {percentile(latencies, 0.5):.2f}ms p99 {percentile(latencies, 0.99):.2f}ms ({len(latencies)} sent)")
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)  # MessageLog สร้างไฟล์ใน directory ปัจจุบัน
+    try:
+        log = MessageLog('fill')
+        started = time.perf_counter()
+        for i in range(messages):
+            log.append(f"user{i % 97}: message number {i}")
+        print(f"{messages:,} messages appended in {time.perf_counter() - started:.1f}s, log {log.size / 1e6:.1f} MB")
+
+        limit = 100
+        for label, last_seen in (('first JOIN (latest page)', None), ('page from offset 0', 0), ('page from the middle', messages // 2)):
+            started = time.perf_counter()
+            log.read_page(last_seen, limit)
+            print(f"read_page {label:26} {(time.perf_counter() - started) * 1e6:10.0f} us")
+        started = time.perf_counter()
+        _, _, everything = log.read_page(0, messages)
+        print(f"read_page whole log (old OFFSET 0)   {(time.perf_counter() - started) * 1e6:10.0f} us, {len(everything) / 1e6:.1f} MB in one frame")
+        del everything
+
+        for name in ('simple-chat-history', 'chat-app-history'):
+            for suffix in ('.log', '.idx'):
+                shutil.copy('fill' + suffix, name + suffix)
+        simple_chat = load('simple_chat_server', os.path.join(ROOT, 'simple-chat', 'server.py'))
+        chat_app = load('chat_app_server', os.path.join(ROOT, 'chat-app', 'server.py'))
+        ok = run_simple_chat(simple_chat, messages)
+        ok = run_chat_app(chat_app, messages) and ok
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if not ok:
+        print("replayed pages did not line up with the log")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
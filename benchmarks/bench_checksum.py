@@ -0,0 +1,61 @@
+# วัด CPU ต่อข้อความของ checksum แต่ละ algorithm ที่ CTSP11/guide ตกลงกันตอน ENTER ที่ payload 64 B, 4 KB และ 1 MB
+# ตั้ง CTSP_CHECKSUM_KEY ให้ก่อน import ถ้ายังไม่ได้ตั้ง blake2b จึงถูกวัดด้วย
+# ตรวจว่า client กับ server คำนวณได้ค่าเดียวกัน byte ที่เปลี่ยนหนึ่งตัวทำให้ค่าเปลี่ยน และ ENTER เลือก algorithm ตัวแรกที่ client เสนอ
+# รัน: python benchmarks/bench_checksum.py
+import os
+import sys
+import time
+
+os.environ.setdefault('CTSP_CHECKSUM_KEY', 'bench-key')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'CTSP11', 'guide'))
+import server as ctsp_server
+import client as ctsp_client
+
+SIZES = (64, 4 * 1024, 1024 * 1024)
+TARGET_SECONDS = 0.2  # เวลาวัดโดยประมาณต่อช่อง
+
+def per_message(function, data):
+    rounds, started = 0, time.perf_counter()
+    while time.perf_counter() - started < TARGET_SECONDS:
+        function(data)
+        rounds += 1
+    return (time.perf_counter() - started) / rounds
+
+def label(size):
+    return f"{size} B" if size < 1024 else f"{size // 1024} KB" if size < 1024 * 1024 else f"{size // (1024 * 1024)} MB"
+
+def checks():
+    failures = []
+    data = os.urandom(4096)
+    flipped = bytes([data[0] ^ 1]) + data[1:]
+    for name, checksum in ctsp_server.CHECKSUM_ALGORITHMS.items():
+        if ctsp_client.CHECKSUM_ALGORITHMS[name](data) != checksum(data):
+            failures.append(f"{name} differs between client and server")
+        if checksum(flipped) == checksum(data):
+            failures.append(f"{name} missed a flipped bit")
+    server = ctsp_server.CTSPServer(port=0)
+    server.add_user('bench', 'pw')
+    for offered in (['crc32', 'md5'], ['blake2b', 'crc32'], ['unknown', 'adler32']):
+        response = server._handle_enter(None, {'username': 'bench', 'password': 'pw', 'checksums': offered})
+        chosen = next(name for name in offered if name in ctsp_server.CHECKSUM_ALGORITHMS)
+        if b'"checksum":"%s"' % chosen.encode() not in b''.join(response).replace(b' ', b''):
+            failures.append(f"ENTER offering {offered} did not pick {chosen}")
+    return failures
+
+def main():
+    algorithms = ctsp_server.CHECKSUM_ALGORITHMS
+    print("ns per message (MB/s)")
+    print(f"{'algorithm':>10}" + ''.join(f"{label(size):>22}" for size in SIZES))
+    for name, checksum in algorithms.items():
+        cells = []
+        for size in SIZES:
+            seconds = per_message(checksum, os.urandom(size))
+            cells.append(f"{seconds * 1e9:12.0f} ({size / seconds / 1e6:6.0f})")
+        print(f"{name:>10}" + ''.join(f"{cell:>22}" for cell in cells))
+    failures = checks()
+    print(f"client / server agreement, bit flips and ENTER negotiation: {'ok' if not failures else failures}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# เทียบเวลา encode / decode ของ JSONCodec แต่ละ backend กับ json.dumps / json.loads ตรงๆ บนข้อความจริงของแต่ละ server
+# backend ที่ไม่ได้ติดตั้งจะข้ามไป คอลัมน์ schema คือ decoder แบบ TypedDict ของ server ซึ่งใช้ msgspec เมื่อมี
+# รัน: python benchmarks/bench_codec.py
+import importlib.util
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from common import codec as codec_module
+from common.codec import JSONCodec
+
+REPEAT = 5
+
+TRADE_REQUEST = json.dumps({'coin': 'AA', 'amount': 0.5})
+TRADE_RESULT = {'status': 200, 'type': 'buy', 'coin': 'AA', 'amount': 0.5, 'price': 101.25}
+TRADE_RESPONSE = {'executed': 1, 'failed': 0, 'results': [TRADE_RESULT]}
+PRICES = {f"S{i:05d}": 100.0 + i / 7 for i in range(200)}
+BATCH_RESPONSE = {'executed': 1000, 'failed': 0, 'results': [TRADE_RESULT] * 1000}
+SCAN_ENTRY = {"coin": "BTC", "price": 50123.456, "change_24h": "1.2%"}
+MAMS_MESSAGE = {"header": {"protocol_version": "1.0", "message_type": "INVENTORY_UPDATE", "sender_id": "U001",
+                           "timestamp": 1790000000, "message_id": "0f8fad5b-d9cb-469f-a165-70867728950e"},
+                "body": {"content": {"weapon_id": "W001", "quantity": 7}}}
+ORDER = {'type': 'ORDER', 'user': 'alice', 'content': {'order_type': 'BUY', 'crypto': 'A', 'amount': 1.0, 'price': 10.0, 'order_id': 'c1-17'}}
+
+ENCODE = [('CTSP BATCH 1 result', TRADE_RESPONSE), ('CTSP 200 prices', PRICES), ('CTSP BATCH 1000', BATCH_RESPONSE),
+          ('CTSP11 SCAN entry', SCAN_ENTRY), ('MAMS message', MAMS_MESSAGE), ('trade-tip ORDER', ORDER)]
+DECODE = [('CTSP BUY request', TRADE_REQUEST), ('MAMS message', json.dumps(MAMS_MESSAGE)), ('trade-tip ORDER', json.dumps(ORDER))]
+
+def load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def micros(fn, number):
+    # microsecond ต่อครั้ง เอาค่าดีที่สุดจาก REPEAT รอบ
+    return min(timeit.repeat(fn, number=number, repeat=REPEAT)) / number * 1e6
+
+def versions():
+    found = []
+    for name in ('orjson', 'msgspec'):
+        module = getattr(codec_module, name)
+        if module is not None:
+            found.append(f"{name} {module.__version__}")
+    return ', '.join(found) or "no optional JSON library"
+
+def main():
+    backends = ['json'] + [name for name in ('orjson', 'msgspec') if getattr(codec_module, name) is not None]
+    codecs = [JSONCodec(backend) for backend in backends]
+    ctsp = load('ctsp_server', os.path.join(ROOT, 'CTSP', 'server.py'))
+    mams = load('mams_server', os.path.join(ROOT, 'MAMS', 'server.py'))
+    trade_tip = load('trade_tip_server', os.path.join(ROOT, 'trade-tip', 'server.py'))
+    schema_decoders = [ctsp.REQUEST_DECODERS[('BUY', '/trade')], mams.decode_message, trade_tip.decode_request]
+
+    print(f"python {sys.version.split()[0]}, {versions()}, default backend {codec_module.codec.name}")
+    print(f"{'us/op':28}{'json.dumps/loads':>17}" + ''.join(f"{'codec ' + backend:>15}" for backend in backends) + f"{'schema':>9}")
+    for name, obj in ENCODE:
+        number = 200 if obj is BATCH_RESPONSE else 20000
+        row = [micros(lambda: json.dumps(obj).encode(), number)] + [micros(lambda: codec.encode(obj), number) for codec in codecs]
+        print(f"{'encode ' + name:28}{row[0]:17.2f}" + ''.join(f"{value:15.2f}" for value in row[1:]))
+    for (name, raw), schema in zip(DECODE, schema_decoders):
+        row = [micros(lambda: json.loads(raw), 20000)] + [micros(lambda: codec.decode(raw), 20000) for codec in codecs]
+        print(f"{'decode ' + name:28}{row[0]:17.2f}" + ''.join(f"{value:15.2f}" for value in row[1:]) + f"{micros(lambda: schema(raw), 20000):9.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
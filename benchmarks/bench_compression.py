@@ -0,0 +1,75 @@
+# วัด byte ที่ประหยัดได้และ CPU ที่ใช้ต่อ response เมื่อบีบอัด body ของ CTSP ตามขนาด
+# body เป็น GET_HISTORY จริง (รายการ transaction ที่ encode ด้วย codec) ตั้งแต่ 256 B ถึง 1 MB ทุก encoding ที่ server รองรับ
+# แยกเวลาบีบอัดครั้งแรกกับครั้งที่ได้จาก compression cache และตรวจว่า body ที่เล็กกว่า COMPRESS_MIN_SIZE ไม่ถูกบีบอัด
+# simple-http ใช้ zlib ระดับ 6 แบบเดียวกัน ตัวเลขของ POST echo จึงใกล้กัน
+# รัน: python benchmarks/bench_compression.py
+import gzip
+import os
+import sys
+import time
+import zlib
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'CTSP'))
+import server as ctsp_server
+from common.codec import codec
+
+SIZES = (256, 1024, 4 * 1024, 64 * 1024, 1024 * 1024)
+TARGET_SECONDS = 0.2  # เวลาวัดโดยประมาณต่อช่อง
+
+def history_body(size):
+    # จำนวน transaction ประมาณจากขนาดของรายการเดียว body จึงยาวใกล้ size
+    def transaction(i):
+        return {'username': 'trader', 'type': 'BUY' if i % 3 else 'SELL', 'coin': 'AA', 'amount': round(0.001 * (i % 977 + 1), 3),
+                'price': 100.0 + (i % 89) * 0.37, 'price_version': i, 'timestamp': datetime.now().isoformat()}
+    count = max(1, size // (len(codec.encode(transaction(0))) + 1))
+    return codec.encode([transaction(i) for i in range(count)])
+
+def decompress(data, encoding):
+    if encoding == 'zstd':
+        return ctsp_server.zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data) if encoding == 'gzip' else zlib.decompress(data)
+
+def timed(function):
+    # คืนเวลาเฉลี่ยต่อครั้งเป็น us วนจนครบ TARGET_SECONDS
+    rounds, started = 0, time.perf_counter()
+    while time.perf_counter() - started < TARGET_SECONDS:
+        function()
+        rounds += 1
+    return (time.perf_counter() - started) / rounds * 1e6
+
+def main():
+    server = ctsp_server.CTSServer('localhost', 0)
+    failures = []
+    print(f"CTSP response bodies (GET_HISTORY), COMPRESS_MIN_SIZE = {ctsp_server.COMPRESS_MIN_SIZE}")
+    print(f"{'body':>9}{'encoding':>10}{'sent':>10}{'saved':>8}{'first us':>11}{'cached us':>11}{'us/KB saved':>13}")
+    for size in SIZES:
+        body = history_body(size)
+        for encoding in ctsp_server.SUPPORTED_ENCODINGS:
+            response = (200, body, None)
+            head, sent = server._encode_response(response, encoding)
+            compressed = b'Content-Encoding' in head
+            if len(body) < ctsp_server.COMPRESS_MIN_SIZE:
+                if compressed:
+                    failures.append(f"{len(body)} B body compressed")
+                print(f"{len(body):>9}{encoding:>10}{len(sent):>10}{'skipped':>8}")
+                continue
+            if compressed and decompress(sent, encoding) != body:
+                failures.append(f"{encoding} round trip at {len(body)} B")
+
+            def first():
+                server.compression_cache.clear()
+                server._encode_response(response, encoding)
+            cold = timed(first)
+            cached = timed(lambda: server._encode_response(response, encoding))
+            saved = len(body) - len(sent)
+            per_kb = cold / (saved / 1024) if saved else float('inf')
+            print(f"{len(body):>9}{encoding:>10}{len(sent):>10}{saved / len(body):8.0%}{cold:11.1f}{cached:11.1f}{per_kb:13.2f}")
+    if failures:
+        print(f"failed checks: {failures}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
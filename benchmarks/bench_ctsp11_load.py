@@ -0,0 +1,98 @@
+# load test ของ CTSP11/guide: client หลายตัว ENTER แล้วส่ง BUY / SELL / RANK วนไปพร้อมกัน วัด throughput และ latency แยกตามคำสั่ง
+# จบแล้วส่ง trade ที่ amount เป็น NaN / Infinity / ไม่มี coin ต้องได้ 400 ทั้งหมดและ Leaderboard ต้องยังเรียงถูก
+# รัน: python benchmarks/bench_ctsp11_load.py [จำนวน client ...]
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'CTSP11', 'guide'))
+import server as ctsp_server
+import client as ctsp_client
+
+DURATION = 2.0  # วินาทีต่อรอบ
+COMMANDS = ('ENTER', 'BUY', 'SELL', 'RANK')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000
+
+def player(port, username, stop, latencies, errors):
+    client = ctsp_client.CTSPClient(port=port)
+    client.connect()
+    calls = (('BUY', lambda: client.buy('BTC', 0.001)), ('SELL', lambda: client.sell('BTC', 0.001)), ('RANK', client.rank))
+    started = time.perf_counter()
+    if client.enter(username, 'pw')['status'] != 200:
+        errors.append(f"ENTER {username}")
+        return
+    latencies['ENTER'].append(time.perf_counter() - started)
+    while not stop.is_set():
+        for command, call in calls:
+            started = time.perf_counter()
+            response = call()
+            latencies[command].append(time.perf_counter() - started)
+            if response['status'] != 200:
+                errors.append(f"{command} {response['status']}")
+    client.socket.close()
+
+def run(server, port, clients):
+    for i in range(clients):
+        server.add_user(f"load{clients}-{i}", 'pw')
+    stop = threading.Event()
+    latencies = {command: [] for command in COMMANDS}
+    errors = []
+    threads = [threading.Thread(target=player, args=(port, f"load{clients}-{i}", stop, latencies, errors)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    requests = sum(len(values) for values in latencies.values())
+    print(f"{clients:>8}{requests / DURATION:10.0f}" + ''.join(
+        f"{percentile(latencies[command], 0.5):10.2f}{percentile(latencies[command], 0.99):8.2f}" for command in COMMANDS))
+    return errors
+
+def invalid_trades(port):
+    # ทุกอันต้องได้ 400 และ connection ต้องใช้ต่อได้
+    client = ctsp_client.CTSPClient(port=port)
+    client.connect()
+    client.enter('Satoshi', 'bitcoin123')
+    payloads = [{'coin': 'BTC', 'amount': float('nan')}, {'coin': 'BTC', 'amount': float('inf')}, {'coin': 'BTC', 'amount': True},
+                {'coin': 'BTC', 'amount': -1}, {'coin': 'BTC', 'amount': '5'}, {'amount': 1}, {'coin': 'BTC'}, {'coin': ['BTC'], 'amount': 1}]
+    failures = [payload for payload in payloads if client.send_request('BUY', payload)['status'] != 400]
+    if client.send_request('CHECK', {})['status'] != 400:
+        failures.append('CHECK without type')
+    if client.rank()['status'] != 200:
+        failures.append('connection unusable after invalid requests')
+    client.socket.close()
+    return failures
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1, 10, 50]
+    port = free_port()
+    server = ctsp_server.CTSPServer(port=port)
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.3)
+
+    print(f"{DURATION:.0f}s per run, latency p50 / p99 in ms")
+    print(f"{'clients':>8}{'req/s':>10}" + ''.join(f"{command + ' p50':>10}{'p99':>8}" for command in COMMANDS))
+    errors = []
+    for clients in sizes:
+        errors += run(server, port, clients)
+    failures = invalid_trades(port)
+    values = [entry['total_value'] for entry in server.leaderboard.top(len(server.users))]
+    if errors or failures or values != sorted(values, reverse=True):
+        print(f"errors: {errors[:5]}, accepted invalid trades: {failures}, leaderboard sorted: {values == sorted(values, reverse=True)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# วัด session lookup และการตรวจ sequence ของ CTSP11/guide เมื่อมี session ค้างอยู่ 100k ตัว
+# แยกเวลา dict lookup / Session.check + record ของ request ใหม่ / request ซ้ำที่ตอบจาก response เดิม และ _process_sequenced ทั้งเส้นด้วย PING
+# ตรวจด้วยว่า sequence ที่สลับลำดับภายใน window ผ่านครบและ ack ตามทัน request ที่ส่งซ้ำได้ response เดิม และ sequence เก่า / กระโดดไกลถูกปฏิเสธ
+# รัน: python benchmarks/bench_ctsp11_sessions.py [จำนวน session]
+import os
+import random
+import secrets
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'CTSP11', 'guide'))
+import server as ctsp_server
+
+Session = ctsp_server.Session
+OPERATIONS = 200000
+
+def report(label, elapsed, count):
+    print(f"{label:42}{elapsed / count * 1e9:10.0f} ns/op")
+
+def correctness():
+    failures = []
+    session = Session('p', 'u', 0)
+    # สลับลำดับทีละช่วง 32 ตัว ทุกตัวยังอยู่ใน window
+    sequences = []
+    for block in range(1, 1001, 32):
+        chunk = list(range(block, block + 32))
+        random.shuffle(chunk)
+        sequences += chunk
+    for sequence in sequences:
+        if session.check(sequence) != Session.NEW:
+            failures.append(f"reordered {sequence} rejected")
+            break
+        session.record(sequence, [sequence])
+    if session.acked != session.highest_seen:
+        failures.append(f"ack stuck at {session.acked} of {session.highest_seen}")
+    last = session.highest_seen
+    if session.check(last) != Session.DUPLICATE or session.responses.get(last) != [last]:
+        failures.append('retransmit did not get the cached response')
+    if session.check(last - ctsp_server.REPLAY_WINDOW) != Session.STALE:
+        failures.append('sequence outside the window accepted')
+    if session.check(last + ctsp_server.MAX_SEQUENCE_JUMP + 1) != Session.TOO_FAR:
+        failures.append('far sequence jump accepted')
+    if len(session.responses) > ctsp_server.REPLAY_WINDOW:
+        failures.append(f"{len(session.responses)} cached responses kept")
+    return failures
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    server = ctsp_server.CTSPServer(port=0)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(count):
+        player_id = secrets.token_urlsafe(16)
+        server.sessions[player_id] = Session(player_id, f"player{i}", 0)
+    per_session = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+    print(f"{count:,} sessions, {per_session:.0f} bytes each before any request")
+
+    players = list(server.sessions)
+    picks = [random.choice(players) for _ in range(OPERATIONS)]
+    sessions = server.sessions
+    started = time.perf_counter()
+    for player_id in picks:
+        sessions.get(player_id)
+    report('session lookup', time.perf_counter() - started, OPERATIONS)
+
+    # request ใหม่ของแต่ละ session ใช้ sequence ถัดไปของ session นั้น
+    response = [b'', b'', b'', b'']
+    started = time.perf_counter()
+    for player_id in picks:
+        session = sessions.get(player_id)
+        sequence = session.highest_seen + 1
+        if session.check(sequence) == Session.NEW:
+            session.record(sequence, response)
+    report('lookup + check + record (new request)', time.perf_counter() - started, OPERATIONS)
+
+    started = time.perf_counter()
+    for player_id in picks:
+        session = sessions.get(player_id)
+        if session.check(session.highest_seen) == Session.DUPLICATE:
+            session.responses.get(session.highest_seen)
+    report('lookup + check (retransmit)', time.perf_counter() - started, OPERATIONS)
+
+    rounds = OPERATIONS // 10
+    started = time.perf_counter()
+    for player_id in picks[:rounds]:
+        server._process_sequenced('PING', sessions[player_id].highest_seen + 1, player_id, '{}')
+    report('_process_sequenced PING', time.perf_counter() - started, rounds)
+
+    failures = correctness()
+    print(f"reorder / retransmit / stale / jump checks: {'ok' if not failures else failures}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# วัด throughput และ latency ของ CTSClient (CTSPR/client.py) ที่ส่งหลาย request ค้างไว้บน connection เดียว
+# แล้วส่ง BUY / GET_PRICES / GET_HISTORY ปนกันพร้อม push NEW_TRANSACTION ที่แทรกมา ทุก response ต้องตรงกับ request ของมัน
+# สุดท้ายส่ง Content-Length ติดลบ / ใหญ่เกิน MAX_REQUEST_SIZE ต้องได้ 400 / 413 แล้ว server ปิด connection
+# รัน: python benchmarks/bench_ctspr_client.py [จำนวน request ต่อรอบ]
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'CTSPR'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import client as ctspr_client
+from bench_login_storm import percentile, start_server
+
+IN_FLIGHT = (1, 8, 64)
+MIXED_REQUESTS = 200
+
+class QuietClient(ctspr_client.CTSClient):
+    # ไม่พิมพ์ราคาและ portfolio ทุก push เหมือนเมนู interactive push ยังเข้าคิวที่ subscribe ไว้ตามปกติ
+    async def listen_for_updates(self):
+        pass
+
+async def throughput(client, requests, in_flight):
+    latencies = []
+
+    async def worker(count):
+        for _ in range(count):
+            started = time.perf_counter()
+            await client.get_prices()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(requests // in_flight) for _ in range(in_flight)))
+    elapsed = time.perf_counter() - started
+    print(f"{in_flight:>9}{len(latencies) / elapsed:10.0f}{percentile(latencies, 0.5):9.2f}{percentile(latencies, 0.99):9.2f}")
+
+async def mixed(client, coins):
+    # amount ของแต่ละ BUY ไม่ซ้ำกัน ข้อความตอบกลับจึงบอกได้ว่าเป็นของ request ไหน
+    pushes = client.subscribe('NEW_TRANSACTION')
+
+    async def one(i):
+        if i % 3 == 0:
+            amount = round(0.001 * (i + 1), 3)
+            response = await client.trade('BUY', 'AA', amount)
+            return response['status'] == 200 and f"for {amount} AA" in response['body']
+        if i % 3 == 1:
+            response = await client.get_prices()
+            return response['status'] == 200 and isinstance(response['body'], dict) and set(response['body']) == coins
+        response = await client.get_history()
+        return response['status'] == 200 and isinstance(response['body'], list)
+
+    results = await asyncio.gather(*(one(i) for i in range(MIXED_REQUESTS)))
+    await asyncio.sleep(0.1)
+    client.unsubscribe('NEW_TRANSACTION', pushes)
+    return results.count(False), pushes.qsize()
+
+async def oversized(port):
+    # server ต้องตอบ error แล้วปิดเอง read() จึงจบที่ EOF ภายใน timeout
+    statuses = []
+    for length in (-1, 10 ** 9):
+        reader, writer = await asyncio.open_connection('localhost', port)
+        writer.write(b"CTSP/1.0 BUY /trade\nRequest-ID: 1\nContent-Length: %d\n\n" % length)
+        status_line = await asyncio.wait_for(reader.readline(), 5)
+        await asyncio.wait_for(reader.read(), 5)
+        statuses.append(int(status_line.split()[1]))
+        writer.close()
+    return statuses
+
+async def run(port, server, requests):
+    client = QuietClient(port=port)
+    await client.connect()
+    await client.register('bench', 'pw')
+    await client.login('bench', 'pw')
+    server.users['bench']['balance'] = 1e12
+
+    print(f"GET_PRICES over one connection, {requests} requests per run, latency in ms")
+    print(f"{'in flight':>9}{'req/s':>10}{'p50':>9}{'p99':>9}")
+    for in_flight in IN_FLIGHT:
+        await throughput(client, requests, in_flight)
+
+    mismatched, pushes = await mixed(client, set(server.prices))
+    print(f"{MIXED_REQUESTS} mixed requests in flight: {mismatched} mismatched responses, {pushes} NEW_TRANSACTION pushes interleaved")
+    statuses = await oversized(port)
+    print(f"Content-Length -1: {statuses[0]}, Content-Length 1e9: {statuses[1]}, both connections closed by the server")
+    await client.close()
+    return mismatched == 0 and pushes > 0 and statuses == [400, 413]
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    server, port = start_server()
+    return 0 if asyncio.run(run(port, server, requests)) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# วัด requests/s ของ simple-http ด้วย keep-alive GET / ที่ 1, 10 และ 1000 connection พร้อมกัน และแบบ pipeline หลาย request ต่อ connection
+# server รันใน process แยก load generator ใช้ selectors ใน thread เดียว ทุก connection ส่ง request ใหม่ทันทีที่ได้ response ครบ
+# ก่อนวัดตรวจว่า body ที่ยาวกว่า 1 KB (Content-Length และ chunked) ไม่ถูกตัด และ request ที่ pipeline มาได้ response ครบตามลำดับ
+# รัน: python benchmarks/bench_http.py [วินาทีต่อรอบ]
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_batch import free_port
+
+RUNS = ((1, 1), (10, 1), (1000, 1), (10, 16))  # (connection, request ที่ค้างต่อ connection)
+REQUEST = b"GET / HTTP/1.1\r\nHost: bench\r\n\r\n"
+
+def start_server(port, setup=''):
+    # setup คือโค้ดที่รันหลัง import server ก่อนเปิด port เช่นเปลี่ยน STATIC_ROOT
+    code = (f"import sys; sys.path.insert(0, {os.path.join(ROOT, 'simple-http')!r}); import server\n{setup}\n"
+            f"server.run_server('localhost', {port})")
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('localhost', port)).close()
+            return process
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("simple-http did not start")
+
+def exchange(port, data):
+    # ส่งทีเดียวแล้วอ่านจนกว่า server จะปิด (request สุดท้ายต้องมี Connection: close)
+    with socket.create_connection(('localhost', port)) as sock:
+        sock.sendall(data)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+def check_bodies(port):
+    body = os.urandom(48 * 1024).hex().encode()  # 96 KB
+    failures = []
+    response = exchange(port, b"POST /upload HTTP/1.1\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+    if not response.endswith(b"Received: " + body):
+        failures.append('Content-Length body truncated')
+    chunked = b''.join(b"%x\r\n%s\r\n" % (len(body[i:i + 5000]), body[i:i + 5000]) for i in range(0, len(body), 5000))
+    response = exchange(port, b"POST /upload HTTP/1.1\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n" + chunked + b"0\r\n\r\n")
+    if not response.endswith(b"Received: " + body):
+        failures.append('chunked body truncated')
+    pipelined = b''.join(b"POST /p HTTP/1.1\r\nContent-Length: 1\r\n\r\n%d" % i for i in range(9))
+    response = exchange(port, pipelined + b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+    if response.count(b"HTTP/1.1 200") != 10 or b"Received: 0" not in response or not response.endswith(b"Hello, World!"):
+        failures.append('pipelined responses missing or out of order')
+    print(f"96 KB Content-Length / chunked bodies and 10 pipelined requests: {'ok' if not failures else failures}")
+    return failures
+
+def response_size(port):
+    with socket.create_connection(('localhost', port)) as sock:
+        sock.sendall(REQUEST)
+        data = b''
+        while b"Hello, World!" not in data:
+            data += sock.recv(65536)
+        return len(data)
+
+def load(port, connections, depth, duration, size):
+    # นับ response จากจำนวน byte ที่ได้ เพราะ response ของ GET / ยาวเท่ากันทุกครั้ง
+    selector = selectors.DefaultSelector()
+    sockets = []
+    for _ in range(connections):
+        sock = socket.create_connection(('localhost', port))
+        sock.sendall(REQUEST * depth)
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, [0])
+        sockets.append(sock)
+    responses = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        for key, _ in selector.select(0.1):
+            data = key.fileobj.recv(65536)
+            if not data:
+                raise ConnectionError("server closed a keep-alive connection")
+            received = key.data[0] + len(data)
+            done, key.data[0] = divmod(received, size)
+            if done:
+                responses += done
+                key.fileobj.send(REQUEST * done)
+    elapsed = time.perf_counter() - started
+    selector.close()
+    for sock in sockets:
+        sock.close()
+    return responses / elapsed
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    port = free_port()
+    process = start_server(port)
+    try:
+        failures = check_bodies(port)
+        size = response_size(port)
+        print(f"keep-alive GET /, {duration:.0f}s per run")
+        print(f"{'connections':>11}{'pipelined':>10}{'req/s':>10}")
+        for connections, depth in RUNS:
+            print(f"{connections:>11}{depth:>10}{load(port, connections, depth, duration, size):10.0f}")
+    finally:
+        process.kill()
+        process.wait()
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
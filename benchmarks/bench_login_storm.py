@@ -0,0 +1,146 @@
+# วัด latency ของ BUY บน CTSPR ระหว่างที่มี client จำนวนมาก LOGIN ด้วยรหัสผ่านพร้อมกัน (LOGIN storm)
+# เทียบ KDF ที่รันใน thread pool (ตามที่ server ทำ) กับ KDF ที่รันบน event loop ตรงๆ และวัด LOGIN ซ้ำด้วย token ที่ข้าม KDF
+# รัน: python benchmarks/bench_login_storm.py [จำนวน client ที่ LOGIN พร้อมกัน]
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import Executor, Future
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'CTSPR'))
+import server as ctspr_server
+
+TRADE_INTERVAL = 0.005  # BUY ทุก 5ms ระหว่างวัด
+IDLE_SECONDS = 1.0
+
+class InlineExecutor(Executor):
+    # คำนวณใน thread ที่เรียก submit เลย ใช้จำลอง KDF ที่บล็อก event loop
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+class RawClient:
+    # ส่ง frame CTSP/1.0 ตรงๆ ข้าม frame ที่เป็น Push (เช่น NEW_TRANSACTION) ที่ server ส่งแทรกมา
+    def __init__(self, port):
+        self.sock = socket.create_connection(('localhost', port))
+        self.buffer = b''
+        self.request_id = 0
+
+    def request(self, method, resource, body=None):
+        self.request_id += 1
+        data = json.dumps(body).encode() if body is not None else b''
+        self.sock.sendall(f"CTSP/1.0 {method} {resource}\nRequest-ID: {self.request_id}\n".encode()
+                          + b"Content-Length: %d\n\n" % len(data) + data)
+        while True:
+            headers, body = self._read_frame()
+            if 'Push' not in headers:
+                return headers['status'], body
+
+    def _read_frame(self):
+        while b'\n\n' not in self.buffer:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("Connection closed by server")
+            self.buffer += chunk
+        head, self.buffer = self.buffer.split(b'\n\n', 1)
+        lines = head.decode().split('\n')
+        headers = dict(line.split(': ', 1) for line in lines[1:])
+        headers['status'] = int(lines[0].split()[1])
+        length = int(headers.get('Content-Length', 0))
+        while len(self.buffer) < length:
+            self.buffer += self.sock.recv(65536)
+        body, self.buffer = self.buffer[:length], self.buffer[length:]
+        return headers, body.decode()
+
+    def close(self):
+        self.sock.close()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def start_server():
+    port = free_port()
+    server = ctspr_server.CTSServer('localhost', port)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_until_complete, args=(server.start(),), daemon=True).start()
+    time.sleep(0.3)
+    return server, port
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000
+
+def trade_latencies(port, stop, idle):
+    client = RawClient(port)
+    idle.append(client)
+    client.request('LOGIN', '/auth', {'username': 'trader', 'password': 'pw'})
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        client.request('BUY', '/trade', {'coin': 'AA', 'amount': 0.001})
+        latencies.append(time.perf_counter() - started)
+        time.sleep(TRADE_INTERVAL)
+    return latencies
+
+def storm(port, logins):
+    # client ที่ LOGIN แล้วยังได้ Push ของทุก trade ปิดไปทั้งที่มีข้อมูลค้างจะโดน reset จึงเปิดค้างไว้จนจบ
+    clients = [RawClient(port) for _ in range(logins)]
+    threads = [threading.Thread(target=client.request, args=('LOGIN', '/auth', {'username': 'storm', 'password': 'pw'}))
+               for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clients
+
+def measure(port, logins, idle):
+    stop = threading.Event()
+    result = []
+    trader = threading.Thread(target=lambda: result.extend(trade_latencies(port, stop, idle)))
+    trader.start()
+    if logins:
+        time.sleep(0.1)
+        idle.extend(storm(port, logins))
+    else:
+        time.sleep(IDLE_SECONDS)
+    stop.set()
+    trader.join()
+    return result
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    server, port = start_server()
+    setup = RawClient(port)
+    for username in ('trader', 'storm'):
+        setup.request('REGISTER', '/auth', {'username': username, 'password': 'pw'})
+    server.users['trader']['balance'] = 1e12
+
+    print(f"BUY every {TRADE_INTERVAL * 1000:.0f}ms, {logins} concurrent password LOGINs, KDF_WORKERS = {ctspr_server.KDF_WORKERS}")
+    pool = server.kdf_executor
+    idle = []  # connection ที่จบงานแล้วแต่ยังเปิดไว้
+    for label, executor, count in (('idle', pool, 0), ('KDF in thread pool', pool, logins), ('KDF on the event loop', InlineExecutor(), logins)):
+        server.kdf_executor = executor
+        latencies = measure(port, count, idle)
+        print(f"{label:24} trades {len(latencies):5d}  p50 {percentile(latencies, 0.5):8.2f}ms  "
+              f"p99 {percentile(latencies, 0.99):8.2f}ms  max {max(latencies) * 1000:8.2f}ms")
+    server.kdf_executor = pool
+
+    status, body = setup.request('LOGIN', '/auth', {'username': 'storm', 'password': 'pw'})
+    token = json.loads(body)['token']
+    clients = [RawClient(port) for _ in range(logins)]
+    idle.extend(clients)
+    started = time.perf_counter()
+    ok = sum(client.request('LOGIN', '/auth', {'username': 'storm', 'token': token})[0] == 200 for client in clients)
+    elapsed = time.perf_counter() - started
+    print(f"{logins} token re-logins: {elapsed * 1000:.1f}ms ({ok} accepted)")
+    return 0 if ok == logins else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
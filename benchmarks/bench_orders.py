@@ -0,0 +1,73 @@
+# วัดเวลาต่อ tick ของ _fill_orders ใน CTSP เมื่อมีคำสั่ง limit / stop_loss / take_profit ค้างอยู่จำนวนมาก
+# เวลาควรขึ้นกับจำนวนคำสั่งที่ถูก trigger ใน tick นั้น ไม่ใช่จำนวนที่ค้างทั้งหมด คอลัมน์สุดท้ายคือการไล่ดูทุกคำสั่ง (ไว้เทียบเท่านั้น)
+# หลังทุก tick ต้องไม่เหลือคำสั่งค้างที่ราคาข้าม trigger แล้ว
+# รัน: python benchmarks/bench_orders.py [จำนวนคำสั่งค้าง ...]
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'CTSP'))
+import server as ctsp_server
+
+COINS = 100
+TICKS = 60
+
+def crossed(order, prices):
+    price = prices[order.coin]
+    return price <= order.trigger if order.direction == 'below' else price >= order.trigger
+
+def run(resting):
+    simulator = ctsp_server.MarketSimulator.generate(COINS, seed=7)
+    server = ctsp_server.CTSServer('localhost', 0, simulator=simulator)
+    server.users['bench'] = {'password': '', 'portfolio': {coin: 1e12 for coin in simulator.symbols},
+                             'balance': 1e15, 'lock': threading.Lock()}
+    rng = random.Random(resting)
+    prices = server.snapshot.prices
+    # trigger ห่างจากราคาปัจจุบัน 2-50% ฝั่งที่ยังไม่ข้าม คำสั่งจึงทยอย fire ตามราคาที่เดินไป
+    for _ in range(resting):
+        coin = rng.choice(simulator.symbols)
+        kind = rng.choice(ctsp_server.ORDER_KINDS)
+        side = rng.choice(('buy', 'sell'))
+        away = rng.uniform(0.02, 0.5)
+        below = ctsp_server.TRIGGER_DIRECTIONS[(kind, side)] == 'below'
+        trigger = prices[coin] * (1 - away if below else 1 + away)
+        server.order_book.add(ctsp_server.ConditionalOrder('bench', kind, side, coin, 0.001, trigger), limit=resting + 1)
+
+    times, quiet, fills, missed = [], [], 0, 0
+    for _ in range(TICKS):
+        snapshot = ctsp_server.PriceSnapshot(server.snapshot.version + 1, simulator.step())
+        server.snapshot = snapshot
+        before = len(server.transactions)
+        started = time.perf_counter()
+        server._fill_orders(snapshot)
+        elapsed = (time.perf_counter() - started) * 1e6
+        filled = len(server.transactions) - before
+        times.append(elapsed)
+        fills += filled
+        if filled == 0:
+            quiet.append(elapsed)
+        open_orders = [order for orders in server.order_book.open.values() for order in orders.values()]
+        missed += sum(1 for order in open_orders if crossed(order, snapshot.prices))
+
+    started = time.perf_counter()
+    [order for order in open_orders if crossed(order, snapshot.prices)]
+    scan = (time.perf_counter() - started) * 1e6
+    quiet_min = f"{min(quiet):10.0f}" if quiet else f"{'-':>10}"
+    print(f"{resting:>10,}{sum(times) / len(times):12.0f}{fills:8d}{quiet_min}{scan:14.0f}")
+    return missed
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [0, 1000, 10000, 100000]
+    print(f"{COINS} coins, {TICKS} ticks per size, times in us")
+    print(f"{'resting':>10}{'mean/tick':>12}{'fills':>8}{'quiet min':>10}{'naive scan':>14}")
+    missed = sum(run(resting) for resting in sizes)
+    if missed:
+        print(f"{missed} open orders were left past their trigger")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+# วัดจำนวน response ต่อวินาทีที่ CTSP, CTSPR และ CTSP11/guide สร้างเป็น bytes ได้ และสร้างแล้วส่งผ่าน TCP loopback
+# เทียบกับแบบเดิมที่สร้าง response เป็น str แล้วแยก header ออกมา encode ใหม่ตอนส่ง
+# และวัด sendall ของ bytes ที่ต่อแล้วเทียบกับ sendmsg เพื่อดูจุดคุ้มทุนของ SENDMSG_MIN_SIZE
+# รัน: python benchmarks/bench_responses.py
+import importlib.util
+import json
+import os
+import socket
+import sys
+import threading
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from common.response import SENDMSG_MIN_SIZE, send_parts
+
+REPEAT = 5
+
+SMALL = "Buy order processed for 1.0 AA at 100.0"
+THAI = json.dumps({"message": "ซื้อสำเร็จ " * 5}, ensure_ascii=False)
+TRANSACTION = {"username": "user", "type": "buy", "coin": "AA", "amount": 1.0, "price": 100.0, "timestamp": "2026-10-19T12:00:00"}
+BODIES = [('41 B', SMALL), ('Thai', THAI), ('2 KB', json.dumps([TRANSACTION] * 40)), ('64 KB', json.dumps([TRANSACTION] * 640))]
+
+def load(name, path):
+    # server ทุกตัวชื่อ server.py จึงโหลดจาก path ตรงๆ ด้วยชื่อ module แยกกัน
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def rate(fn, number):
+    # พันครั้งต่อวินาที เอาค่าดีที่สุดจาก REPEAT รอบ เครื่องที่มีงานอื่นจะได้ไม่แกว่งมาก
+    return number / min(timeit.repeat(fn, number=number, repeat=REPEAT)) / 1e3
+
+def loopback():
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    listener.listen()
+    sender = socket.create_connection(listener.getsockname())
+    receiver, _ = listener.accept()
+    listener.close()
+    threading.Thread(target=drain, args=(receiver,), daemon=True).start()
+    return sender
+
+def drain(sock):
+    while sock.recv(1 << 18):
+        pass
+
+def string_response(status_code, body):
+    # _create_response แบบเดิม ก่อนมี STATUS_LINES: สร้าง dict ของ status กับ header เป็น f-string ทุกครั้ง
+    status_phrase = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 500: "Internal Server Error"}
+    headers = f"CTSP/1.0 {status_code} {status_phrase.get(status_code, '')}\n"
+    headers += f"Content-Length: {len(body.encode())}\n"
+    return f"{headers}\n{body}"
+
+def string_encode_ctsp(server, response, accept_encoding):
+    # _encode_response แบบเดิมของ CTSP: แยก str ที่สร้างมาแล้ว encode body และ header ใหม่อีกรอบ
+    head, body = response.split('\n\n', 1)
+    data = body.encode('utf-8')
+    headers = head.split('\n', 1)[0] + '\n'
+    encoding = server._choose_encoding(accept_encoding) if len(data) >= 512 else None
+    if encoding:
+        data = server._compress(data, encoding)
+        headers += f"Content-Encoding: {encoding}\n"
+    headers += f"Content-Length: {len(data)}\n"
+    return headers.encode('utf-8') + b'\n' + data
+
+def string_with_header_ctspr(response, name, value):
+    # CTSPR แบบเดิมแทรก Request-ID ด้วยการแยก str แล้ว encode ทั้งก้อน
+    status_line, rest = response.split('\n', 1)
+    return f"{status_line}\n{name}: {value}\n{rest}".encode()
+
+def main():
+    sock = loopback()
+    ctsp = load('ctsp_server', os.path.join(ROOT, 'CTSP', 'server.py'))
+    server = ctsp.CTSServer('localhost', 0)
+    print(f"{'k responses/s':16}{'str':>10}{'bytes':>10}{'str+send':>15}{'bytes+send':>12}")
+    for name, body in BODIES:
+        number = 2000 if len(body) > 16 * 1024 else 20000
+        # accept_encoding ว่าง วัดเฉพาะการสร้างและส่ง ไม่รวมการบีบอัด
+        build = lambda: server._encode_response(server._create_response(200, body), '')
+        old = lambda: string_encode_ctsp(server, string_response(200, body), '')
+        print(f"CTSP   {name:9}"
+              f"{rate(old, number):10.0f}"
+              f"{rate(build, number):10.0f}"
+              f"{rate(lambda: sock.sendall(old()), number // 4):15.0f}"
+              f"{rate(lambda: send_parts(sock, build()), number // 4):12.0f}")
+
+    ctspr = load('ctspr_server', os.path.join(ROOT, 'CTSPR', 'server.py'))
+    for name, body in BODIES[:3]:
+        build = lambda: ctspr.CTSServer._encode_response(ctspr.CTSServer._create_response(200, body), b"Request-ID: %d\n" % 17)
+        old = lambda: string_with_header_ctspr(string_response(200, body), 'Request-ID', '17')
+        print(f"CTSPR  {name:9}{rate(old, 20000):10.0f}{rate(build, 20000):10.0f}")
+
+    guide = load('ctsp11_server', os.path.join(ROOT, 'CTSP11', 'guide', 'server.py'))
+    ctsp11 = guide.CTSPServer(port=0)
+    session = ctsp11.sessions['p1'] = guide.Session('p1', 'Satoshi', 0)
+    for name, body in (('41 B', {"message": SMALL}), ('2 KB', [TRANSACTION] * 40)):
+        build = lambda: ctsp11._with_ack(ctsp11._create_response("BUY", 200, body, 'p1'), 5, session)
+        print(f"CTSP11 {name:9}{'':10}{rate(build, 10000):10.0f}{'':15}{rate(lambda: send_parts(sock, build()), 2500):12.0f}")
+
+    print(f"\n{'body size':16}{'join+sendall':>14}{'sendmsg':>10}  (k/s, SENDMSG_MIN_SIZE = {SENDMSG_MIN_SIZE})")
+    header = b"CTSP/1.0 200 OK\nContent-Length: 0\n\n"
+    for size in (40, 1024, 4096, 16 * 1024, 64 * 1024):
+        body = b"x" * size
+        number = 2000 if size > 16 * 1024 else 10000
+        print(f"{size:>9} B      "
+              f"{rate(lambda: sock.sendall(header + body), number):14.0f}"
+              f"{rate(lambda: sock.sendmsg([header, body]), number):10.0f}")
+    sock.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
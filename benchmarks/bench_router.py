@@ -0,0 +1,80 @@
+# micro-benchmark ของ route dispatch ใน simple-http เมื่อมี 1k route
+# เทียบการไล่ regex ทีละ route (เหมือน if/elif เดิม) กับ Router ที่ compile เป็น dict + trie
+# วัด path ที่ตรงกับ route แรก / route สุดท้าย / route ที่มี parameter / path ที่ไม่มี route ทั้งสองแบบต้องได้ handler และ parameter เดียวกัน
+# รัน: python benchmarks/bench_router.py [จำนวน route]
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'simple-http'))
+import server as http_server
+
+ROUNDS = 20000
+
+def handler_for(name):
+    def handler(request):
+        return 200, {}, name
+    return handler
+
+def build(routes):
+    # ครึ่งหนึ่งเป็น path ตายตัว อีกครึ่งมี {id} แบบ REST
+    router = http_server.Router()
+    linear = []
+    for i in range(routes):
+        pattern = f"/api/v1/resource{i}" if i % 2 == 0 else f"/api/v1/users{i}/{{id}}/items"
+        handler = handler_for(pattern)
+        router.add_route('GET', pattern, handler)
+        regex = re.compile('^' + re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", pattern) + '$')
+        linear.append(('GET', regex, handler))
+    router.compile()
+    return router, linear
+
+def linear_dispatch(linear, request):
+    path = request['path'].split('?', 1)[0]
+    for method, regex, handler in linear:
+        if method == request['method']:
+            match = regex.match(path)
+            if match:
+                request['params'] = match.groupdict()
+                return handler(request)
+    return 404, {}, b"Page not found"
+
+def measure(dispatch, table, path):
+    request = {'method': 'GET', 'path': path, 'headers': {}}
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        dispatch(table, request)
+    return (time.perf_counter() - started) / ROUNDS * 1e6
+
+def main():
+    routes = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    router, linear = build(routes)
+    last_static = (routes - 1) // 2 * 2
+    paths = {
+        'first route': '/api/v1/resource0',
+        'last static route': f"/api/v1/resource{last_static}",
+        'last param route': f"/api/v1/users{routes - 1 if routes % 2 == 0 else routes - 2}/42/items",
+        'no route (404)': '/api/v2/missing',
+    }
+    mismatched = []
+    for label, path in paths.items():
+        compiled = {'method': 'GET', 'path': path, 'headers': {}}
+        plain = dict(compiled)
+        if router.dispatch(compiled)[2] != linear_dispatch(linear, plain)[2] or compiled.get('params', {}) != plain.get('params', {}):
+            mismatched.append(label)
+
+    print(f"{routes} routes, us per dispatch")
+    print(f"{'path':20}{'linear':>10}{'compiled':>10}{'speedup':>9}")
+    for label, path in paths.items():
+        slow = measure(linear_dispatch, linear, path)
+        fast = measure(lambda table, request: table.dispatch(request), router, path)
+        print(f"{label:20}{slow:10.2f}{fast:10.2f}{slow / fast:8.1f}x")
+    if mismatched:
+        print(f"compiled router disagrees with linear matching on: {mismatched}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
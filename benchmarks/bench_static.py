@@ -0,0 +1,101 @@
+# เทียบการส่งไฟล์ static ของ simple-http แบบปัจจุบัน (ไฟล์ใหญ่ส่งด้วย sendfile ไฟล์เล็กจาก LRU ใน memory)
+# กับแบบอ่านทั้งไฟล์เข้า memory ทุก request บนไฟล์ขนาด 4 KB และ 16 MB ผ่าน keep-alive connection เดียว
+# ตรวจด้วยว่า body ตรงกับไฟล์ Range ได้ 206 ช่วงที่ถูกต้อง และ If-None-Match ได้ 304
+# รัน: python benchmarks/bench_static.py [วินาทีต่อรอบ]
+import hashlib
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_batch import free_port
+from bench_http import start_server
+
+FILES = {'small.txt': 4 * 1024, 'large.bin': 16 * 1024 * 1024}
+# แบบเดิม: ทุกไฟล์อ่านเข้า memory และ cache ขนาด 0 จึงอ่านจาก disk ใหม่ทุกครั้ง
+READ_INTO_MEMORY = "server.CACHE_MAX_FILE_SIZE = 1 << 40; server.file_cache = server.FileCache(0)"
+
+class StaticClient:
+    def __init__(self, port):
+        self.sock = socket.create_connection(('localhost', port))
+        self.buffer = bytearray()
+        self.body = bytearray(max(FILES.values()))
+
+    def get(self, path, headers=''):
+        self.sock.sendall(f"GET /static/{path} HTTP/1.1\r\nHost: bench\r\n{headers}\r\n".encode())
+        while b"\r\n\r\n" not in self.buffer:
+            self.buffer += self.sock.recv(65536)
+        end = self.buffer.index(b"\r\n\r\n")
+        lines = self.buffer[:end].decode().split("\r\n")
+        del self.buffer[:end + 4]
+        response = dict(line.split(": ", 1) for line in lines[1:])
+        length = int(response.get('Content-Length', 0))
+        # body ยาวถึง 16 MB อ่านลง buffer ที่จองไว้ด้วย recv_into ไม่ต่อ bytes
+        view = memoryview(self.body)
+        received = min(len(self.buffer), length)
+        view[:received] = self.buffer[:received]
+        del self.buffer[:received]
+        while received < length:
+            received += self.sock.recv_into(view[received:length])
+        return int(lines[0].split()[1]), response, view[:length]
+
+def throughput(port, name, duration):
+    client = StaticClient(port)
+    requests = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        client.get(name)
+        requests += 1
+    elapsed = time.perf_counter() - started
+    client.sock.close()
+    return requests / elapsed, requests * FILES[name] / elapsed / 1e6
+
+def check(port, contents):
+    failures = []
+    client = StaticClient(port)
+    for name, data in contents.items():
+        status, headers, body = client.get(name)
+        if status != 200 or hashlib.sha256(body).digest() != hashlib.sha256(data).digest():
+            failures.append(f"{name} body")
+        etag = headers['ETag']
+        status, _, body = client.get(name, 'Range: bytes=100-199\r\n')
+        if status != 206 or bytes(body) != data[100:200]:
+            failures.append(f"{name} range")
+        if client.get(name, f"If-None-Match: {etag}\r\n")[0] != 304:
+            failures.append(f"{name} If-None-Match")
+    client.sock.close()
+    return failures
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    root = os.path.realpath(tempfile.mkdtemp())
+    contents = {name: os.urandom(size) for name, size in FILES.items()}
+    for name, data in contents.items():
+        with open(os.path.join(root, name), 'wb') as f:
+            f.write(data)
+    failures = []
+    print(f"one keep-alive connection, {duration:.0f}s per run")
+    print(f"{'mode':22}" + ''.join(f"{name + ' req/s':>18}{'MB/s':>8}" for name in FILES))
+    try:
+        for label, setup in (('sendfile + LRU', ''), ('read into memory', READ_INTO_MEMORY)):
+            port = free_port()
+            process = start_server(port, f"server.STATIC_ROOT = {root!r}\n{setup}")
+            try:
+                failures += check(port, contents)
+                cells = [throughput(port, name, duration) for name in FILES]
+            finally:
+                process.kill()
+                process.wait()
+            print(f"{label:22}" + ''.join(f"{rate:18.0f}{megabytes:8.0f}" for rate, megabytes in cells))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    if failures:
+        print(f"failed checks: {failures}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
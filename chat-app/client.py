@@ -3,31 +3,75 @@ import json
 import hashlib
 import threading
 
-def create_message(body):
+CHECKSUM_LENGTH = 32  # md5 hexdigest
+history_state = {"offset": None, "replayed": False, "pending": []}  # offset ล่าสุดที่ได้รับ ใช้ขอข้อความที่ขาดไปตอนเชื่อมต่อใหม่
+
+def create_message(body, msg_type="chat"):
     header = {
-        "length": len(body),
-        "type": "chat"
+        "length": len(body.encode()),
+        "type": msg_type
     }
     header_json = json.dumps(header)
     checksum = hashlib.md5((header_json + body).encode()).hexdigest()
     return f"{header_json}|{body}|{checksum}"
 
 def parse_message(message):
-    header_json, body, checksum = message.split("|")
+    header_json, rest = message.split("|", 1)
+    body, checksum = rest.rsplit("|", 1)
     header = json.loads(header_json)
     calculated_checksum = hashlib.md5((header_json + body).encode()).hexdigest()
     if calculated_checksum != checksum:
         raise ValueError("Checksum mismatch")
     return header, body
 
+def read_frame(client_socket, buffer):
+    # ข้อความมาต่อกันใน stream และ history อาจยาวกว่าหนึ่ง recv จึงตัดตาม length ใน header
+    while True:
+        sep = buffer.find(b"|")
+        if sep != -1:
+            header = json.loads(buffer[:sep])
+            end = sep + 1 + header["length"] + 1 + CHECKSUM_LENGTH
+            if len(buffer) >= end:
+                return buffer[:end].decode(), buffer[end:]
+        chunk = client_socket.recv(4096)
+        if not chunk:
+            return None, buffer
+        buffer += chunk
+
 def receive_messages(client_socket):
+    buffer = b""
     while True:
         try:
-            response = client_socket.recv(1024).decode()
-            if not response:
+            response, buffer = read_frame(client_socket, buffer)
+            if response is None:
                 break
             header, body = parse_message(response)
-            print(f"\nServer: {body}")
+            offset = header.get("offset")
+            if header["type"] == "history":
+                history_state["offset"] = offset
+                if body:
+                    print(f"\n{body}", end="")
+                if header.get("remaining"):
+                    # server ส่ง history ทีละหน้า ขอหน้าถัดไปต่อจาก offset ของหน้านี้
+                    client_socket.sendall(create_message(str(offset), "history").encode())
+                    continue
+                history_state["replayed"] = True
+                # ข้อความที่มาก่อน history แต่ offset ใหม่กว่า ยังไม่อยู่ใน history ต้องแสดงต่อท้าย
+                for pending_offset, pending_body in history_state["pending"]:
+                    if pending_offset > history_state["offset"]:
+                        history_state["offset"] = pending_offset
+                        print(f"\nServer: {pending_body}")
+                history_state["pending"] = []
+            elif offset is not None:
+                if not history_state["replayed"]:
+                    history_state["pending"].append((offset, body))
+                    continue
+                if offset <= history_state["offset"]:
+                    continue
+                history_state["offset"] = offset
+                print(f"\nServer: {body}")
+            else:
+                print(f"\nServer: {body}")
             print("You: ", end="", flush=True)
         except Exception as e:
             print(f"\nError receiving message: {e}")
@@ -40,6 +84,11 @@ def start_client(host, port):
         client_socket.connect((host, port))
         print(f"Connected to server at {host}:{port}")
 
+        last_offset = history_state["offset"]
+        history_state["replayed"] = False
+        history_state["pending"] = []
+        client_socket.send(create_message("" if last_offset is None else str(last_offset), "history").encode())
+
         receive_thread = threading.Thread(target=receive_messages, args=(client_socket,))
         receive_thread.start()
 
@@ -1,42 +1,107 @@
+import os
+import sys
 import socket
-import json
 import hashlib
 import threading
+from typing import TypedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.message_log import MessageLog
+from common.codec import codec
 
 MAX_CONNECTIONS = 5
+CHECKSUM_LENGTH = 32  # md5 hexdigest
+MAX_HEADER_SIZE = 256  # header JSON มีแค่ length / type / offset
+MAX_BODY_SIZE = 64 * 1024
+REPLAY_LIMIT = 100  # จำนวนข้อความย้อนหลังสูงสุดต่อ history หนึ่งครั้ง ที่เหลือ client ขอหน้าถัดไปเอง
 clients = []
-clients_lock = threading.Lock()
+clients_lock = threading.RLock()
+send_locks = {}  # {client_socket: lock} broadcast กับ history ส่งจากคนละ thread frame ต้องไม่ปนกัน
+
+history = MessageLog('chat-app-history')
+
+FrameHeaderBase = TypedDict('FrameHeaderBase', {'length': int, 'type': str})
+
+class FrameHeader(FrameHeaderBase, total=False):
+    offset: int
+    remaining: int
+
+decode_header = codec.decoder(FrameHeader)
 
-def create_message(body):
+def create_message(body, msg_type="chat", offset=None, remaining=None):
+    # คืน frame เป็น bytes พร้อมส่ง
+    body = body.encode()
     header = {
         "length": len(body),
-        "type": "chat"
+        "type": msg_type
     }
-    header_json = json.dumps(header)
-    checksum = hashlib.md5((header_json + body).encode()).hexdigest()
-    return f"{header_json}|{body}|{checksum}"
-
-def parse_message(message):
-    header_json, body, checksum = message.split("|")
-    header = json.loads(header_json)
-    calculated_checksum = hashlib.md5((header_json + body).encode()).hexdigest()
+    if offset is not None:
+        header["offset"] = offset
+    if remaining is not None:
+        header["remaining"] = remaining
+    header_json = codec.encode(header)
+    checksum = hashlib.md5(header_json + body).hexdigest().encode()
+    return header_json + b"|" + body + b"|" + checksum
+
+def parse_message(header, frame):
+    # header ถูก decode แล้วตอน read_frame ที่นี่แค่ตัด body กับ checksum ตาม length แล้วตรวจ
+    sep = frame.index(b"|")
+    body = frame[sep + 1:sep + 1 + header["length"]]
+    checksum = frame[-CHECKSUM_LENGTH:]
+    calculated_checksum = hashlib.md5(frame[:sep] + body).hexdigest().encode()
     if calculated_checksum != checksum:
         raise ValueError("Checksum mismatch")
-    return header, body
+    return header, body.decode()
+
+def read_frame(client_socket, buffer):
+    # ข้อความมาต่อกันใน stream จึงตัดตาม length ใน header แทนการ recv ครั้งเดียว
+    # จำกัดทั้งส่วนก่อน "|" และ length peer จึงสั่งให้เก็บ buffer โตไปเรื่อยๆ ไม่ได้
+    header = None
+    while True:
+        if header is None:
+            sep = buffer.find(b"|", 0, MAX_HEADER_SIZE + 1)
+            if sep == -1 and len(buffer) > MAX_HEADER_SIZE:
+                raise ValueError(f"Header limited to {MAX_HEADER_SIZE} bytes")
+            if sep != -1:
+                header = decode_header(buffer[:sep])
+                length = header.get("length") if isinstance(header, dict) else None
+                if not isinstance(length, int) or isinstance(length, bool) or not 0 <= length <= MAX_BODY_SIZE:
+                    raise ValueError(f"Body length must be 0-{MAX_BODY_SIZE} bytes")
+                end = sep + 1 + length + 1 + CHECKSUM_LENGTH
+        if header is not None and len(buffer) >= end:
+            return header, buffer[:end], buffer[end:]
+        chunk = client_socket.recv(4096)
+        if not chunk:
+            return None, None, buffer
+        buffer += chunk
 
-def broadcast(message, sender_socket):
+def broadcast(text, sender_socket):
     with clients_lock:
-        for client in clients:
+        offset = history.append(text)
+        data = create_message(text, offset=offset)
+        for client in list(clients):
             if client != sender_socket:
                 try:
-                    client.send(message.encode())
+                    with send_locks[client]:
+                        client.sendall(data)
                 except:
                     remove_client(client)
 
+def replay_history(client_socket, body):
+    # client ส่ง offset ล่าสุดที่เห็นมา ได้ข้อความถัดจากนั้นไม่เกิน REPLAY_LIMIT ข้อความ remaining บอกว่ายังต้องขอหน้าถัดไปไหม
+    # body ว่างคือยังไม่เคยเห็นข้อความใด ได้ REPLAY_LIMIT ข้อความล่าสุด
+    # อ่านหน้าใต้ lock ของ MessageLog เท่านั้นแล้วส่งโดยไม่ถือ clients_lock client ที่อ่านช้าจะไม่ขวาง broadcast ของคนอื่น
+    # ข้อความที่ broadcast แทรกก่อน history มี offset มากกว่าหน้านี้เสมอ client พักไว้แล้วแสดงต่อจาก history
+    offset, remaining, backlog = history.read_page(int(body) if body else None, REPLAY_LIMIT)
+    data = create_message(backlog, "history", offset, remaining)
+    with send_locks[client_socket]:
+        client_socket.sendall(data)
+
 def remove_client(client_socket):
     with clients_lock:
         if client_socket in clients:
             clients.remove(client_socket)
+            del send_locks[client_socket]
             client_socket.close()
 
 def handle_client(client_socket, client_address):
@@ -44,22 +109,26 @@ def handle_client(client_socket, client_address):
     with clients_lock:
         if len(clients) >= MAX_CONNECTIONS:
             print(f"Maximum connections reached. Rejecting {client_address}")
-            client_socket.send(create_message("Server is full. Try again later.").encode())
+            client_socket.send(create_message("Server is full. Try again later."))
             client_socket.close()
             return
         clients.append(client_socket)
+        send_locks[client_socket] = threading.Lock()
 
+    buffer = b""
     while True:
         try:
-            message = client_socket.recv(1024).decode()
-            if not message:
+            header, message, buffer = read_frame(client_socket, buffer)
+            if message is None:
                 break
 
-            header, body = parse_message(message)
+            header, body = parse_message(header, message)
+            if header.get("type") == "history":
+                replay_history(client_socket, body)
+                continue
             print(f"Received from {client_address}: {body}")
 
-            broadcast_message = create_message(f"Client {client_address}: {body}")
-            broadcast(broadcast_message, client_socket)
+            broadcast(f"Client {client_address}: {body}", client_socket)
         except ValueError as e:
             print(f"Error with client {client_address}: {e}")
             break
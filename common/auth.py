@@ -0,0 +1,64 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# รหัสผ่าน token ของ session และ token ของ admin ที่ CTSP, CTSPR และ trade-tip ใช้ร่วมกัน
+KDF_ITERATIONS = 100000  # ~50ms ต่อครั้ง
+SESSION_TTL = 15 * 60  # อายุ token ที่ใช้ login ซ้ำโดยไม่ต้องคำนวณ KDF
+SESSION_CACHE_SIZE = 10000
+
+def hash_password(password: str, salt: Optional[bytes] = None, iterations: int = KDF_ITERATIONS) -> str:
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+def verify_password(password: str, stored: str) -> bool:
+    _, iterations, salt, digest = stored.split('$')
+    candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+def is_admin_token(token, admin_token: str) -> bool:
+    # admin_token ว่างคือปิด endpoint นั้น เทียบเป็น bytes เพราะ compare_digest ไม่รับ str ที่ไม่ใช่ ASCII
+    return bool(admin_token) and isinstance(token, str) and hmac.compare_digest(token.encode(), admin_token.encode())
+
+# ใช้ตรวจเมื่อไม่มี username นี้ เวลาตอบจะได้ไม่บอกว่า username มีอยู่หรือไม่
+DUMMY_PASSWORD_HASH = hash_password('')
+
+class SessionCache:
+    # token สุ่มที่ออกให้หลัง login สำเร็จ เก็บแบบ LRU จำกัดทั้งจำนวนและอายุ
+    # ล็อกไว้เพราะ CTSP เรียกจากหลาย thread ส่วน CTSPR เรียกจาก event loop เดียว ล็อกจึงไม่เคยต้องรอ
+    def __init__(self, ttl: float = SESSION_TTL, size: int = SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.tokens: OrderedDict = OrderedDict()  # {token: (username, expires)}
+        self.lock = threading.Lock()
+
+    def issue(self, username: str) -> str:
+        token = secrets.token_urlsafe(32)
+        with self.lock:
+            self.tokens[token] = (username, time.monotonic() + self.ttl)
+            if len(self.tokens) > self.size:
+                self.tokens.popitem(last=False)
+        return token
+
+    def check(self, token: str, username: str) -> bool:
+        if not isinstance(token, str):
+            return False
+        with self.lock:
+            entry = self.tokens.get(token)
+            if entry is None:
+                return False
+            if entry[1] < time.monotonic():
+                del self.tokens[token]
+                return False
+        # username เป็นภาษาไทยได้ compare_digest รับ str เฉพาะ ASCII จึงเทียบเป็น bytes
+        return isinstance(username, str) and hmac.compare_digest(entry[0].encode(), username.encode())
+
+    def revoke(self, token: Optional[str]):
+        with self.lock:
+            self.tokens.pop(token, None)
@@ -0,0 +1,43 @@
+import json
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+class JSONCodec:
+    # JSON ทุกขาเข้าออกผ่านตัวนี้ ใช้ orjson หรือ msgspec ถ้า import ได้ ไม่มีก็ใช้ json ของ stdlib
+    # encode คืน bytes เสมอ และได้ JSON แบบไม่มีช่องว่างเหมือนกันทุก backend
+    def __init__(self, backend: Optional[str] = None):
+        if backend is None:
+            backend = 'orjson' if orjson else 'msgspec' if msgspec else 'json'
+        self.name = backend
+        self.decoders = {}
+        if backend == 'orjson':
+            self.encode = orjson.dumps
+            self.decode = orjson.loads
+        elif backend == 'msgspec':
+            self.encode = msgspec.json.Encoder().encode
+            self.decode = msgspec.json.Decoder().decode
+        else:
+            encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+            self.encode = lambda obj: encoder.encode(obj).encode('utf-8')
+            self.decode = json.loads
+
+    def decoder(self, schema) -> Callable[[Union[str, bytes]], Any]:
+        # ข้อความที่รู้รูปร่างล่วงหน้า (TypedDict) ถ้ามี msgspec จะ parse พร้อมตรวจ type ในรอบเดียว
+        # ได้ dict ธรรมดาเหมือน decode ปกติ ไม่มี msgspec ก็ใช้ decode ปกติ
+        if msgspec is None:
+            return self.decode
+        if schema not in self.decoders:
+            self.decoders[schema] = msgspec.json.Decoder(schema).decode
+        return self.decoders[schema]
+
+# server ทุกตัวใช้ instance นี้ร่วมกัน decoder ของแต่ละ schema จึงสร้างครั้งเดียวต่อ process
+codec = JSONCodec()
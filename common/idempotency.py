@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+# คำตอบของ /trade ตาม (username, Idempotency-Key) ที่ CTSP และ CTSPR ใช้ร่วมกัน
+# ที่นี่มีแค่ LRU / TTL การรอคำขอแรกที่ยังทำไม่เสร็จแต่ละ server ทำเอง (CTSP ใช้ thread, CTSPR ใช้ event loop)
+IDEMPOTENCY_TTL = 10 * 60  # ช่วงเวลาที่ client retry ด้วย Idempotency-Key เดิมแล้วได้คำตอบเดิม
+IDEMPOTENCY_CACHE_SIZE = 10000
+IDEMPOTENCY_KEY_LIMIT = 128
+
+class IdempotencyEntry:
+    __slots__ = ('fingerprint', 'response', 'expires', 'done')
+
+    def __init__(self, fingerprint: bytes, expires: float):
+        self.fingerprint = fingerprint
+        self.response: Optional[Any] = None  # None ระหว่างที่คำขอแรกยังทำอยู่
+        self.expires = expires  # 0 คือคำขอแรกล้ม
+        self.done: Optional[Any] = None  # ของที่ชั้นรอผูกไว้ เช่น asyncio.Event ของ CTSPR สร้างเมื่อมีคำขอซ้ำมารอเท่านั้น
+
+    @property
+    def pending(self) -> bool:
+        return self.response is None and bool(self.expires)
+
+class IdempotencyStore:
+    # เก็บแบบ LRU จำกัดทั้งจำนวนและอายุ ไม่ล็อกเอง ผู้เรียกต้องกันการเรียกพร้อมกันไว้แล้ว
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, size: int = IDEMPOTENCY_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.entries: OrderedDict = OrderedDict()  # {(username, key): IdempotencyEntry}
+
+    def find(self, username: str, key: str) -> Optional[IdempotencyEntry]:
+        return self.entries.get((username, key))
+
+    def resolve(self, username: str, key: str, entry: Optional[IdempotencyEntry], fingerprint: bytes) -> Tuple[IdempotencyEntry, bool]:
+        # เรียกหลังรอ entry ที่ find ได้จนไม่ pending แล้ว
+        # คืน (entry, False) ถ้ามีคำตอบที่ยังไม่หมดอายุ ไม่งั้นจอง entry ใหม่แล้วคืน (entry, True) ให้ผู้เรียกทำคำขอเอง
+        now = time.monotonic()
+        if entry is not None and entry.response is not None and entry.expires >= now:
+            if self.entries.get((username, key)) is entry:
+                self.entries.move_to_end((username, key))
+            return entry, False
+        entry = IdempotencyEntry(fingerprint, now + self.ttl)
+        self.entries[(username, key)] = entry
+        self.entries.move_to_end((username, key))
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry, True
+
+    def complete(self, entry: IdempotencyEntry, response):
+        entry.response = response
+
+    def discard(self, username: str, key: str, entry: IdempotencyEntry):
+        # คำขอแรกล้มกลางทาง ให้ retry ทำใหม่ได้
+        entry.expires = 0.0
+        if self.entries.get((username, key)) is entry:
+            del self.entries[(username, key)]
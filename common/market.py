@@ -0,0 +1,201 @@
+import math
+import random
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# แท่งเทียนและตัวจำลองราคาที่ CTSP, CTSPR และ trade-tip ใช้ร่วมกัน
+CANDLE_INTERVALS = {'1s': 1, '1m': 60, '1h': 3600}
+CANDLE_CAPACITY = {'1s': 3600, '1m': 1440, '1h': 720}  # 1 ชั่วโมง / 1 วัน / 30 วัน
+CANDLE_INITIAL_CAPACITY = 16  # ช่องที่จองตอน tick แรก แล้วขยายเท่าตัวจนถึง capacity
+CANDLE_LIMIT = 1000  # จำนวนแท่งสูงสุดต่อ GET_CANDLES
+SIMULATOR_VOLATILITY = 0.006  # ส่วนเบี่ยงเบนมาตรฐานของ log return ต่อ tick
+SIMULATOR_JUMP_PROBABILITY = 0.001  # โอกาสเกิดข่าวแรงต่อเหรียญต่อ tick
+SIMULATOR_JUMP_SIZE = 0.05
+
+def _candle_column(size: int, typecode: str):
+    # ใช้ numpy ถ้ามี ไม่มีก็ใช้ array ของ stdlib ทั้งสองแบบเก็บเป็นตัวเลขติดกัน 8 byte ต่อช่อง
+    if numpy is not None:
+        return numpy.zeros(size, dtype='int64' if typecode == 'q' else 'float64')
+    return array(typecode, bytes(8 * size))
+
+def _grow_column(column, size: int, typecode: str):
+    grown = _candle_column(size, typecode)
+    grown[:len(column)] = column
+    return grown
+
+class CandleSeries:
+    # ring buffer ของแท่งเทียนช่วงเดียว เรียงตามเวลา ช่องใหม่เขียนทับช่องที่เก่าที่สุด
+    # จองช่องตอน tick แรกแล้วขยายเท่าตัว เหรียญที่ไม่มี tick หรือยังมีไม่กี่แท่งจึงไม่กิน memory เต็ม size
+    # ระหว่างที่ยังขยายอยู่ข้อมูลเริ่มที่ช่อง 0 เสมอ จะวนทับก็ต่อเมื่อ capacity เท่ากับ size แล้ว
+    def __init__(self, interval: int, size: int):
+        self.interval = interval
+        self.size = size
+        self.capacity = 0
+        self.times = self.opens = self.highs = self.lows = self.closes = self.volumes = None
+        self.head = -1
+        self.count = 0
+
+    def _grow(self):
+        capacity = min(self.size, max(CANDLE_INITIAL_CAPACITY, self.capacity * 2))
+        if self.times is None:
+            self.times = _candle_column(capacity, 'q')
+            self.opens, self.highs, self.lows, self.closes, self.volumes = (_candle_column(capacity, 'd') for _ in range(5))
+        else:
+            self.times = _grow_column(self.times, capacity, 'q')
+            self.opens, self.highs, self.lows, self.closes, self.volumes = (
+                _grow_column(column, capacity, 'd')
+                for column in (self.opens, self.highs, self.lows, self.closes, self.volumes))
+        self.capacity = capacity
+
+    def add(self, price: float, volume: float, timestamp: float):
+        bucket = int(timestamp // self.interval) * self.interval
+        head = self.head
+        if self.count and self.times[head] == bucket:
+            if price > self.highs[head]:
+                self.highs[head] = price
+            if price < self.lows[head]:
+                self.lows[head] = price
+            self.closes[head] = price
+            self.volumes[head] += volume
+            return
+        if self.count and bucket < self.times[head]:
+            return  # tick ที่มาช้ากว่าแท่งล่าสุด ทิ้งไป
+        if self.count == self.capacity and self.capacity < self.size:
+            self._grow()
+        head = (head + 1) % self.capacity
+        self.times[head] = bucket
+        self.opens[head] = self.highs[head] = self.lows[head] = self.closes[head] = price
+        self.volumes[head] = volume
+        self.head = head
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _position(self, timestamp: float) -> int:
+        # binary search ตำแหน่งแรก (นับจากแท่งเก่าสุด) ที่เวลา >= timestamp
+        oldest = self.head - self.count + 1
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[(oldest + middle) % self.capacity] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, start: float, end: float, limit: int) -> List[list]:
+        first = self._position(start)
+        last = self._position(int(end) + 1)
+        first = max(first, last - limit)  # เกิน limit ให้เอาแท่งล่าสุด
+        if first >= last:
+            return []
+        oldest = (self.head - self.count + 1) % self.capacity
+        begin = (oldest + first) % self.capacity
+        stop = begin + (last - first)
+        columns = (self.times, self.opens, self.highs, self.lows, self.closes, self.volumes)
+        if stop <= self.capacity:
+            rows = zip(*(column[begin:stop].tolist() for column in columns))
+        else:
+            rows = zip(*(column[begin:].tolist() + column[:stop - self.capacity].tolist() for column in columns))
+        return [list(row) for row in rows]
+
+class CandleStore:
+    # ทุก tick ถูกรวมเป็นแท่ง 1s/1m/1h ตอนรับเข้ามาเลย GET_CANDLES จึงแค่ตัดช่วงออกไป
+    # capacity ต่อช่วงปรับได้ตอนสร้าง เช่นเก็บแท่ง 1s น้อยลงเมื่อมีเหรียญเป็นหมื่น
+    def __init__(self, symbols, capacity: Optional[Dict[str, int]] = None):
+        capacity = {**CANDLE_CAPACITY, **(capacity or {})}
+        self.series = {
+            symbol: {name: CandleSeries(interval, capacity[name]) for name, interval in CANDLE_INTERVALS.items()}
+            for symbol in symbols
+        }
+        self.lock = threading.Lock()
+
+    def add_tick(self, symbol: str, price: float, volume: float = 0.0, timestamp: Optional[float] = None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            for series in self.series[symbol].values():
+                series.add(price, volume, timestamp)
+
+    def add_ticks(self, prices: Dict[str, float], timestamp: Optional[float] = None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            for symbol, price in prices.items():
+                for series in self.series[symbol].values():
+                    series.add(price, 0.0, timestamp)
+
+    def query(self, symbol: str, interval: str, start: float, end: float, limit: int = CANDLE_LIMIT) -> List[list]:
+        with self.lock:
+            return self.series[symbol][interval].query(start, end, limit)
+
+def parse_candle_query(query, symbols, symbol_key: str = 'coin') -> Tuple[str, str, float, float, int]:
+    # ตรวจ GET_CANDLES ของทุก server ที่เดียว ค่าที่ใช้ไม่ได้ raise ValueError พร้อมข้อความที่ส่งกลับ client ได้เลย
+    # start / end / limit ต้องเป็นตัวเลขจริงที่ไม่ใช่ bool / NaN / Infinity ไม่อย่างนั้น query จะพังกลางทาง
+    if not isinstance(query, dict):
+        raise ValueError("Query must be an object")
+    symbol = query.get(symbol_key)
+    interval = query.get('interval', '1m')
+    if not isinstance(symbol, str) or symbol not in symbols:
+        raise ValueError(f"Invalid {symbol_key}")
+    if not isinstance(interval, str) or interval not in CANDLE_INTERVALS:
+        raise ValueError(f"Invalid interval, use one of {', '.join(CANDLE_INTERVALS)}")
+    values = [query.get('start', 0), query.get('end', time.time()), query.get('limit', CANDLE_LIMIT)]
+    for value in values:
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+            raise ValueError("start, end and limit must be finite numbers")
+    start, end, limit = values
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    return symbol, interval, start, end, min(int(limit), CANDLE_LIMIT)
+
+class MarketSimulator:
+    # geometric Brownian motion + jump ราคาคูณด้วย exp(return) จึงไม่ติดลบหรือวิ่งเข้าหา 0 แบบคูณ (1 + uniform)
+    # มี numpy จะคำนวณทุกเหรียญพร้อมกันทีละ batch ถ้าไม่มีจะวนทีละเหรียญด้วย random.Random
+    def __init__(self, prices: Dict[str, float], seed: Optional[int] = None, drift: float = 0.0,
+                 volatility: float = SIMULATOR_VOLATILITY, jump_probability: float = SIMULATOR_JUMP_PROBABILITY,
+                 jump_size: float = SIMULATOR_JUMP_SIZE):
+        self.symbols = list(prices)
+        self.drift = drift - 0.5 * volatility * volatility
+        self.volatility = volatility
+        self.jump_probability = jump_probability
+        self.jump_size = jump_size
+        if numpy is not None:
+            self.rng = numpy.random.default_rng(seed)
+            self.values = numpy.array([prices[symbol] for symbol in self.symbols], dtype='float64')
+        else:
+            self.rng = random.Random(seed)
+            self.values = [prices[symbol] for symbol in self.symbols]
+
+    @classmethod
+    def generate(cls, count: int, seed: Optional[int] = None, **options) -> 'MarketSimulator':
+        # สร้างเหรียญสมมติจำนวนมากไว้ load test ราคาเริ่มต้นกระจายแบบ log-uniform ระหว่าง 1 ถึง 10000
+        rng = random.Random(seed)
+        prices = {f"S{i:05d}": round(10 ** rng.uniform(0, 4), 2) for i in range(count)}
+        return cls(prices, seed, **options)
+
+    def prices(self) -> Dict[str, float]:
+        values = self.values.tolist() if numpy is not None else self.values
+        return dict(zip(self.symbols, values))
+
+    def step(self) -> Dict[str, float]:
+        if numpy is not None:
+            count = len(self.symbols)
+            returns = self.drift + self.volatility * self.rng.standard_normal(count)
+            jumps = self.rng.random(count) < self.jump_probability
+            returns[jumps] += self.rng.normal(0.0, self.jump_size, int(jumps.sum()))
+            self.values *= numpy.exp(returns)
+        else:
+            gauss = self.rng.gauss
+            for i in range(len(self.values)):
+                change = self.drift + self.volatility * gauss(0.0, 1.0)
+                if self.rng.random() < self.jump_probability:
+                    change += gauss(0.0, self.jump_size)
+                self.values[i] *= math.exp(change)
+        return self.prices()
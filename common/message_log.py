@@ -0,0 +1,47 @@
+import mmap
+import threading
+from array import array
+
+# log ข้อความแชทแบบต่อท้ายไฟล์ พร้อมไฟล์ index เก็บตำแหน่งเริ่มของแต่ละข้อความ
+# ใช้ร่วมกันระหว่าง simple-chat และ chat-app
+class MessageLog:
+    def __init__(self, name):
+        self.log_path = f"{name}.log"
+        self.index_path = f"{name}.idx"
+        self.lock = threading.Lock()
+        self.log_file = open(self.log_path, 'ab')
+        self.index_file = open(self.index_path, 'ab')
+        self.offsets = array('Q')  # ตำแหน่ง byte เริ่มต้นของแต่ละข้อความใน log
+        with open(self.index_path, 'rb') as f:
+            self.offsets.frombytes(f.read())
+        self.size = self.log_file.tell()
+        self.mapped = None
+
+    def append(self, text):
+        data = text.replace('\n', ' ').encode('utf-8') + b'\n'
+        with self.lock:
+            self.offsets.append(self.size)
+            self.log_file.write(data)
+            self.log_file.flush()
+            self.index_file.write(self.offsets[-1:].tobytes())
+            self.index_file.flush()
+            self.size += len(data)
+            return len(self.offsets)
+
+    def read_page(self, last_seen, limit):
+        # ข้อความถัดจาก last_seen ไม่เกิน limit ข้อความ last_seen เป็น None คือขอ limit ข้อความล่าสุด
+        # คืน (offset ของข้อความสุดท้ายในหน้านี้, จำนวนข้อความที่ยังเหลือหลังหน้านี้, ข้อความ)
+        with self.lock:
+            count = len(self.offsets)
+            start = max(count - limit, 0) if last_seen is None else min(max(last_seen, 0), count)
+            end = min(start + limit, count)
+            if start == end:
+                return end, 0, ''
+            if self.mapped is None or len(self.mapped) < self.size:
+                if self.mapped is not None:
+                    self.mapped.close()
+                with open(self.log_path, 'rb') as f:
+                    self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stop = self.offsets[end] if end < count else self.size
+            data = self.mapped[self.offsets[start]:stop]
+        return end, count - end, data.decode('utf-8')
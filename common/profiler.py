@@ -0,0 +1,86 @@
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, Optional
+
+# PROFILE ของ CTSP, CTSPR และ trade-tip ใช้ profiler ตัวนี้ร่วมกัน
+PROFILE_INTERVAL = 0.005  # วินาทีระหว่างการเก็บ stack แต่ละครั้ง
+PROFILE_MIN_INTERVAL = 0.001  # เก็บถี่กว่านี้ thread ของ profiler จะวนอ่าน stack ของทุก thread จนแย่ง CPU กับ server
+PROFILE_MAX_DURATION = 300
+PROFILE_MEMORY_TOP = 20
+
+class SamplingProfiler:
+    # thread แยกคอยอ่าน stack ของทุก thread ผ่าน sys._current_frames ทุก interval
+    # ไม่ต้อง restart server และ thread ที่รับ request ยังทำงานต่อตามปกติระหว่างเก็บ
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration: float, interval: float = PROFILE_INTERVAL, memory: bool = False) -> bool:
+        # nan, inf และค่าติดลบใช้เป็นเวลาไม่ได้ ส่วนค่าที่มากหรือถี่เกินไปตัดให้อยู่ในช่วงที่รับได้
+        if not 0 < duration < math.inf or not 0 < interval < math.inf:
+            raise ValueError("duration and interval must be positive numbers")
+        duration = min(duration, PROFILE_MAX_DURATION)
+        interval = max(interval, PROFILE_MIN_INTERVAL)
+        with self.lock:
+            if self.running():
+                return False
+            self.stop_event = threading.Event()
+            self.result = None
+            self.thread = threading.Thread(target=self._run, args=(duration, interval, memory, self.stop_event))
+            self.thread.daemon = True
+            self.thread.start()
+            return True
+
+    def stop(self) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            thread = self.thread
+        if thread is not None:
+            self.stop_event.set()
+            thread.join()
+        return self.result
+
+    def _run(self, duration: float, interval: float, memory: bool, stop_event: threading.Event):
+        started_tracing = memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        stacks: Dict[str, int] = {}
+        samples = 0
+        me = threading.get_ident()
+        started = time.monotonic()
+        deadline = started + duration
+        while not stop_event.is_set() and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                # รูปแบบ collapsed stack (root;...;leaf count) ใช้กับ flamegraph.pl / speedscope ได้ทันที
+                stack = ';'.join(reversed(frames))
+                stacks[stack] = stacks.get(stack, 0) + 1
+            samples += 1
+            stop_event.wait(interval)
+        result = {
+            'duration': time.monotonic() - started,
+            'samples': samples,
+            'collapsed': '\n'.join(f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+        }
+        if memory:
+            statistics = tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_MEMORY_TOP]
+            result['memory'] = [{'location': str(stat.traceback), 'size': stat.size, 'count': stat.count} for stat in statistics]
+            if started_tracing:
+                tracemalloc.stop()
+        self.result = result
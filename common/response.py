@@ -0,0 +1,29 @@
+import socket
+from typing import List
+
+# ส่วนหัวของ response ที่ CTSP, CTSPR และ CTSP11/guide ใช้ร่วมกัน encode ไว้ล่วงหน้าตอน import
+# ต่อ response เหลือแค่ใส่ Content-Length และ header เฉพาะ request
+STATUS_PHRASES = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 413: "Payload Too Large", 500: "Internal Server Error"}
+STATUS_LINES = {code: f"CTSP/1.0 {code} {phrase}\n".encode() for code, phrase in STATUS_PHRASES.items()}
+STATUS_HEADERS = {code: f"Status: {code} {phrase}\n".encode() for code, phrase in STATUS_PHRASES.items()}  # CTSP11 ส่ง status เป็น header
+CONTENT_LENGTH_HEADER = b"Content-Length: %d\n\n"
+SENDMSG_MIN_SIZE = 16 * 1024  # จุดที่ sendmsg เริ่มเร็วกว่าการต่อ bytes (วัดบน loopback)
+
+def status_line(status_code: int) -> bytes:
+    return STATUS_LINES.get(status_code) or f"CTSP/1.0 {status_code} \n".encode()
+
+def status_header(status_code: int) -> bytes:
+    return STATUS_HEADERS.get(status_code) or f"Status: {status_code} \n".encode()
+
+def response_head(status_code: int, headers: bytes, length: int) -> bytes:
+    # บรรทัด status + header เฉพาะ request + Content-Length และบรรทัดว่างที่ปิด header
+    return status_line(status_code) + headers + CONTENT_LENGTH_HEADER % length
+
+def send_parts(sock: socket.socket, parts: List[bytes]):
+    # body เล็กต่อ bytes แล้ว sendall เร็วกว่าสร้าง iovec ของ sendmsg body ใหญ่ใช้ sendmsg ไม่ต้อง copy body
+    if len(parts[-1]) < SENDMSG_MIN_SIZE:
+        sock.sendall(b''.join(parts))
+        return
+    sent = sock.sendmsg(parts)
+    if sent < sum(map(len, parts)):
+        sock.sendall(b''.join(parts)[sent:])
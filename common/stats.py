@@ -0,0 +1,159 @@
+import threading
+import time
+from typing import Any, Dict, List
+
+# สถิติต่อ handler (จำนวน, error, latency histogram, bytes) ที่ CTSP และ CTSPR ใช้ร่วมกันสำหรับ GET_STATS / metrics
+HISTOGRAM_SUB_BITS = 4  # 16 ช่องย่อยต่อช่วงกำลังสอง ความคลาดเคลื่อนไม่เกิน ~6%
+HISTOGRAM_SIZE = 512  # ครอบคลุมถึงหลายชั่วโมง (หน่วย microsecond)
+PROMETHEUS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _histogram_index(micros: int) -> int:
+    # log-linear แบบ HDR: ค่าน้อยเก็บละเอียดทีละ 1us ค่ามากเก็บเป็นช่วงที่กว้างขึ้นตามกำลังสอง
+    shift = max(0, micros.bit_length() - HISTOGRAM_SUB_BITS - 1)
+    return min((shift << HISTOGRAM_SUB_BITS) + (micros >> shift), HISTOGRAM_SIZE - 1)
+
+def _histogram_value(index: int) -> int:
+    # ค่าสูงสุดของช่อง (us) ใช้ตอนหา percentile
+    if index < 2 << HISTOGRAM_SUB_BITS:
+        return index
+    shift = (index >> HISTOGRAM_SUB_BITS) - 1
+    return ((index - (shift << HISTOGRAM_SUB_BITS) + 1) << shift) - 1
+
+class ServerStats:
+    # แต่ละ thread นับลงตัวแปรของตัวเองโดยไม่ใช้ lock แล้วค่อยรวมกันตอนมีคนขอดู
+    # thread ที่จบไปแล้วจะถูกรวมเข้า retired ตอนอ่าน รายการจึงไม่โตตามจำนวน connection ที่เคยมี
+    # CTSPR รันทุกอย่างใน event loop เดียวจึงมีชุดเดียว แต่ใช้ร่วมกับ executor thread ได้ถ้าจำเป็น
+    def __init__(self):
+        self.started = time.time()
+        self.local = threading.local()
+        self.threads: List[tuple] = []  # [(thread, counters)]
+        self.retired = self._new_counters()
+        self.lock = threading.Lock()  # ใช้แค่ตอนลงทะเบียน thread ใหม่และตอนอ่าน
+
+    @staticmethod
+    def _new_counters() -> Dict[str, Any]:
+        return {'handlers': {}, 'opened': 0, 'closed': 0}
+
+    def _counters(self) -> Dict[str, Any]:
+        counters = getattr(self.local, 'counters', None)
+        if counters is None:
+            counters = self.local.counters = self._new_counters()
+            with self.lock:
+                self.threads.append((threading.current_thread(), counters))
+        return counters
+
+    def connection_opened(self):
+        self._counters()['opened'] += 1
+
+    def connection_closed(self):
+        self._counters()['closed'] += 1
+
+    def record(self, handler: str, seconds: float, error: bool, bytes_in: int, bytes_out: int):
+        try:
+            entry = self.local.counters['handlers'][handler]
+        except (AttributeError, KeyError):
+            # [count, errors, total_us, max_us, bytes_in, bytes_out, histogram]
+            entry = self._counters()['handlers'].setdefault(handler, [0, 0, 0, 0, 0, 0, [0] * HISTOGRAM_SIZE])
+        micros = int(seconds * 1000000)
+        entry[0] += 1
+        entry[1] += error
+        entry[2] += micros
+        if micros > entry[3]:
+            entry[3] = micros
+        entry[4] += bytes_in
+        entry[5] += bytes_out
+        entry[6][_histogram_index(micros)] += 1
+
+    @staticmethod
+    def _merge(target: Dict[str, Any], source: Dict[str, Any]):
+        target['opened'] += source['opened']
+        target['closed'] += source['closed']
+        for handler, entry in list(source['handlers'].items()):
+            merged = target['handlers'].get(handler)
+            if merged is None:
+                merged = target['handlers'][handler] = [0, 0, 0, 0, 0, 0, [0] * HISTOGRAM_SIZE]
+            for i in (0, 1, 2, 4, 5):
+                merged[i] += entry[i]
+            merged[3] = max(merged[3], entry[3])
+            merged[6] = [a + b for a, b in zip(merged[6], entry[6])]
+
+    def collect(self) -> Dict[str, Any]:
+        total = self._new_counters()
+        with self.lock:
+            alive = []
+            for thread, counters in self.threads:
+                if thread.is_alive():
+                    alive.append((thread, counters))
+                else:
+                    self._merge(self.retired, counters)
+            self.threads = alive
+            self._merge(total, self.retired)
+            for _, counters in alive:
+                self._merge(total, counters)
+        return total
+
+    @staticmethod
+    def _percentile(histogram: List[int], count: int, fraction: float) -> float:
+        target = fraction * count
+        seen = 0
+        for index, bucket in enumerate(histogram):
+            seen += bucket
+            if bucket and seen >= target:
+                return _histogram_value(index) / 1000
+        return 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        total = self.collect()
+        handlers = {}
+        for handler, (count, errors, total_us, max_us, bytes_in, bytes_out, histogram) in sorted(total['handlers'].items()):
+            handlers[handler] = {
+                'count': count,
+                'errors': errors,
+                'mean_ms': total_us / count / 1000 if count else 0.0,
+                'p50_ms': self._percentile(histogram, count, 0.5),
+                'p90_ms': self._percentile(histogram, count, 0.9),
+                'p99_ms': self._percentile(histogram, count, 0.99),
+                'max_ms': max_us / 1000,
+                'bytes_in': bytes_in,
+                'bytes_out': bytes_out
+            }
+        return {
+            'uptime': time.time() - self.started,
+            'active_connections': total['opened'] - total['closed'],
+            'connections_total': total['opened'],
+            'handlers': handlers
+        }
+
+    def prometheus(self) -> str:
+        total = self.collect()
+        lines = [
+            '# TYPE ctsp_active_connections gauge',
+            f"ctsp_active_connections {total['opened'] - total['closed']}",
+            '# TYPE ctsp_connections_total counter',
+            f"ctsp_connections_total {total['opened']}",
+            '# TYPE ctsp_request_duration_seconds histogram',
+        ]
+        counters = {'errors': [], 'bytes_in': [], 'bytes_out': []}
+        for handler, (count, errors, total_us, _, bytes_in, bytes_out, histogram) in sorted(total['handlers'].items()):
+            label = f'handler="{handler}"'
+            cumulative = 0
+            index = 0
+            for bound in PROMETHEUS_BUCKETS:
+                # นับช่องที่ค่าสูงสุดยังไม่เกินขอบ bucket ของ Prometheus
+                while index < HISTOGRAM_SIZE and _histogram_value(index) <= bound * 1000000:
+                    cumulative += histogram[index]
+                    index += 1
+                lines.append(f'ctsp_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'ctsp_request_duration_seconds_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f'ctsp_request_duration_seconds_sum{{{label}}} {total_us / 1000000}')
+            lines.append(f'ctsp_request_duration_seconds_count{{{label}}} {count}')
+            counters['errors'].append(f'ctsp_request_errors_total{{{label}}} {errors}')
+            counters['bytes_in'].append(f'ctsp_received_bytes_total{{{label}}} {bytes_in}')
+            counters['bytes_out'].append(f'ctsp_sent_bytes_total{{{label}}} {bytes_out}')
+        lines.append('# TYPE ctsp_request_errors_total counter')
+        lines.extend(counters['errors'])
+        lines.append('# TYPE ctsp_received_bytes_total counter')
+        lines.extend(counters['bytes_in'])
+        lines.append('# TYPE ctsp_sent_bytes_total counter')
+        lines.extend(counters['bytes_out'])
+        return '\n'.join(lines) + '\n'
@@ -1,5 +1,8 @@
 import socket
 import threading
+import queue
+
+SEND_QUEUE_SIZE = 100
 
 def handle_client(client_socket, client_address):
     while True:
@@ -11,35 +14,73 @@ def handle_client(client_socket, client_address):
             broadcast(f"{client_address}: {message}", client_socket)
         except:
             break
-    clients.remove(client_socket)
+    remove_client(client_socket)
+
+def send_loop(client_socket, send_queue):
+    while True:
+        data = send_queue.get()
+        if data is None:
+            break
+        try:
+            client_socket.sendall(data)
+        except:
+            remove_client(client_socket)
+            break
+
+def add_client(client_socket):
+    send_queue = queue.Queue(maxsize=SEND_QUEUE_SIZE)
+    with clients_lock:
+        clients[client_socket] = send_queue
+    sender_thread = threading.Thread(target=send_loop, args=(client_socket, send_queue), daemon=True)
+    sender_thread.start()
+
+def remove_client(client_socket):
+    with clients_lock:
+        send_queue = clients.pop(client_socket, None)
+    if send_queue is None:
+        return
+    try:
+        send_queue.put_nowait(None)
+    except queue.Full:
+        pass
+    try:
+        client_socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
     client_socket.close()
 
 def broadcast(message, sender_socket):
-    for client in clients:
+    data = message.encode('utf-8')
+    # คัดลอกรายชื่อผู้รับไว้ก่อน แล้วค่อยส่งนอก lock
+    with clients_lock:
+        recipients = list(clients.items())
+    for client, send_queue in recipients:
         if client != sender_socket:
             try:
-                client.send(message.encode('utf-8'))
-            except:
-                client.close()
-                clients.remove(client)
+                send_queue.put_nowait(data)
+            except queue.Full:
+                # ผู้รับค้างจนคิวเต็ม ตัดการเชื่อมต่อแทนที่จะรอ
+                remove_client(client)
 
 def accept_connections():
     while True:
         client_socket, client_address = server_socket.accept()
         print(f"เชื่อมต่อใหม่จาก {client_address}")
-        clients.append(client_socket)
+        add_client(client_socket)
         client_thread = threading.Thread(target=handle_client, args=(client_socket, client_address))
         client_thread.start()
 
 server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 server_socket.bind(('', 8082))
 server_socket.listen(5)
 
-clients = []
+clients = {}  # {client_socket: send_queue}
+clients_lock = threading.Lock()
 
 print("เซิร์ฟเวอร์กำลังทำงาน... กำลังรอการเชื่อมต่อ")
 accept_thread = threading.Thread(target=accept_connections)
 accept_thread.start()
 accept_thread.join()
 
-server_socket.close()
\ No newline at end of file
+server_socket.close()
@@ -7,10 +7,14 @@ class ChatClient:
         self.port = port
         self.username = username
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.buffer = b''
+        self.last_offset = None  # offset ของข้อความล่าสุดที่ได้รับ ใช้ขอข้อความที่ขาดไปตอนเชื่อมต่อใหม่
+        self.replaying = True  # ยังได้ HISTORY ไม่ครบทุกหน้า MESSAGE ที่มาระหว่างนี้พักไว้ใน pending
+        self.pending = []
 
     def start(self):
         self.client_socket.connect((self.host, self.port))
-        self.send_message('JOIN', self.username, '')
+        self.send_message('JOIN', self.username, '', self.last_offset)
         
         receive_thread = threading.Thread(target=self.receive_messages)
         receive_thread.start()
@@ -33,27 +37,63 @@ class ChatClient:
                 message = self.receive_message()
                 if not message:
                     break
-                print(f"{message['user']}: {message['content']}")
+                if message['type'] == 'HISTORY':
+                    print(message['content'], end='')
+                    self.last_offset = int(message['offset'])
+                    if int(message.get('remaining', 0)):
+                        self.send_message('HISTORY', self.username, '', self.last_offset)
+                        continue
+                    # MESSAGE ที่มาก่อน history หน้าสุดท้ายแต่ offset ใหม่กว่า ยังไม่อยู่ใน history ต้องแสดงต่อท้าย
+                    self.replaying = False
+                    for pending in self.pending:
+                        self.show(pending)
+                    self.pending = []
+                elif self.replaying:
+                    self.pending.append(message)
+                else:
+                    self.show(message)
             except Exception as e:
                 print(f"Error receiving message: {e}")
                 break
 
-    def send_message(self, msg_type, user, content):
-        message = f"TYPE: {msg_type}\nUSER: {user}\nLENGTH: {len(content)}\n\n{content}"
-        self.client_socket.send(message.encode())
+    def show(self, message):
+        if 'offset' in message:
+            if self.last_offset is not None and int(message['offset']) <= self.last_offset:
+                return
+            self.last_offset = int(message['offset'])
+        print(f"{message['user']}: {message['content']}")
+
+    def send_message(self, msg_type, user, content, offset=None):
+        data = content.encode()
+        header = f"TYPE: {msg_type}\nUSER: {user}\n"
+        if offset is not None:
+            header += f"OFFSET: {offset}\n"
+        header += f"LENGTH: {len(data)}\n\n"
+        self.client_socket.sendall(header.encode() + data)
 
     def receive_message(self):
-        headers = self.client_socket.recv(1024).decode().strip().split('\n')
+        # HISTORY อาจยาวกว่าหนึ่ง recv จึงต้องอ่านจาก buffer จนครบตาม LENGTH
+        while b'\n\n' not in self.buffer:
+            chunk = self.client_socket.recv(4096)
+            if not chunk:
+                return None
+            self.buffer += chunk
+        header_data, self.buffer = self.buffer.split(b'\n\n', 1)
         message = {}
-        for header in headers:
+        for header in header_data.decode().split('\n'):
             if ': ' in header:
                 key, value = header.split(': ', 1)
                 message[key.lower()] = value
-        
-        if 'length' in message:
-            content_length = int(message['length'])
-            message['content'] = self.client_socket.recv(content_length).decode()
-        
+
+        content_length = int(message.get('length', 0))
+        while len(self.buffer) < content_length:
+            chunk = self.client_socket.recv(max(content_length - len(self.buffer), 4096))
+            if not chunk:
+                return None
+            self.buffer += chunk
+        message['content'] = self.buffer[:content_length].decode()
+        self.buffer = self.buffer[content_length:]
+
         return message
     
 client = ChatClient('localhost', 5000, 'YourUsername')
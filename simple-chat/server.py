@@ -1,13 +1,25 @@
 # server.py
+import os
+import sys
 import socket
 import threading
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.message_log import MessageLog
+
+REPLAY_LIMIT = 100  # จำนวนข้อความย้อนหลังสูงสุดต่อ HISTORY หนึ่งครั้ง ที่เหลือ client ขอหน้าถัดไปเอง
+MAX_HEADER_SIZE = 1024  # header ยาวกว่านี้ถือว่าผิดรูปแบบ
+MAX_CONTENT_LENGTH = 64 * 1024
+
 class ChatServer:
     def __init__(self, host, port):
         self.host = host
         self.port = port
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.clients = {}  # {client_socket: username}
+        self.send_locks = {}  # {client_socket: lock} broadcast กับ HISTORY ส่งจากคนละ thread frame ต้องไม่ปนกัน
+        self.history = MessageLog('simple-chat-history')
+        self.lock = threading.Lock()
 
     def start(self):
         self.server_socket.bind((self.host, self.port))
@@ -20,52 +32,99 @@ class ChatServer:
             client_thread.start()
 
     def handle_client(self, client_socket):
+        buffer = b''
+        self.send_locks[client_socket] = threading.Lock()
         while True:
             try:
-                message = self.receive_message(client_socket)
+                message, buffer = self.receive_message(client_socket, buffer)
                 if not message:
                     break
                 
                 if message['type'] == 'JOIN':
-                    self.clients[client_socket] = message['user']
+                    # อ่านหน้าแรกแล้วลงทะเบียนใต้ lock แต่ส่งหลังปล่อย lock client ที่อ่านช้าจะไม่ขวาง broadcast ของคนอื่น
+                    # ข้อความที่ broadcast แทรกก่อน HISTORY มี offset มากกว่าหน้านี้เสมอ client พักไว้แล้วแสดงต่อจาก history
+                    with self.lock:
+                        page = self.history.read_page(self.parse_offset(message), REPLAY_LIMIT)
+                        self.clients[client_socket] = message['user']
+                    self.send_history(client_socket, page)
                     self.broadcast(f"{message['user']} has joined the chat.")
+                elif message['type'] == 'HISTORY':
+                    # หน้าถัดไปของ history ต่อจาก OFFSET ที่ได้ในหน้าก่อน
+                    self.send_history(client_socket, self.history.read_page(self.parse_offset(message), REPLAY_LIMIT))
                 elif message['type'] == 'LEAVE':
                     self.broadcast(f"{message['user']} has left the chat.")
-                    del self.clients[client_socket]
+                    with self.lock:
+                        del self.clients[client_socket]
                     break
                 elif message['type'] == 'MESSAGE':
                     self.broadcast(f"{message['user']}: {message['content']}")
             except Exception as e:
                 print(f"Error handling client: {e}")
                 break
-        
+
+        with self.lock:
+            self.clients.pop(client_socket, None)
+            del self.send_locks[client_socket]
         client_socket.close()
 
-    def receive_message(self, client_socket):
+    def receive_message(self, client_socket, buffer):
+        # ข้อความหลายอันอาจมาใน recv เดียว หรือหนึ่งข้อความอาจแบ่งหลาย recv จึงเก็บส่วนที่เหลือไว้ใน buffer
         try:
-            headers = client_socket.recv(1024).decode().strip().split('\n')
+            while b'\n\n' not in buffer:
+                if len(buffer) > MAX_HEADER_SIZE:
+                    raise ValueError("header too large")
+                chunk = client_socket.recv(4096)
+                if not chunk:
+                    return None, buffer
+                buffer += chunk
+            header_data, buffer = buffer.split(b'\n\n', 1)
             message = {}
-            for header in headers:
+            for header in header_data.decode().split('\n'):
                 if ': ' in header:
                     key, value = header.split(': ', 1)
                     message[key.lower()] = value
-            
-            if 'length' in message:
-                content_length = int(message['length'])
-                message['content'] = client_socket.recv(content_length).decode()
-            
-            return message
+
+            content_length = int(message.get('length', 0))
+            if not 0 <= content_length <= MAX_CONTENT_LENGTH:
+                raise ValueError(f"invalid length {content_length}")
+            while len(buffer) < content_length:
+                chunk = client_socket.recv(4096)
+                if not chunk:
+                    return None, buffer
+                buffer += chunk
+            message['content'] = buffer[:content_length].decode()
+            return message, buffer[content_length:]
         except Exception as e:
             print(f"Error receiving message: {e}")
-            return None
+            return None, buffer
+
+    @staticmethod
+    def parse_offset(message):
+        # ไม่มี OFFSET คือเข้าห้องครั้งแรก ได้ REPLAY_LIMIT ข้อความล่าสุด
+        offset = message.get('offset')
+        return None if offset is None else int(offset)
+
+    def send_history(self, client_socket, page):
+        # ส่งทุกครั้งแม้ว่าง REMAINING บอก client ว่าต้องขอหน้าถัดไปอีกหรือ replay จบแล้ว
+        offset, remaining, backlog = page
+        self.send_message(client_socket, 'HISTORY', 'Server', backlog, offset, remaining)
 
     def broadcast(self, message):
-        for client_socket in self.clients:
-            self.send_message(client_socket, 'MESSAGE', 'Server', message)
+        with self.lock:
+            offset = self.history.append(message)
+            for client_socket in self.clients:
+                self.send_message(client_socket, 'MESSAGE', 'Server', message, offset)
 
-    def send_message(self, client_socket, msg_type, user, content):
-        message = f"TYPE: {msg_type}\nUSER: {user}\nLENGTH: {len(content)}\n\n{content}"
-        client_socket.send(message.encode())
+    def send_message(self, client_socket, msg_type, user, content, offset=None, remaining=None):
+        data = content.encode()
+        header = f"TYPE: {msg_type}\nUSER: {user}\n"
+        if offset is not None:
+            header += f"OFFSET: {offset}\n"
+        if remaining is not None:
+            header += f"REMAINING: {remaining}\n"
+        header += f"LENGTH: {len(data)}\n\n"
+        with self.send_locks[client_socket]:
+            client_socket.sendall(header.encode() + data)
 if __name__ == "__main__":
     # For server
     server = ChatServer('localhost', 5000)
@@ -1,36 +1,525 @@
 # server.py
 import socket
+import threading
+import os
+import mimetypes
+import time
+import zlib
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote
 
-def handle_request(request):
-    # แยกส่วนของ request
-    headers, body = request.split('\r\n\r\n', 1)
-    request_line = headers.split('\r\n')[0]
-    method, path, _ = request_line.split()
-    
-    if method == 'GET':
-        if path == '/':
-            response = "HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\nHello, World!"
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RECV_SIZE = 65536
+KEEP_ALIVE_TIMEOUT = 5  # วินาทีที่รอ request ถัดไปบน connection เดิม
+MAX_HEADER_SIZE = 65536
+MAX_BODY_SIZE = 1024 * 1024  # body ที่ใหญ่กว่านี้ตอบ 413 โดยไม่อ่านต่อ
+
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+CACHE_MAX_FILE_SIZE = 64 * 1024  # ไฟล์ที่เล็กกว่านี้เก็บไว้ใน memory
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+COMPRESS_MIN_SIZE = 1024  # body ที่เล็กกว่านี้บีบอัดแล้วไม่คุ้ม CPU
+COMPRESSION_CACHE_SIZE = 256
+SUPPORTED_ENCODINGS = ('zstd', 'gzip', 'deflate') if zstandard else ('gzip', 'deflate')
+
+STATUS_PHRASES = {
+    200: "OK",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Content Too Large",
+    416: "Range Not Satisfiable",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+}
+
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class FileBody:
+    def __init__(self, path, offset, length):
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def send(self, conn):
+        # socket.sendfile ใช้ os.sendfile ส่งจาก page cache ตรงไปที่ socket โดยไม่ copy ผ่าน user space
+        with open(self.path, 'rb') as f:
+            conn.sendfile(f, self.offset, self.length)
+
+class FileCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()  # {path: (mtime_ns, size, data)}
+        self.lock = threading.Lock()
+
+    def get(self, path, st):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != st.st_mtime_ns or entry[1] != st.st_size:
+                return None
+            self.entries.move_to_end(path)
+            return entry[2]
+
+    def put(self, path, st, data):
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[2])
+            self.entries[path] = (st.st_mtime_ns, st.st_size, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[2])
+
+file_cache = FileCache(CACHE_MAX_BYTES)
+
+def parse_range(value, size):
+    # รองรับเฉพาะช่วงเดียว เช่น bytes=0-499, bytes=500-, bytes=-500
+    if not value.startswith('bytes=') or ',' in value:
+        return None
+    start, _, end = value[6:].strip().partition('-')
+    try:
+        if start == '':
+            length = int(end)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+def not_modified(headers, etag, mtime):
+    if 'if-none-match' in headers:
+        # If-None-Match ใช้ weak comparison จึงตัด W/ ที่ compression_middleware เติมให้ออกก่อน
+        tags = [tag.strip().removeprefix('W/') for tag in headers['if-none-match'].split(',')]
+        return '*' in tags or etag in tags
+    if 'if-modified-since' in headers:
+        try:
+            return int(mtime) <= parsedate_to_datetime(headers['if-modified-since']).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def serve_static(request):
+    relative_path = unquote(request['params']['path'])
+    path = os.path.realpath(os.path.join(STATIC_ROOT, relative_path))
+    if not path.startswith(STATIC_ROOT + os.sep):
+        return 404, {'Content-Type': 'text/plain'}, b"Page not found"
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 404, {'Content-Type': 'text/plain'}, b"Page not found"
+    if not os.path.isfile(path):
+        return 404, {'Content-Type': 'text/plain'}, b"Page not found"
+
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(st.st_mtime, usegmt=True),
+        'Accept-Ranges': 'bytes',
+    }
+    if not_modified(request['headers'], etag, st.st_mtime):
+        return 304, headers, b""
+
+    headers['Content-Type'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    status, start, end = 200, 0, st.st_size - 1
+    range_header = request['headers'].get('range')
+    if range_header and request['headers'].get('if-range', etag) == etag:
+        byte_range = parse_range(range_header, st.st_size)
+        if byte_range is False:
+            headers['Content-Range'] = f"bytes */{st.st_size}"
+            return 416, headers, b""
+        if byte_range:
+            status, (start, end) = 206, byte_range
+            headers['Content-Range'] = f"bytes {start}-{end}/{st.st_size}"
+
+    if st.st_size > CACHE_MAX_FILE_SIZE:
+        return status, headers, FileBody(path, start, end - start + 1)
+    data = file_cache.get(path, st)
+    if data is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        file_cache.put(path, st, data)
+    return status, headers, data[start:end + 1]
+
+class RouteNode:
+    __slots__ = ('children', 'param_name', 'param_child', 'rest_name', 'rest_handlers', 'handlers')
+
+    def __init__(self):
+        self.children = {}
+        self.param_name = None
+        self.param_child = None
+        self.rest_name = None
+        self.rest_handlers = {}
+        self.handlers = {}
+
+class Router:
+    # path ที่ไม่มี parameter ถูก compile เป็น dict lookup ครั้งเดียว ส่วนที่มี {name} หรือ {name*} ใช้ trie
+    def __init__(self):
+        self.routes = []  # [(method, pattern, handler)]
+        self.middlewares = []
+        self.static_routes = {}  # {(method, path): handler}
+        self.root = RouteNode()
+
+    def add_route(self, method, pattern, handler):
+        self.routes.append((method, pattern, handler))
+
+    def route(self, method, pattern):
+        def decorator(handler):
+            self.add_route(method, pattern, handler)
+            return handler
+        return decorator
+
+    def use(self, middleware):
+        self.middlewares.append(middleware)
+
+    def compile(self):
+        self.static_routes = {}
+        self.root = RouteNode()
+        for method, pattern, handler in self.routes:
+            # ห่อ middleware ไว้ตั้งแต่ตอน compile จึงไม่มีงานเพิ่มต่อ request ถ้าไม่ได้ใช้ middleware
+            for middleware in reversed(self.middlewares):
+                handler = middleware(handler)
+            segments = [segment for segment in pattern.split('/') if segment]
+            if not any(segment.startswith('{') for segment in segments):
+                self.static_routes[(method, '/' + '/'.join(segments))] = handler
+            node = self.root
+            for segment in segments:
+                if segment.startswith('{') and segment.endswith('*}'):
+                    node.rest_name = segment[1:-2]
+                    node.rest_handlers[method] = handler
+                    break
+                if segment.startswith('{'):
+                    if node.param_child is None:
+                        node.param_child = RouteNode()
+                        node.param_name = segment[1:-1]
+                    node = node.param_child
+                else:
+                    node = node.children.setdefault(segment, RouteNode())
+            else:
+                node.handlers[method] = handler
+
+    def match(self, method, path):
+        segments = [segment for segment in path.split('/') if segment]
+        params = {}
+        fallbacks = []  # catch-all ({name*}) ที่เจอระหว่างทาง เผื่อ path ตรงตัวไม่มี method นี้
+        node = self.root
+        for i, segment in enumerate(segments):
+            if node.rest_handlers:
+                fallbacks.append((node, i, dict(params)))
+            child = node.children.get(segment)
+            if child is None and node.param_child is not None:
+                params[node.param_name] = segment
+                child = node.param_child
+            if child is None:
+                node = None
+                break
+            node = child
         else:
-            response = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n\r\nPage not found"
-    elif method == 'POST':
-        response = f"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\nReceived: {body}"
+            if node.rest_handlers:
+                fallbacks.append((node, len(segments), dict(params)))
+
+        allowed = node is not None and bool(node.handlers)
+        if allowed and method in node.handlers:
+            return 200, node.handlers[method], params
+        for rest_node, i, rest_params in reversed(fallbacks):
+            if method in rest_node.rest_handlers:
+                rest_params[rest_node.rest_name] = '/'.join(segments[i:])
+                return 200, rest_node.rest_handlers[method], rest_params
+        return (405 if allowed else 404), None, params
+
+    def dispatch(self, request):
+        path = request['path'].split('?', 1)[0]
+        handler = self.static_routes.get((request['method'], path))
+        if handler is not None:
+            request['params'] = {}
+            return handler(request)
+        status, handler, params = self.match(request['method'], path)
+        if handler is None:
+            if status == 405:
+                return 405, {'Content-Type': 'text/plain'}, b"Method not allowed"
+            return 404, {'Content-Type': 'text/plain'}, b"Page not found"
+        request['params'] = params
+        return handler(request)
+
+def logging_middleware(handler):
+    def wrapper(request):
+        status, headers, body = handler(request)
+        print(f"{request['method']} {request['path']} {status}")
+        return status, headers, body
+    return wrapper
+
+def timing_middleware(handler):
+    def wrapper(request):
+        start = time.perf_counter()
+        status, headers, body = handler(request)
+        headers['Server-Timing'] = f"app;dur={(time.perf_counter() - start) * 1000:.3f}"
+        return status, headers, body
+    return wrapper
+
+def choose_encoding(accept_encoding):
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        params = params.strip()
+        q = 1.0
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in SUPPORTED_ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compress(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
     else:
-        response = "HTTP/1.1 405 Method Not Allowed\r\nContent-Type: text/plain\r\n\r\nMethod not allowed"
-    
-    return response.encode()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 15)
+    return compressor.compress(data) + compressor.flush()
+
+class CompressionCache:
+    # body ที่ซ้ำกัน (เช่นไฟล์ static หรือข้อมูลที่เปลี่ยนตาม tick) ไม่ต้องบีบอัดใหม่ทุกครั้ง
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # {(encoding, body): compressed}
+        self.lock = threading.Lock()
+
+    def compress(self, data, encoding):
+        if len(data) > CACHE_MAX_FILE_SIZE:
+            return compress(data, encoding)
+        key = (encoding, data)
+        with self.lock:
+            compressed = self.entries.get(key)
+            if compressed is not None:
+                self.entries.move_to_end(key)
+                return compressed
+        compressed = compress(data, encoding)
+        with self.lock:
+            self.entries[key] = compressed
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return compressed
+
+compression_cache = CompressionCache(COMPRESSION_CACHE_SIZE)
+
+def compression_middleware(handler):
+    def wrapper(request):
+        status, headers, body = handler(request)
+        if status != 200 or not isinstance(body, bytes) or len(body) < COMPRESS_MIN_SIZE:
+            return status, headers, body
+        encoding = choose_encoding(request['headers'].get('accept-encoding', ''))
+        if encoding is None or 'Content-Encoding' in headers:
+            return status, headers, body
+        compressed = compression_cache.compress(body, encoding)
+        if len(compressed) >= len(body):
+            return status, headers, body
+        headers['Content-Encoding'] = encoding
+        headers['Vary'] = 'Accept-Encoding'
+        if 'ETag' in headers and not headers['ETag'].startswith('W/'):
+            headers['ETag'] = 'W/' + headers['ETag']
+        return status, headers, compressed
+    return wrapper
+
+router = Router()
+
+@router.route('GET', '/')
+def index(request):
+    return 200, {'Content-Type': 'text/plain'}, b"Hello, World!"
+
+@router.route('POST', '/{path*}')
+def echo(request):
+    return 200, {'Content-Type': 'text/plain'}, b"Received: " + request['body']
+
+router.add_route('GET', '/static/{path*}', serve_static)
+router.use(compression_middleware)
+router.compile()
+
+def handle_request(request):
+    return router.dispatch(request)
+
+def build_response(status, headers, body, keep_alive):
+    lines = [f"HTTP/1.1 {status} {STATUS_PHRASES.get(status, '')}"]
+    for key, value in headers.items():
+        lines.append(f"{key}: {value}")
+    if status != 304:
+        lines.append(f"Content-Length: {len(body)}")
+    if not keep_alive:
+        lines.append("Connection: close")
+    head = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+    if isinstance(body, FileBody):
+        return head
+    return head + body
+
+def read_until(conn, buffer, length):
+    while len(buffer) < length:
+        chunk = conn.recv(RECV_SIZE)
+        if not chunk:
+            raise ConnectionError("connection closed in the middle of a request")
+        buffer += chunk
+
+def read_line(conn, buffer, start):
+    while True:
+        end = buffer.find(b"\r\n", start)
+        if end != -1:
+            return end
+        if len(buffer) - start > MAX_HEADER_SIZE:
+            raise BadRequest(400, "Line too long")
+        read_until(conn, buffer, len(buffer) + 1)
+
+def read_chunked_body(conn, buffer, start):
+    body = bytearray()
+    pos = start
+    while True:
+        end = read_line(conn, buffer, pos)
+        try:
+            size = int(bytes(buffer[pos:end]).split(b";", 1)[0], 16)
+        except ValueError:
+            raise BadRequest(400, "Invalid chunk size")
+        if size < 0:
+            raise BadRequest(400, "Invalid chunk size")
+        if len(body) + size > MAX_BODY_SIZE:
+            raise BadRequest(413, "Request body too large")
+        pos = end + 2
+        if size == 0:
+            # ข้าม trailer headers จนถึงบรรทัดว่าง
+            while True:
+                if len(buffer) - pos > MAX_HEADER_SIZE:
+                    raise BadRequest(431, "Request headers too large")
+                end = read_line(conn, buffer, pos)
+                line_empty = end == pos
+                pos = end + 2
+                if line_empty:
+                    return bytes(body), pos
+        read_until(conn, buffer, pos + size + 2)
+        body += buffer[pos:pos + size]
+        pos += size + 2
+
+def read_request(conn, buffer):
+    # อ่าน request หนึ่งอันจาก buffer (ข้อมูลที่เหลือคือ request ถัดไปที่ถูก pipeline มา)
+    while True:
+        head_end = buffer.find(b"\r\n\r\n")
+        if head_end != -1:
+            break
+        if len(buffer) > MAX_HEADER_SIZE:
+            raise BadRequest(431, "Request headers too large")
+        chunk = conn.recv(RECV_SIZE)
+        if not chunk:
+            if buffer:
+                raise ConnectionError("connection closed in the middle of a request")
+            return None
+        buffer += chunk
+
+    lines = bytes(buffer[:head_end]).decode('latin-1').split("\r\n")
+    try:
+        method, path, version = lines[0].split()
+        headers = {}
+        for line in lines[1:]:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    except ValueError:
+        raise BadRequest(400, "Malformed request")
+
+    body_start = head_end + 4
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        body, body_end = read_chunked_body(conn, buffer, body_start)
+    else:
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise BadRequest(400, "Invalid Content-Length")
+        if length < 0:
+            raise BadRequest(400, "Invalid Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise BadRequest(413, "Request body too large")
+        body_end = body_start + length
+        read_until(conn, buffer, body_end)
+        body = bytes(buffer[body_start:body_end])
+    del buffer[:body_end]
+
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        keep_alive = connection == 'keep-alive'
+    else:
+        keep_alive = connection != 'close'
+
+    return {
+        'method': method,
+        'path': path,
+        'version': version,
+        'headers': headers,
+        'body': body,
+        'keep_alive': keep_alive,
+    }
+
+def handle_connection(conn, addr):
+    conn.settimeout(KEEP_ALIVE_TIMEOUT)
+    buffer = bytearray()
+    pending = []
+    try:
+        while True:
+            try:
+                request = read_request(conn, buffer)
+            except BadRequest as e:
+                conn.sendall(b"".join(pending) + build_response(e.status, {'Content-Type': 'text/plain'}, str(e).encode(), False))
+                return
+            if request is None:
+                break
+            try:
+                status, headers, body = handle_request(request)
+            except Exception as e:
+                print(f"Error handling request from {addr}: {e}")
+                status, headers, body = 500, {'Content-Type': 'text/plain'}, b"Internal server error"
+            pending.append(build_response(status, headers, body, request['keep_alive']))
+            if isinstance(body, FileBody):
+                conn.sendall(b"".join(pending))
+                pending.clear()
+                body.send(conn)
+            if not request['keep_alive']:
+                break
+            # ถ้ามี request ถัดไปรออยู่ใน buffer แล้ว (pipelining) ให้รวบ response แล้วส่งทีเดียว
+            if b"\r\n\r\n" not in buffer:
+                conn.sendall(b"".join(pending))
+                pending.clear()
+        if pending:
+            conn.sendall(b"".join(pending))
+    except (socket.timeout, ConnectionError):
+        pass
+    finally:
+        conn.close()
 
 def run_server(host, port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((host, port))
-        s.listen()
+        s.listen(1024)
         print(f"Server running on {host}:{port}")
         while True:
             conn, addr = s.accept()
-            with conn:
-                print(f"Connected by {addr}")
-                data = conn.recv(1024).decode()
-                response = handle_request(data)
-                conn.sendall(response)
+            threading.Thread(target=handle_connection, args=(conn, addr), daemon=True).start()
 
 if __name__ == "__main__":
-    run_server('localhost', 8080)
\ No newline at end of file
+    run_server('localhost', 8080)
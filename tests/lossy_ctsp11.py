@@ -0,0 +1,127 @@
+# ทดสอบ CTSP11/guide ผ่าน proxy ที่ทิ้ง response และทำ request เสีย เทียบ goodput ของ window กับ stop-and-wait (window=1)
+# ทุก request ต้องจบ (ได้ response หรือถูกยืนยันด้วย Ack) และ window ต้องได้ goodput มากกว่า stop-and-wait เมื่อมี loss
+# รัน: python tests/lossy_ctsp11.py [จำนวน request] [loss rate ...]
+import os
+import queue
+import random
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'CTSP11', 'guide'))
+import server as ctsp_server
+import client as ctsp_client
+
+PORT = 6889
+PROXY_PORT = PORT + 1
+DELAY = 0.005  # latency ทางเดียวของ proxy
+WINDOW = 8
+
+class LossyProxy:
+    # ฝั่ง client -> server ทำ payload เสีย (server ตอบ NACK) ฝั่ง server -> client ทิ้ง response ทั้ง frame
+    def __init__(self, port, upstream, loss):
+        self.loss = loss
+        self.upstream = upstream
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('localhost', port))
+        self.listener.listen()
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            downstream, _ = self.listener.accept()
+            upstream = socket.create_connection(('localhost', self.upstream))
+            threading.Thread(target=self.pipe, args=(downstream, upstream, True), daemon=True).start()
+            threading.Thread(target=self.pipe, args=(upstream, downstream, False), daemon=True).start()
+
+    def pipe(self, src, dst, corrupt):
+        delayed = queue.Queue()
+        threading.Thread(target=self.deliver, args=(dst, delayed), daemon=True).start()
+        for head, body in read_frames(src):
+            if random.random() < self.loss:
+                if not corrupt:
+                    continue
+                if len(body) > 2:
+                    body = body[:1] + b'X' + body[2:]
+            delayed.put((time.monotonic() + DELAY, head + b'\n\n' + body))
+
+    @staticmethod
+    def deliver(dst, delayed):
+        while True:
+            deadline, data = delayed.get()
+            wait = deadline - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                dst.sendall(data)
+            except OSError:
+                return
+
+def read_frames(sock):
+    buffer = b''
+    while True:
+        while b'\n\n' not in buffer:
+            try:
+                chunk = sock.recv(65536)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buffer += chunk
+        head, buffer = buffer.split(b'\n\n', 1)
+        length = 0
+        for line in head.split(b'\n'):
+            if line.startswith(b'Content-Length: '):
+                length = int(line[len(b'Content-Length: '):])
+        while len(buffer) < length:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return
+            buffer += chunk
+        yield head, buffer[:length]
+        buffer = buffer[length:]
+
+def run(requests, window):
+    random.seed(1)
+    client = ctsp_client.CTSPClient(port=PROXY_PORT)
+    client.connect()
+    while client.enter('Satoshi', 'bitcoin123')['status'] != 200:
+        pass
+    started = time.perf_counter()
+    results = client.send_window([('PING', {})] * requests, window=window)
+    elapsed = time.perf_counter() - started
+    client.close()
+    answered = sum(1 for r in results if r and r['status'] == 200)
+    acked = sum(1 for r in results if r and r.get('acked'))
+    return elapsed, answered, acked
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    losses = [float(arg) for arg in sys.argv[2:]] or [0.0, 0.02, 0.05]
+    server = ctsp_server.CTSPServer(port=PORT)
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.3)
+    proxy = LossyProxy(PROXY_PORT, PORT, 0.0)
+
+    failures = 0
+    for loss in losses:
+        proxy.loss = loss
+        goodput = {}
+        for window in (1, WINDOW):
+            elapsed, answered, acked = run(requests, window)
+            goodput[window] = requests / elapsed
+            print(f"loss {loss:.0%} window {window}: {goodput[window]:.0f} req/s "
+                  f"({answered} answered, {acked} confirmed by Ack only, {elapsed:.2f}s)")
+            if answered + acked != requests:
+                failures += 1
+                print(f"  {requests - answered - acked} requests did not complete")
+        if loss > 0 and goodput[WINDOW] <= goodput[1]:
+            failures += 1
+            print(f"  window {WINDOW} was not faster than stop-and-wait")
+    return 0 if failures == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# soak test ของ CTSP11/guide: connection จำนวนมาก ENTER แล้วเงียบหายไปโดยไม่ส่ง FIN
+# heartbeat ต้องปิด connection เหล่านั้น และ session / thread ต้องกลับมาเท่าเดิม ส่วน client ที่ส่ง PING อยู่ต้องใช้งานได้ต่อ
+# รัน: python tests/soak_ctsp11.py [จำนวน connection]
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'CTSP11', 'guide'))
+import server as ctsp_server
+import client as ctsp_client
+
+IDLE_TIMEOUT = 3
+
+def free_port():
+    # connection นับหมื่นที่ถูกปิดค้าง TIME_WAIT บน port เดิม รันซ้ำจึงใช้ port ว่างใหม่ทุกครั้ง
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def silent_peers(port, count):
+    # รันใน process ลูก: ENTER ทุก connection แล้วค้างไว้เฉยๆ ไม่ส่งอะไรและไม่ปิด
+    peers = []
+    for _ in range(count):
+        peer = ctsp_client.CTSPClient(port=port)
+        peer.connect()
+        if peer.enter('Satoshi', 'bitcoin123')['status'] != 200:
+            raise RuntimeError("ENTER failed")
+        peers.append(peer)
+    print("ready", flush=True)
+    time.sleep(3600)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, count + 1024)), hard))
+    port = free_port()
+    server = ctsp_server.CTSPServer(port=port, idle_timeout=IDLE_TIMEOUT)
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.3)
+
+    alive = ctsp_client.CTSPClient(port=port)
+    alive.connect()
+    alive.start_heartbeat(1.0)
+    alive.enter('Vitalik', 'ethereum123')
+    base_threads = threading.active_count()
+    base_sessions = len(server.sessions)
+
+    started = time.perf_counter()
+    peers = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--peers', str(port), str(count)],
+                             stdout=subprocess.PIPE)
+    try:
+        if peers.stdout.readline().strip() != b"ready":
+            print("peer process failed")
+            return 1
+        print(f"{count} connections entered in {time.perf_counter() - started:.1f}s: "
+              f"{len(server.sessions)} sessions, {threading.active_count()} threads")
+
+        deadline = time.time() + IDLE_TIMEOUT * 10
+        while time.time() < deadline and (len(server.sessions) > base_sessions or threading.active_count() > base_threads):
+            time.sleep(0.5)
+        sessions, threads = len(server.sessions), threading.active_count()
+        rank = alive.rank()
+        print(f"after idle timeout: {sessions} sessions (baseline {base_sessions}), "
+              f"{threads} threads (baseline {base_threads}), heartbeat client RANK {rank['status']}")
+        ok = sessions == base_sessions and threads <= base_threads and rank['status'] == 200
+        return 0 if ok else 1
+    finally:
+        peers.kill()
+        alive.close()
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--peers']:
+        silent_peers(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        sys.exit(main())
@@ -0,0 +1,121 @@
+# stress test ของ middle/server.py: client หลายตัวส่งพร้อมกัน มี client เข้าออกตลอด และมี client ที่ไม่อ่านเลย
+# ทุก client ปกติต้องได้ข้อความจากคนอื่นครบ และ server ต้องไม่ตาย
+# รัน: python tests/stress_middle.py [จำนวน client] [ข้อความต่อ client]
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 8082
+TOKEN = re.compile(rb"<(\d+):(\d+)>")
+PADDING = b"." * 400  # ให้ client ที่ไม่อ่านเต็ม buffer ของ kernel จริง
+
+def wait_for_port(port, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server did not open port {port}")
+
+class Receiver:
+    def __init__(self, sock):
+        self.sock = sock
+        self.data = bytearray()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                chunk = self.sock.recv(65536)
+            except OSError:
+                return
+            if not chunk:
+                return
+            self.data += chunk
+
+    def tokens(self):
+        return TOKEN.findall(bytes(self.data))
+
+def churn(stop):
+    # เชื่อมต่อแล้วปิดทันทีวนไปเรื่อยๆ ให้ registry ถูกเพิ่มและลบพร้อมกับ broadcast
+    count = 0
+    while not stop.is_set():
+        try:
+            sock = socket.create_connection(('127.0.0.1', PORT))
+            sock.send(b"churn")
+            sock.close()
+            count += 1
+        except OSError:
+            pass
+        time.sleep(0.002)
+    return count
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'middle', 'server.py')],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        wait_for_port(PORT)
+        stuck = [socket.create_connection(('127.0.0.1', PORT)) for _ in range(3)]  # ไม่อ่านเลย
+        for sock in stuck:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        socks = [socket.create_connection(('127.0.0.1', PORT)) for _ in range(clients)]
+        receivers = [Receiver(sock) for sock in socks]
+        time.sleep(0.2)
+
+        stop = threading.Event()
+        churners = [threading.Thread(target=churn, args=(stop,), daemon=True) for _ in range(4)]
+        for thread in churners:
+            thread.start()
+
+        def send(index, sock):
+            for seq in range(messages):
+                sock.sendall(b"<%d:%d>" % (index, seq) + PADDING)
+                time.sleep(0.01)  # ให้แต่ละ recv(1024) ของ server ได้ข้อความเดียว และไม่เกินที่ server 1 core ส่งทัน
+
+        started = time.perf_counter()
+        senders = [threading.Thread(target=send, args=(i, sock)) for i, sock in enumerate(socks)]
+        for thread in senders:
+            thread.start()
+        for thread in senders:
+            thread.join()
+        stop.set()
+
+        expected = (clients - 1) * messages
+        deadline = time.time() + 30
+        while time.time() < deadline and any(len(r.tokens()) < expected for r in receivers):
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - started
+
+        failures = 0
+        for index, receiver in enumerate(receivers):
+            got = receiver.tokens()
+            from_self = sum(1 for sender, _ in got if int(sender) == index)
+            unique = len(set(got))
+            if from_self or unique != expected or len(got) != expected:
+                failures += 1
+                print(f"client {index}: got {len(got)} ({unique} unique, {from_self} own) expected {expected}")
+        server.poll()
+        alive = server.returncode is None
+        print(f"{clients} clients x {messages} messages, 3 stuck peers, 4 churn threads: "
+              f"{clients * expected} deliveries in {elapsed:.1f}s, failures {failures}, server alive {alive}")
+        for sock in socks + stuck:
+            sock.close()
+        return 0 if failures == 0 and alive else 1
+    finally:
+        server.kill()
+        errors = server.stderr.read().decode(errors='replace')
+        if 'Traceback' in errors:
+            print(errors)
+
+if __name__ == "__main__":
+    sys.exit(main())
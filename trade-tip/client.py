@@ -3,6 +3,14 @@ import json
 import threading
 import hashlib
 import time
+import random
+import itertools
+from collections import deque
+
+RECONNECT_ATTEMPTS = 5
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 8
+REPLAY_QUEUE_SIZE = 32  # คำขอที่ยังไม่ได้คำตอบซึ่งจะส่งซ้ำหลัง reconnect
 
 class TradingClient:
     def __init__(self, host, port):
@@ -11,6 +19,10 @@ class TradingClient:
         self.socket = None
         self.username = None
         self.connected = False
+        self.session_token = None
+        self.replay_queue = deque(maxlen=REPLAY_QUEUE_SIZE)
+        self.order_ids = itertools.count(1)
+        self.client_id = f"{random.getrandbits(64):016x}"
 
     def connect(self):
         try:
@@ -24,155 +36,171 @@ class TradingClient:
 
     def reconnect(self):
         print("Attempting to reconnect...")
-        for _ in range(3):  # Try to reconnect 3 times
+        if self.socket:
+            self.socket.close()
+        for attempt in range(RECONNECT_ATTEMPTS):
             self.connect()
-            if self.connected:
+            if self.connected and self.resume():
                 return True
-            time.sleep(2)  # Wait for 2 seconds before trying again
+            self.connected = False
+            # exponential backoff แบบ full jitter client ที่หลุดพร้อมกันจะไม่กลับมาพร้อมกัน
+            time.sleep(random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt)))
         return False
 
-    def send_message(self, message):
-        if not self.connected:
-            if not self.reconnect():
-                print("Failed to reconnect. Please try again later.")
-                return False
-
-        data = self.create_message(message['type'], self.username, message.get('content', {}))
-        message_length = len(data).to_bytes(4, byteorder='big')
-        try:
-            self.socket.send(message_length + data.encode())
+    def resume(self):
+        # ยืนยันตัวตนบน socket ใหม่ด้วย token แทนการ LOGIN ใหม่ token หมดอายุหรือ server เปลี่ยน secret ค่อย LOGIN
+        if self.username is None:
             return True
-        except BrokenPipeError:
-            print("Connection lost. Attempting to reconnect...")
-            self.connected = False
-            return self.send_message(message)  # Recursive call after reconnection attempt
-        except Exception as e:
-            print(f"Error sending message: {e}")
-            self.connected = False
+        try:
+            if self.session_token:
+                self.send_message({'type': 'RESUME', 'user': self.username, 'content': {'token': self.session_token}})
+                response = self.receive_message()
+                if response['body'].get('status') == 'SUCCESS':
+                    self.session_token = response['body'].get('token')
+                    return True
+            self.send_message({'type': 'LOGIN', 'user': self.username})
+            response = self.receive_message()
+        except (OSError, ValueError) as e:
+            print(f"Failed to resume session: {e}")
             return False
+        if response['body'].get('status') != 'SUCCESS':
+            return False
+        self.session_token = response['body'].get('token')
+        return True
+
+    def request(self, message):
+        # คำขอเข้าคิวก่อนส่ง ถ้าการเชื่อมต่อหลุดกลางทางจะถูกส่งซ้ำตามลำดับหลัง reconnect
+        if len(self.replay_queue) == self.replay_queue.maxlen:
+            print(f"Replay queue full, dropping {self.replay_queue[0]['type']} request")
+        self.replay_queue.append(message)
+        if not self.connected and not self.reconnect():
+            print("Failed to reconnect. Request queued for the next connection.")
+            return None
 
-    def receive_message(self):
-        if not self.connected:
-            if not self.reconnect():
-                print("Failed to reconnect. Please try again later.")
-                return None
+        response = None
+        while self.replay_queue:
+            try:
+                self.send_message(self.replay_queue[0])
+                response = self.receive_message()
+            except (OSError, ValueError) as e:
+                print(f"Connection lost: {e}")
+                self.connected = False
+                if not self.reconnect():
+                    print("Failed to reconnect. Request queued for the next connection.")
+                    return None
+                continue
+            self.replay_queue.popleft()
+        return response
 
-        try:
-            message_length = int.from_bytes(self.socket.recv(4), byteorder='big')
-            message_data = self.socket.recv(message_length).decode()
-            return self.parse_message(message_data)
-        except ConnectionResetError:
-            print("Connection reset by server. Attempting to reconnect...")
-            self.connected = False
-            if self.reconnect():
-                return self.receive_message()  # Recursive call after reconnection
-            return None
-        except Exception as e:
-            print(f"Error receiving message: {e}")
-            self.connected = False
-            return None
+    def send_message(self, message):
+        header, body = self.create_message(message).split('\n', 1)
+        header = header.encode()
+        self.socket.sendall(len(header).to_bytes(4, byteorder='big') + header + body.encode())
+
+    def receive_message(self):
+        header = json.loads(self._recv_exact(int.from_bytes(self._recv_exact(4), byteorder='big')).decode())
+        body = self._recv_exact(header['length']).decode()
+        return {'header': header, 'body': self.parse_message(f"{json.dumps(header)}\n{body}")}
+
+    def _recv_exact(self, size):
+        # recv_into ต่อท้าย bytearray ที่จองไว้ ไม่ต่อ bytes ทีละ chunk (response ของ GET_CANDLES ใหญ่ได้)
+        data = bytearray(size)
+        view = memoryview(data)
+        received = 0
+        while received < size:
+            count = self.socket.recv_into(view[received:])
+            if not count:
+                raise ConnectionError("Connection closed by server")
+            received += count
+        return bytes(data)
 
     @staticmethod
-    def create_message(msg_type, user, content):
-        header = json.dumps({'type': msg_type, 'user': user})
-        body = json.dumps(content)
-        combined = f"{header}\n{body}"
-        checksum = hashlib.md5(combined.encode()).hexdigest()
-        return f"{header}\n{body}\n{checksum}"
+    def create_message(message):
+        body = json.dumps(message)
+        checksum = hashlib.md5(body.encode()).hexdigest()
+        header = json.dumps({'length': len(body.encode()), 'checksum': checksum})
+        return f"{header}\n{body}"
 
     @staticmethod
     def parse_message(data):
-        try:
-            # Try to parse as JSON first
-            parsed_data = json.loads(data)
-            return {'header': {'type': 'RESPONSE'}, 'body': parsed_data}
-        except json.JSONDecodeError:
-            # If it's not JSON, try to split it into parts
-            parts = data.split('\n', 2)
-            if len(parts) == 3:
-                header, body, received_checksum = parts
-                try:
-                    header = json.loads(header)
-                    body = json.loads(body)
-                    combined = f"{json.dumps(header)}\n{json.dumps(body)}"
-                    calculated_checksum = hashlib.md5(combined.encode()).hexdigest()
-                    
-                    if calculated_checksum != received_checksum:
-                        print("Warning: Checksum mismatch")
-                    
-                    return {'header': header, 'body': body}
-                except json.JSONDecodeError:
-                    pass  # If parsing fails, fall through to the default case
-            
-            # If all else fails, wrap the raw data in a JSON structure
-            return {
-                'header': {'type': 'UNKNOWN'},
-                'body': {'message': data.strip() if data.strip() else 'Empty response'}
-            }
+        header, body = data.split('\n', 1)
+        header = json.loads(header)
+        if hashlib.md5(body.encode()).hexdigest() != header['checksum']:
+            raise ValueError("Checksum mismatch")
+        return json.loads(body)
 
     def register(self, username):
-        if self.send_message({'type': 'REGISTER', 'user': username}):
-            response = self.receive_message()
-            if response:
-                print(response['body'].get('message', 'Unknown response'))
-                if response['body'].get('status') == 'SUCCESS':
-                    self.username = username
+        response = self.request({'type': 'REGISTER', 'user': username})
+        if response:
+            print(response['body'].get('message', 'Unknown response'))
+            if response['body'].get('status') == 'SUCCESS':
+                self.username = username
 
     def login(self, username):
-        if self.send_message({'type': 'LOGIN', 'user': username}):
-            response = self.receive_message()
-            if response:
-                print(response['body'].get('message', 'Unknown response'))
-                if response['body'].get('status') == 'SUCCESS':
-                    self.username = username
+        response = self.request({'type': 'LOGIN', 'user': username})
+        if response:
+            print(response['body'].get('message', 'Unknown response'))
+            if response['body'].get('status') == 'SUCCESS':
+                self.username = username
+                self.session_token = response['body'].get('token')
 
     def logout(self):
-        if self.send_message({'type': 'LOGOUT', 'user': self.username}):
-            response = self.receive_message()
-            if response:
-                print(response['body'].get('message', 'Unknown response'))
-                self.username = None
+        response = self.request({'type': 'LOGOUT', 'user': self.username})
+        if response:
+            print(response['body'].get('message', 'Unknown response'))
+            self.username = None
+            self.session_token = None
 
     def get_balance(self):
-        if self.send_message({'type': 'BALANCE', 'user': self.username}):
-            response = self.receive_message()
-            if response:
-                if response['body'].get('status') == 'SUCCESS':
-                    print("Your balance:")
-                    for currency, amount in response['body'].get('balance', {}).items():
-                        print(f"{currency}: {amount}")
-                else:
-                    print(response['body'].get('message', 'Unknown response'))
+        response = self.request({'type': 'BALANCE', 'user': self.username})
+        if response:
+            if response['body'].get('status') == 'SUCCESS':
+                print("Your balance:")
+                for currency, amount in response['body'].get('balance', {}).items():
+                    print(f"{currency}: {amount}")
+            else:
+                print(response['body'].get('message', 'Unknown response'))
 
     def place_order(self, order_type, crypto, amount, price):
         content = {
             'order_type': order_type,
             'crypto': crypto,
             'amount': float(amount),
-            'price': float(price)
+            'price': float(price),
+            # server ใช้ order_id ตัด order ที่ถูก replay ซ้ำหลัง reconnect
+            'order_id': f"{self.client_id}-{next(self.order_ids)}"
         }
-        if self.send_message({'type': 'ORDER', 'user': self.username, 'content': content}):
-            response = self.receive_message()
-            if response:
-                print(response['body'].get('message', 'Unknown response'))
+        response = self.request({'type': 'ORDER', 'user': self.username, 'content': content})
+        if response:
+            print(response['body'].get('message', 'Unknown response'))
 
     def get_market_data(self):
-        if self.send_message({'type': 'MARKET_DATA', 'user': self.username}):
-            response = self.receive_message()
-            if response:
-                if response['body'].get('status') == 'SUCCESS':
-                    print("Current market data:")
-                    for crypto, price in response['body'].get('market_data', {}).items():
-                        print(f"{crypto}: ${price:.2f}")
-                else:
-                    print(response['body'].get('message', 'Unknown response'))
+        response = self.request({'type': 'MARKET_DATA', 'user': self.username})
+        if response:
+            if response['body'].get('status') == 'SUCCESS':
+                print("Current market data:")
+                for crypto, price in response['body'].get('market_data', {}).items():
+                    print(f"{crypto}: ${price:.2f}")
+            else:
+                print(response['body'].get('message', 'Unknown response'))
+
+    def get_candles(self, crypto, interval='1m', limit=20):
+        content = {'crypto': crypto, 'interval': interval, 'limit': limit}
+        response = self.request({'type': 'GET_CANDLES', 'user': self.username, 'content': content})
+        if response:
+            if response['body'].get('status') == 'SUCCESS':
+                print(f"{crypto} {interval} candles (time open high low close volume):")
+                for candle_time, open_price, high, low, close, volume in response['body'].get('candles', []):
+                    print(f"{time.strftime('%H:%M:%S', time.localtime(candle_time))} {open_price:.2f} {high:.2f} {low:.2f} {close:.2f} {volume:g}")
+            else:
+                print(response['body'].get('message', 'Unknown response'))
 
 def main():
     client = TradingClient('localhost', 5001)
     client.connect()
 
     while True:
-        command = input("Enter command (register/login/logout/balance/buy/sell/market/exit): ").lower()
+        command = input("Enter command (register/login/logout/balance/buy/sell/market/candles/exit): ").lower()
 
         if command == 'exit':
             break
@@ -193,6 +221,10 @@ def main():
             client.place_order(command.upper(), crypto, amount, price)
         elif command == 'market':
             client.get_market_data()
+        elif command == 'candles':
+            crypto = input("Enter crypto (A/B/C): ").upper()
+            interval = input("Enter interval (1s/1m/1h): ")
+            client.get_candles(crypto, interval)
         else:
             print("Invalid command. Please try again.")
 
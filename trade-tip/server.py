@@ -1,40 +1,110 @@
 import socket
 import threading
-import json
+import math
 import time
-import random
 import hashlib
+import hmac
+import base64
+import os
+import sys
+from collections import OrderedDict
+from typing import TypedDict, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.market import CandleStore, MarketSimulator, parse_candle_query
+from common.auth import is_admin_token
+from common.codec import codec
+from common.profiler import PROFILE_INTERVAL, SamplingProfiler
+
+PRICE_TICK_INTERVAL = 5  # วินาทีต่อ tick ไม่ขึ้นกับจำนวนเหรียญ
+
+FrameHeader = TypedDict('FrameHeader', {'length': int, 'checksum': str})
+RequestBase = TypedDict('RequestBase', {'type': str, 'user': Optional[str]})
+
+class Request(RequestBase, total=False):
+    content: dict
+
+decode_header = codec.decoder(FrameHeader)
+decode_request = codec.decoder(Request)
+
+MAX_HEADER_SIZE = 1024  # header มีแค่ length กับ checksum ไม่ถึง 100 bytes
+MAX_MESSAGE_SIZE = 64 * 1024  # ORDER / GET_CANDLES ยังไม่ถึง 1 KB
 
 # Utility functions
 def calculate_checksum(data):
-    return hashlib.md5(data.encode()).hexdigest()
-
-def create_message(msg_type, user, content):
-    body = json.dumps({'type': msg_type, 'user': user, 'content': content})
-    checksum = calculate_checksum(body)
-    header = json.dumps({'length': len(body), 'checksum': checksum})
-    return f"{header}\n{body}"
-
-def parse_message(data):
-    header, body = data.split('\n', 1)
-    header = json.loads(header)
-    body = json.loads(body)
-    
-    if calculate_checksum(body) != header['checksum']:
+    return hashlib.md5(data).hexdigest()
+
+def create_message(message):
+    # คืน (header, body) เป็น bytes ทั้งคู่ checksum คิดจาก bytes ของ body ที่ส่งจริง
+    body = codec.encode(message)
+    header = codec.encode({'length': len(body), 'checksum': calculate_checksum(body)})
+    return header, body
+
+def parse_message(header, body):
+    if calculate_checksum(body) != header.get('checksum'):
         raise ValueError("Checksum mismatch")
-    
-    return body
+    return decode_request(body)
+
+def recv_exact(sock, size):
+    # จองที่ครั้งเดียวแล้ว recv_into ต่อท้าย ไม่ต่อ bytes ทีละ chunk ซึ่งเป็น O(n^2) เมื่อข้อความใหญ่
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            return None
+        received += count
+    return bytes(data)
+
+# Session token
+SESSION_SECRET = os.environ.get('TRADE_TIP_SECRET', '').encode() or os.urandom(32)  # ตั้งค่าเดียวกันทุกเครื่องถ้ารันหลาย server
+SESSION_TTL = 60 * 60
+ORDER_HISTORY_SIZE = 256  # order_id ล่าสุดต่อผู้ใช้ที่จำไว้กันการ replay ซ้ำ
+ADMIN_TOKEN = os.environ.get('TRADE_TIP_ADMIN_TOKEN', '')  # PROFILE ต้องส่ง admin_token ตรงกับค่านี้ ไม่ตั้งก็ปิด PROFILE
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def issue_token(username, ttl=SESSION_TTL):
+    # token = payload.signature ตรวจได้ด้วย HMAC อย่างเดียว server ไม่ต้องเก็บ session
+    expires = int(time.time() + ttl)
+    payload = codec.encode({'user': username, 'exp': expires})
+    signature = hmac.new(SESSION_SECRET, payload, hashlib.sha256).digest()
+    return f"{_b64encode(payload)}.{_b64encode(signature)}", expires
+
+def verify_token(token):
+    try:
+        payload, signature = (_b64decode(part) for part in token.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(hmac.new(SESSION_SECRET, payload, hashlib.sha256).digest(), signature):
+        return None
+    session = codec.decode(payload)
+    if session['exp'] < time.time():
+        return None
+    return session['user']
 
 # Server
 class TradingServer:
-    def __init__(self, host, port):
+    def __init__(self, host, port, simulator=None):
         self.host = host
         self.port = port
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.clients = {}  # {client_socket: username}
+        self.executed_orders = {}  # {username: OrderedDict(order_id: response)}
+        self.orders_lock = threading.Lock()  # replay ที่มาพร้อมกันจากสอง socket ต้องเห็น order_id ที่อีกฝั่งเพิ่งทำ
         self.balances = {}  # {username: {'A': 100, 'B': 100, 'C': 100, 'USD': 10000}}
-        self.market_data = {'A': 10, 'B': 20, 'C': 30}  # Initial prices
+        # ส่ง simulator ของตัวเองเข้ามาได้ เช่น MarketSimulator.generate(5000, seed=1) ตอน load test
+        self.simulator = simulator or MarketSimulator({'A': 10, 'B': 20, 'C': 30})  # Initial prices
+        self.market_data = self.simulator.prices()
         self.orders = []  # List of active orders
+        self.profiler = SamplingProfiler()
+        self.candles = CandleStore(self.market_data)
+        self.candles.add_ticks(self.market_data)
 
     def start(self):
         self.server_socket.bind((self.host, self.port))
@@ -67,28 +137,46 @@ class TradingServer:
         client_socket.close()
 
     def receive_message(self, client_socket):
-        header_length = int.from_bytes(client_socket.recv(4), byteorder='big')
-        header = client_socket.recv(header_length).decode()
-        header = json.loads(header)
-        
-        body = client_socket.recv(header['length']).decode()
-        
+        # ความยาวทั้งสองชั้นมาจาก peer ต้องตรวจก่อนจองที่ตามนั้น ข้อความที่ผิดปิด connection เพราะตัด frame ต่อไม่ได้แล้ว
+        prefix = recv_exact(client_socket, 4)
+        if not prefix:
+            return None
         try:
-            return parse_message(f"{json.dumps(header)}\n{body}")
-        except ValueError:
-            print("Received message with invalid checksum")
+            header_size = int.from_bytes(prefix, byteorder='big')
+            if header_size > MAX_HEADER_SIZE:
+                raise ValueError(f"Header limited to {MAX_HEADER_SIZE} bytes")
+            header = recv_exact(client_socket, header_size)
+            if header is None:
+                return None
+            header = decode_header(header)
+            length = header.get('length') if isinstance(header, dict) else None
+            if not isinstance(length, int) or isinstance(length, bool) or not 0 <= length <= MAX_MESSAGE_SIZE:
+                raise ValueError(f"Message length must be 0-{MAX_MESSAGE_SIZE} bytes")
+
+            body = recv_exact(client_socket, length)
+            if body is None:
+                return None
+            return parse_message(header, body)
+        except ValueError as e:
+            print(f"Received invalid message: {e}")
             return None
 
     def send_message(self, client_socket, message):
-        data = create_message(message['type'], message.get('user', ''), message.get('content', {}))
-        header_length = len(data.split('\n')[0]).to_bytes(4, byteorder='big')
-        client_socket.send(header_length + data.encode())
+        # content ถูกแผ่ลงใน body เดียวกับ status/message ตามที่ client อ่าน
+        body = {key: value for key, value in message.items() if key != 'content'}
+        body.update(message.get('content', {}))
+        header, data = create_message(body)
+        client_socket.sendall(len(header).to_bytes(4, byteorder='big') + header + data)
 
     def process_message(self, client_socket, message):
         msg_type = message['type']
         username = message['user']
         content = message.get('content', {})
 
+        # คำสั่งที่แตะบัญชีต้องมาจาก socket ที่ LOGIN หรือ RESUME แล้วเท่านั้น
+        if msg_type in ('BALANCE', 'ORDER') and self.clients.get(client_socket) != username:
+            return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Not logged in'}
+
         if msg_type == 'REGISTER':
             if username not in self.balances:
                 self.balances[username] = {'A': 100, 'B': 100, 'C': 100, 'USD': 10000}
@@ -98,7 +186,17 @@ class TradingServer:
 
         elif msg_type == 'LOGIN':
             self.clients[client_socket] = username
-            return {'type': 'RESPONSE', 'status': 'SUCCESS', 'message': 'Logged in successfully'}
+            token, expires = issue_token(username)
+            return {'type': 'RESPONSE', 'status': 'SUCCESS', 'message': 'Logged in successfully', 'content': {'token': token, 'expires': expires}}
+
+        elif msg_type == 'RESUME':
+            # ต่อ session เดิมบน socket ใหม่หลัง reconnect ไม่ต้อง LOGIN ซ้ำ
+            resumed = verify_token(content.get('token'))
+            if resumed is None or resumed != username:
+                return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Invalid or expired session'}
+            self.clients[client_socket] = username
+            token, expires = issue_token(username)
+            return {'type': 'RESPONSE', 'status': 'SUCCESS', 'message': 'Session resumed', 'content': {'token': token, 'expires': expires}}
 
         elif msg_type == 'LOGOUT':
             if client_socket in self.clients:
@@ -112,39 +210,105 @@ class TradingServer:
                 return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'User not found'}
 
         elif msg_type == 'ORDER':
-            order_type = content['order_type']
-            crypto = content['crypto']
-            amount = content['amount']
-            price = content['price']
-
-            if username not in self.balances:
-                return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'User not found'}
-
-            if order_type == 'BUY':
-                if self.balances[username]['USD'] < amount * price:
-                    return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Insufficient USD balance'}
-                self.balances[username]['USD'] -= amount * price
-                self.balances[username][crypto] += amount
-            elif order_type == 'SELL':
-                if self.balances[username][crypto] < amount:
-                    return {'type': 'RESPONSE', 'status': 'ERROR', 'message': f'Insufficient {crypto} balance'}
-                self.balances[username]['USD'] += amount * price
-                self.balances[username][crypto] -= amount
-
-            return {'type': 'RESPONSE', 'status': 'SUCCESS', 'message': f'{order_type} order executed successfully'}
+            # order ที่ client replay หลัง reconnect อาจถูกทำไปแล้ว ตอบผลเดิมแทนการทำซ้ำ
+            # ผลที่เป็น ERROR ก็เก็บไว้ด้วย replay ของ order ที่ถูกปฏิเสธจะได้คำตอบเดิม ไม่ถูกทำใหม่ทีหลัง
+            order_id = content.get('order_id')
+            if order_id is not None and not isinstance(order_id, str):
+                return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'order_id must be a string'}
+            with self.orders_lock:
+                executed = self.executed_orders.setdefault(username, OrderedDict())
+                if order_id is not None and order_id in executed:
+                    return executed[order_id]
+                response = self._execute_order(username, content)
+                if order_id is not None:
+                    executed[order_id] = response
+                    if len(executed) > ORDER_HISTORY_SIZE:
+                        executed.popitem(last=False)
+            return response
 
         elif msg_type == 'MARKET_DATA':
             return {'type': 'RESPONSE', 'status': 'SUCCESS', 'content': {'market_data': self.market_data}}
 
+        elif msg_type == 'GET_CANDLES':
+            try:
+                crypto, interval, start, end, limit = parse_candle_query(content, self.market_data, 'crypto')
+            except ValueError as e:
+                return {'type': 'RESPONSE', 'status': 'ERROR', 'message': str(e)}
+            candles = self.candles.query(crypto, interval, start, end, limit)
+            return {'type': 'RESPONSE', 'status': 'SUCCESS', 'content': {
+                'crypto': crypto,
+                'interval': interval,
+                'fields': ['time', 'open', 'high', 'low', 'close', 'volume'],
+                'candles': candles
+            }}
+
+        elif msg_type == 'PROFILE':
+            if not is_admin_token(content.get('admin_token'), ADMIN_TOKEN):
+                return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Admin token required'}
+            action = content.get('action', 'status')
+            if action == 'start':
+                try:
+                    duration = float(content.get('duration', 30))
+                    interval = float(content.get('interval_ms', PROFILE_INTERVAL * 1000)) / 1000
+                    started = self.profiler.start(duration, interval, bool(content.get('memory', False)))
+                except (TypeError, ValueError):
+                    return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'duration and interval_ms must be positive numbers'}
+                if not started:
+                    return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Profiler already running'}
+                return {'type': 'RESPONSE', 'status': 'SUCCESS', 'message': 'Profiler started'}
+            elif action == 'stop':
+                result = self.profiler.stop()
+                if result is None:
+                    return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Profiler has not run'}
+                return {'type': 'RESPONSE', 'status': 'SUCCESS', 'content': result}
+            elif action == 'status':
+                return {'type': 'RESPONSE', 'status': 'SUCCESS', 'content': {'running': self.profiler.running(), 'result': self.profiler.result}}
+            else:
+                return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Invalid action, use start, stop or status'}
+
         else:
             return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Invalid message type'}
 
+    def _execute_order(self, username, content):
+        order_type = content.get('order_type')
+        crypto = content.get('crypto')
+        amount = content.get('amount')
+        price = content.get('price')
+
+        # ตรวจทุกช่องก่อนแตะยอดเงิน order ที่ผิดจะได้ไม่เหลือยอดที่เปลี่ยนไปครึ่งทาง
+        if username not in self.balances:
+            return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'User not found'}
+        if order_type not in ('BUY', 'SELL'):
+            return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Invalid order type, use BUY or SELL'}
+        if crypto not in self.market_data:
+            return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Invalid crypto'}
+        if not all(type(value) in (int, float) and value > 0 and math.isfinite(value) for value in (amount, price)):
+            return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Amount and price must be positive numbers'}
+
+        if order_type == 'BUY':
+            if self.balances[username]['USD'] < amount * price:
+                return {'type': 'RESPONSE', 'status': 'ERROR', 'message': 'Insufficient USD balance'}
+            self.balances[username]['USD'] -= amount * price
+            self.balances[username][crypto] = self.balances[username].get(crypto, 0) + amount
+        elif order_type == 'SELL':
+            if self.balances[username].get(crypto, 0) < amount:
+                return {'type': 'RESPONSE', 'status': 'ERROR', 'message': f'Insufficient {crypto} balance'}
+            self.balances[username]['USD'] += amount * price
+            self.balances[username][crypto] -= amount
+
+        # ราคาใน order มาจาก client จึงนับแค่ volume ที่ราคาตลาดปัจจุบัน
+        self.candles.add_tick(crypto, self.market_data[crypto], amount)
+        return {'type': 'RESPONSE', 'status': 'SUCCESS', 'message': f'{order_type} order executed successfully'}
+
     def simulate_market(self):
+        # นับเวลาจาก deadline ของ tick ก่อน เวลาที่ใช้คำนวณจึงไม่ทำให้ tick ช้าลงเมื่อมีเหรียญมากขึ้น
+        next_tick = time.monotonic()
         while True:
-            for crypto in self.market_data:
-                change = random.uniform(-0.5, 0.5)
-                self.market_data[crypto] *= (1 + change)
-            time.sleep(5)  # Update every 5 seconds
+            prices = self.simulator.step()
+            self.market_data.update(prices)
+            self.candles.add_ticks(prices)
+            next_tick += PRICE_TICK_INTERVAL
+            time.sleep(max(0.0, next_tick - time.monotonic()))
 
 # Usage
 if __name__ == "__main__":